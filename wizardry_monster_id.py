@@ -48,7 +48,8 @@ PRIESTS were actually LVL 5 PRIESTS, and the MAN IN LEATHER was actually a MASTE
 monster entities with name "MASTER THIEF" the suffix "(lo)" indicates that the lower level variety of master thief
 was what was involved.)
 
-This program requires the presence of these two data files in the working directory:
+This program requires these two data files, which it reads from its own directory (or from the directory named by the
+environment variable WIZARDRY_MONSTER_ID_DATA), whatever the working directory is:
 - monsters.json
 - unidentified_groups.json
 
@@ -159,12 +160,17 @@ The first 2 cases total to 36300 xp  and the last one totals to 36305 .. all of
 Potentially, the monster picture (shown for the first group of monsters in the encounter) might disambiguate.
 (The images for trolls, gorgons, and gaze hounds all differ even though they are all "Strange Animals", but
 hatamotos, arch mages, and lvl 7 mages all use the same image. Behavior in battle may also help (spells cast).)
+When the strange animals were the first group, their picture can be given in the query with special code "i" right after
+their term (example user input : 4pri6mir3mia7sa10i6050x6c for the gorgon picture), and monsters which were ruled out
+otherwise can be excluded by pinning a group to the others (example user input : 4pri6mir=aml/h3mia7sa6050x6c).
 Some of these cases (such as the example above) will never occur. If you examine which monsters can
 possibly co-occur, any encounter with gaze hounds will only include gaze hounds (no other monsters)
 so assignment 3 is not possible. Similarly, enounters which include trolls will only include other trolls
 or must include an ogre lord. So assignment 1 is not possible. Assignment 2 is more plausible, but
 when arch mages are present, they must co-occur only with {High Wizard, Champ Samurai, Master Thief, Chimera}
 so assignment 2 is actually not possible either.
+Running with the --co-occur option applies these co-occurrence rules during the search, and reports that no
+assignment is possible for this example.
 An acutal case which occurred in practice was the encounter in the monster allocation center (example
 user input : 2pri2mir1kim1600x5c), had two valid outputs based on the experience points being split
 between 5 surviving party members:
@@ -172,6 +178,7 @@ between 5 surviving party members:
  - 1 high ninja (1600xp), 2 lvl 7 mage (lo)/(sp) (2 * 1000xp), 2 high priest (sp) (2 * 2200xp)
 Both cases total to 8000xp. (To be honest, the game informed on the actual identity of
 the high ninja immediately and all monsters by the end of the encounter, but it makes an illustrative case)
+Every such ambiguous input of up to 3 groups is listed by build-atlas (see the ambiguity atlas below).
 
 Co-occurrence problems:
 Some of the monsters in an unidentified group trigger co-occurence of other monsters in that group.
@@ -180,8 +187,8 @@ not how many from each distinct duplicate group. Example : 3 small humanoids (ac
 5 small humanoids (actually kobolds) are encountered. In the first round two small humanoids flee before
 makanito eliminates all monsters. User will not know whether both of the fleeing monsters fled from
 the same group, or what group/groups they fled from. They will only know that a total of 6 small humanoids
-were killed. To find the solution, the program would need to explore all divisions of the 6 small humanoids
-into two subgroups (possible future improvement). With insects, there can be three different monsters of type
+were killed. To find the solution, the program needs to explore all divisions of the 6 small humanoids
+into two subgroups, which it does when run with the --split option. With insects, there can be three different monsters of type
 insect encountered at once (in up to 4 INSECT groups). Here are all actual trigger paths:
 ani : dragon puppy, killer wolf (KW->DP) [observed]
 ins : boring beetle, giant spider, huge spider (BB->HS) (HS->BB) (GS->HS->BB)
@@ -202,10 +209,13 @@ Some of these cases may be handled by making educated guesses about the counts o
 killed and using the program to verify the validity of those guesses.
 '''
 
-import json
-import re
-import string
+import bisect
+import itertools
+import os
+import stat
+import struct
 import sys
+import time
 
 class InvalidKeyError(Exception):
     def __init__(self, msg):
@@ -219,11 +229,29 @@ class DuplicateKeyError(Exception):
     def __init__(self, msg):
         super().__init__(msg)
 
+'''
+position is the offset of the problem within the query (None when the problem is not at one place), and statistics the
+SearchStatistics of the query when it was given to an Identifier collecting them (see Identifier.identify)
+'''
+class InvalidQueryError(Exception):
+    def __init__(self, msg, position=None):
+        super().__init__(msg)
+        self.position = position
+        self.statistics = None
+
+class InvalidOptionError(Exception):
+    def __init__(self, msg):
+        super().__init__(msg)
+
+class StaleIndexError(Exception):
+    def __init__(self, msg):
+        super().__init__(msg)
+
 class MonsterGroup:
     def __init__(self, dup_group_count, total_monster_count, group_code):
         self.dup_group_count = dup_group_count
         self.total_monster_count = total_monster_count
-        sef.group_code = group_code
+        self.group_code = group_code
 
 def show_usage():
     sys.stdout.write('wizardry_monster_id.py  Copyright (C) 2023 github user bassajack1\n')
@@ -238,22 +266,156 @@ def show_usage():
     sys.stdout.write('      where code is a recognized monster code or unidentified\n')
     sys.stdout.write('      group code (see "codes" option below) or is special code\n')
     sys.stdout.write('      "c" to indicate how many of your party characters ended\n')
-    sys.stdout.write('      the encounter in a non-disabled state (default: 6)\n')
+    sys.stdout.write('      the encounter in a non-disabled state (default: 6), or a\n')
+    sys.stdout.write('      range of counts such as 4-6c when that is not known exactly\n')
+    sys.stdout.write('      (the assignments are then shown for each party size)\n')
     sys.stdout.write('      XP_TERM uses sepecial code "x" to indicate experience\n')
-    sys.stdout.write('      points given "TO EACH SURVIVOR".\n')
+    sys.stdout.write('      points given "TO EACH SURVIVOR", or a range of points such\n')
+    sys.stdout.write('      as 2100-2140x when that was not read exactly (the xp of\n')
+    sys.stdout.write('      each assignment is then shown). When no assignment gives\n')
+    sys.stdout.write('      the experience points, the nearest experience points\n')
+    sys.stdout.write('      which have one are shown.\n')
     sys.stdout.write('      Otherwise, all counts should specify the total of each\n')
     sys.stdout.write('      monster type killed (excluding those dissoved or fled).\n')
+    sys.stdout.write('      The term of the group whose picture was shown (the first\n')
+    sys.stdout.write('      group of the encounter) may be followed by the number of\n')
+    sys.stdout.write('      that picture with special code "i", such as 7sa15i (see\n')
+    sys.stdout.write('      the picture integers in the comments of this program),\n')
+    sys.stdout.write('      and a group term may be pinned to the only monsters it\n')
+    sys.stdout.write('      can still be, such as 7sa=ch/gg. Both rule out the other\n')
+    sys.stdout.write('      monsters of the group before the search.\n')
     sys.stdout.write('      Note: whitespace between TERMs is optional\n')
+    sys.stdout.write('      Encounters whose experience points were only read for a\n')
+    sys.stdout.write('      whole run of them may be given together, separated by ",",\n')
+    sys.stdout.write('      each with its own TERMs and "c", and a single XP_TERM for\n')
+    sys.stdout.write('      the run (points gained by a character who survived every\n')
+    sys.stdout.write('      encounter), such as 5pri1mil,4pri6mir5c,1534x. The\n')
+    sys.stdout.write('      joint assignments (one assignment per encounter) are shown.\n')
+    sys.stdout.write('      Options (may be given anywhere on the command line):\n')
+    sys.stdout.write('      --co-occur  only report assignments whose monsters can\n')
+    sys.stdout.write('                  all occur in one encounter (following the\n')
+    sys.stdout.write('                  co_occur_keys chains of monsters.json)\n')
+    sys.stdout.write('      --split     also consider that the count of a group may be\n')
+    sys.stdout.write('                  divided among several monsters of that group which\n')
+    sys.stdout.write('                  can occur together (example: 6sh325x is 3 kobolds\n')
+    sys.stdout.write('                  and 3 orcs)\n')
+    sys.stdout.write('      --index FILE  answer from a solution index written by\n')
+    sys.stdout.write('                  build-index (queries outside of the index are\n')
+    sys.stdout.write('                  still answered by searching)\n')
+    sys.stdout.write('      --numpy     search with the vectorized numpy engine (the pure\n')
+    sys.stdout.write('                  python search is used when numpy is not installed)\n')
+    sys.stdout.write('      --limit N   stop the search once more than N assignments are\n')
+    sys.stdout.write('                  found and show only the first N\n')
+    sys.stdout.write('      --unique    same as --limit 1 : only tells whether the\n')
+    sys.stdout.write('                  assignment is unique (and shows it) or ambiguous\n')
+    sys.stdout.write('      --any-party-size  a query without a "c" term may have any\n')
+    sys.stdout.write('                  party size from 1 to 6 (as if it ended with 1-6c)\n')
+    sys.stdout.write('      --cache-size N  keep the results of the last N distinct\n')
+    sys.stdout.write('                  queries (default: 4096 for batch, serve and\n')
+    sys.stdout.write('                  analyze, 0 turns the cache off). Queries differing\n')
+    sys.stdout.write('                  only in the order of their terms share one result.\n')
+    sys.stdout.write('      --cache-file FILE  load the cache from FILE and save it back\n')
+    sys.stdout.write('                  at exit, so results survive between runs\n')
+    sys.stdout.write('      --cache-stats  write cache hit/miss/eviction counters to\n')
+    sys.stdout.write('                  standard error at exit\n')
+    sys.stdout.write('      --stats     write the time spent loading, parsing, searching and\n')
+    sys.stdout.write('                  writing output, and the search work (nodes visited,\n')
+    sys.stdout.write('                  leaves tested, branches pruned, solutions) to\n')
+    sys.stdout.write('                  standard error at exit. batch and serve records also\n')
+    sys.stdout.write('                  hold the statistics of each query.\n')
+    sys.stdout.write('      --stats-format FORMAT  text (default) or json\n')
+    sys.stdout.write('      --profile FILE  save a cProfile profile of the run to FILE (read\n')
+    sys.stdout.write('                  it with python3 -m pstats FILE)\n')
+    sys.stdout.write('      --profile-per-query  with batch, profile each query on its own\n')
+    sys.stdout.write('                  and save it to FILE.<line number> instead\n')
     sys.stdout.write(' wizardry_monster_id.py codes\n')
     sys.stdout.write('      shows unidentified group code and monster code lists\n')
     sys.stdout.write(' wizardry_monster_id.py groups\n')
     sys.stdout.write('      shows detailed information about all unidentified groups\n')
     sys.stdout.write('      such as possible monsters in groups and ambiguities.\n')
+    sys.stdout.write(' wizardry_monster_id.py batch [OPTION ...] [--jobs N] [FILE]\n')
+    sys.stdout.write('      reads one encounter query per line from FILE (or from\n')
+    sys.stdout.write('      standard input if FILE is omitted or "-") and writes one\n')
+    sys.stdout.write('      JSON result record per query line. Blank lines and lines\n')
+    sys.stdout.write('      starting with "#" are skipped. A query which cannot be\n')
+    sys.stdout.write('      parsed yields an "error" record and the batch continues.\n')
+    sys.stdout.write('      The options above apply to every query of the batch.\n')
+    sys.stdout.write('      --jobs N    identify the queries in N worker processes (0: one\n')
+    sys.stdout.write('                  per processor), each loading the data once. Records\n')
+    sys.stdout.write('                  are still written in input order unless --unordered\n')
+    sys.stdout.write('                  is given. --chunk-size N (default 64) query lines are\n')
+    sys.stdout.write('                  sent to a worker at a time. Each worker has its own\n')
+    sys.stdout.write('                  cache, so --cache-file, --cache-stats and --profile\n')
+    sys.stdout.write('                  do not apply.\n')
+    sys.stdout.write(' wizardry_monster_id.py serve [OPTION ...] [--socket PATH]\n')
+    sys.stdout.write('      keeps the data loaded and answers requests, one per line, on\n')
+    sys.stdout.write('      the unix domain socket PATH (several clients may connect at\n')
+    sys.stdout.write('      once) or else on standard input/output. A request is a plain\n')
+    sys.stdout.write('      query or a JSON object {"id": ..., "query": "..."}; each\n')
+    sys.stdout.write('      response is one JSON record as written by batch (with the\n')
+    sys.stdout.write('      request "id"). The options above apply to every request.\n')
+    sys.stdout.write('      The request {"command": "cache-stats"} returns the cache counters,\n')
+    sys.stdout.write('      and {"command": "stats"} the statistics so far (with --stats).\n')
+    sys.stdout.write(' wizardry_monster_id.py track [OPTION ...] [FILE]\n')
+    sys.stdout.write('      follows an encounter in progress from its events, one per\n')
+    sys.stdout.write('      line from FILE or standard input : +3sa (3 more kills of a\n')
+    sys.stdout.write('      group or monster, -1sa takes one back), sa=ch (the group was\n')
+    sys.stdout.write('      identified as that monster), 2100x (the experience points\n')
+    sys.stdout.write('      awarded) and 5c (the survivors). After each event, one JSON\n')
+    sys.stdout.write('      record gives the candidate monsters of each group and, once\n')
+    sys.stdout.write('      the experience points are known, the assignments as batch\n')
+    sys.stdout.write('      does. An event only updates the group it changes. A line\n')
+    sys.stdout.write('      "new" starts another encounter.\n')
+    sys.stdout.write(' wizardry_monster_id.py analyze [OPTION ...] [--ambiguity-policy POLICY]\n')
+    sys.stdout.write('                  [--format FORMAT] [FILE]\n')
+    sys.stdout.write('      streams a session log (one query per line, as read by batch)\n')
+    sys.stdout.write('      from FILE or standard input, and writes the totals of the\n')
+    sys.stdout.write('      session at its end : the kills, experience points and\n')
+    sys.stdout.write('      encounters credited to each monster, and for each unidentified\n')
+    sys.stdout.write('      group the encounters where its monsters were unique, ambiguous\n')
+    sys.stdout.write('      or not found (with its ambiguity rate). The kills of an\n')
+    sys.stdout.write('      ambiguous encounter are split evenly among its assignments\n')
+    sys.stdout.write('      with POLICY even (default), given to its first assignment\n')
+    sys.stdout.write('      with first, or not credited with skip. FORMAT is csv (default,\n')
+    sys.stdout.write('      one row per total) or json. Only the totals are kept, so the\n')
+    sys.stdout.write('      log may be of any length.\n')
+    sys.stdout.write(' wizardry_monster_id.py build-index [--max-groups N] [--max-count N] [FILE]\n')
+    sys.stdout.write('      solves every combination of up to N (default 3) groups having\n')
+    sys.stdout.write('      several possible monsters which can occur in one encounter,\n')
+    sys.stdout.write('      with kill counts from 1 to N (default 9), and writes the\n')
+    sys.stdout.write('      solutions to FILE (default: wizardry_monster_id.idx) for use\n')
+    sys.stdout.write('      with --index. The index is rejected once the data files change.\n')
+    sys.stdout.write('      The index is computed with numpy when it is installed.\n')
+    sys.stdout.write(' wizardry_monster_id.py build-atlas [--max-groups N] [--max-count N]\n')
+    sys.stdout.write('                  [--co-occur] [--jobs N] [FILE]\n')
+    sys.stdout.write('      finds every ambiguous input (kill counts, experience points and\n')
+    sys.stdout.write('      party size having several assignments) of the combinations\n')
+    sys.stdout.write('      solved by build-index, for every party size, and writes them\n')
+    sys.stdout.write('      to FILE (default: wizardry_monster_id.atlas), an sqlite\n')
+    sys.stdout.write('      database. With --co-occur, only the assignments whose monsters\n')
+    sys.stdout.write('      can occur together count. The combinations are swept by N\n')
+    sys.stdout.write('      worker processes (0: one per processor) and saved as they are\n')
+    sys.stdout.write('      done to FILE.partial, so an interrupted build-atlas resumes\n')
+    sys.stdout.write('      when it is run again with the same options.\n')
+    sys.stdout.write(' wizardry_monster_id.py atlas [--atlas-file FILE] [TERM ...] XP_TERM\n')
+    sys.stdout.write('      lists the ambiguous inputs of the atlas FILE (default:\n')
+    sys.stdout.write('      wizardry_monster_id.atlas) with the kill counts of the query\n')
+    sys.stdout.write('      and within its experience points and party sizes, such as\n')
+    sys.stdout.write('      every ambiguous experience points of 2pri2mir1kim0-9999x5c.\n')
+    sys.stdout.write(' wizardry_monster_id.py compile-data [FILE]\n')
+    sys.stdout.write('      validates the data files and saves them, with everything derived\n')
+    sys.stdout.write('      from them, to FILE (default: wizardry_monster_id.bundle beside the\n')
+    sys.stdout.write('      data files). While that default bundle is newer than both data\n')
+    sys.stdout.write('      files, it is loaded instead of them.\n')
+    sys.stdout.write(' The data files monsters.json and unidentified_groups.json are read\n')
+    sys.stdout.write(' from the directory of this program, or from the directory named by\n')
+    sys.stdout.write(' the environment variable WIZARDRY_MONSTER_ID_DATA when it is set.\n')
 
 def user_is_asking_for_help(first_arg):
     return first_arg in {'help', '--help', 'usage', '--usage', '?', '/?'}
 
 def read_obj_list_from_file(filename, file_description, list_ref):
+    import json # the modules which only some commands need are imported by those (to keep the start up fast)
     with open(filename, 'r') as file:
         file_content = json.load(file)
     for obj in file_content:
@@ -286,10 +448,11 @@ def construct_unidentified_group_to_monster_map(monster_map, unidentified_group_
 
 '''
 valid keys begin with a letter and contain no whitespace
-also, the keys "x" and "c" are reserved for experience points and character count respectively
+also, the keys "x", "c" and "i" are reserved for experience points, character count and image index respectively
 '''
 def key_is_valid(key):
-    if key.lower() in ["x", "c"]:
+    import re
+    if key.lower() in ["x", "c", "i"]:
         return False
     valid_key_re = re.compile("^[A-Za-z]\\S*$")
     return valid_key_re.match(key) != None
@@ -300,6 +463,91 @@ def validate_keys(map_with_keys, source_filename):
             msg = "while reading file %s, an invalid key string '%s' was encountered\n" % (source_filename, key)
             raise InvalidKeyError(msg)
 
+'''
+one monster of a MonsterTable : its id, key, key_name (as output), xp and the id of its unidentified group (None when its
+group_key is not in the groups file)
+'''
+class MonsterRecord:
+    __slots__ = ("monster_id", "key", "key_name", "xp", "group_id")
+
+    def __init__(self, monster_id, key, key_name, xp, group_id):
+        self.monster_id = monster_id
+        self.key = key
+        self.key_name = key_name
+        self.xp = xp
+        self.group_id = group_id
+
+'''
+one unidentified group of a MonsterTable : its id, key, key_name, and the ids of its possible monsters (ascending, which is
+also the order of their keys)
+'''
+class UnidentifiedGroupRecord:
+    __slots__ = ("group_id", "key", "key_name", "monster_ids")
+
+    def __init__(self, group_id, key, key_name, monster_ids):
+        self.group_id = group_id
+        self.key = key
+        self.key_name = key_name
+        self.monster_ids = monster_ids
+
+'''
+compact table of the monsters and unidentified groups used by the searches, built once from the maps of load_monster_data and not
+changed afterwards. Monsters and unidentified groups are numbered densely in the order of their sorted keys (so a monster id
+is also its node id in CoOccurrenceGraph) :
+  monsters, groups          tuples of MonsterRecord and UnidentifiedGroupRecord, indexed by id
+  monster_keys              tuple of the monster keys, indexed by id
+  monster_ids, group_ids    key to id
+  monster_xp                array of the xp of each monster, indexed by id
+The searches only deal with ids, xp and integer counts, and the assignments they return are keyed by monster key again.
+'''
+class MonsterTable:
+
+    __slots__ = ("monsters", "monster_keys", "monster_ids", "monster_xp", "groups", "group_ids")
+
+    def __init__(self, monster_map, unidentified_group_map):
+        import array
+        group_keys = sorted(unidentified_group_map)
+        self.group_ids = {}
+        for group_id, group_key in enumerate(group_keys):
+            self.group_ids[group_key] = group_id
+        self.monster_keys = tuple(sorted(monster_map))
+        self.monster_ids = {}
+        group_monster_ids = [[] for group_key in group_keys]
+        monsters = []
+        for monster_id, monster_key in enumerate(self.monster_keys):
+            monster = monster_map[monster_key]
+            group_id = self.group_ids.get(monster["group_key"])
+            self.monster_ids[monster_key] = monster_id
+            monsters.append(MonsterRecord(monster_id, monster_key, monster["key_name"], monster["xp"], group_id))
+            if group_id is not None:
+                group_monster_ids[group_id].append(monster_id)
+        self.monsters = tuple(monsters)
+        self.monster_xp = array.array('i', [monster.xp for monster in monsters])
+        self.groups = tuple(UnidentifiedGroupRecord(group_id, group_key, unidentified_group_map[group_key]["key_name"], tuple(group_monster_ids[group_id]))
+                for group_id, group_key in enumerate(group_keys))
+
+    '''
+    the ids of the possible monsters of an unidentified group
+    '''
+    def group_monster_ids(self, group_key):
+        return self.groups[self.group_ids[group_key]].monster_ids
+
+    '''
+    a table sharing the monsters of this one, where the possible monsters of each group of candidate_constraints are only those
+    its CandidateConstraint allows. It is built for a query with constraints, so that the searches never consider the others.
+    '''
+    def with_candidate_constraints(self, candidate_constraints):
+        constrained_table = MonsterTable.__new__(MonsterTable)
+        for name in MonsterTable.__slots__:
+            setattr(constrained_table, name, getattr(self, name))
+        groups = list(self.groups)
+        for group_key, constraint in candidate_constraints.items():
+            group = groups[self.group_ids[group_key]]
+            monster_ids = tuple(monster_id for monster_id in group.monster_ids if constraint.allows_monster_keys((self.monster_keys[monster_id],)))
+            groups[group.group_id] = UnidentifiedGroupRecord(group.group_id, group.key, group.key_name, monster_ids)
+        constrained_table.groups = tuple(groups)
+        return constrained_table
+
 def write_out_monster_codes_and_unidentified_group_codes(monster_map, unidentified_group_map):
     sys.stdout.write('Note that there are several cases where the same in-game monster name string is used for multiple distinct monster types.\n')
     sys.stdout.write('In these cases, it may be advisable to use a code corresponding to the unidentified group rather than the exact monster.\n')
@@ -347,111 +595,112 @@ def write_out_unidentified_groups_with_several_monsters(monster_map, unidentifie
         if len(unidentified_group_to_monster_set_map[group_key]) > 1:
             write_out_unidentified_group_and_monsters(group_key, monster_map, unidentified_group_to_monster_set_map)
 
-def find_all_monster_tuples_of_monster(monster_key, produced_monster_tuple_set, monster_map):
-    in_progress_monster_tuple_list = []
-    in_progress_monster_tuple_list.append([monster_key])
-    while in_progress_monster_tuple_list:
-        in_progress_monster_tuple = in_progress_monster_tuple_list.pop(0)
-        if len(in_progress_monster_tuple) == 4:
-            # 4 groups is a completed tuple
-            produced_monster_tuple_set.add(",".join(in_progress_monster_tuple))
-            continue
-        last_monster_key = in_progress_monster_tuple[-1]
-        co_occur_keys = monster_map[last_monster_key]["co_occur_keys"]
-        if len(co_occur_keys) == 0:
-            # nothing else can be added
-            produced_monster_tuple_set.add(",".join(in_progress_monster_tuple))
-            continue
-        for co_occur_key in co_occur_keys:
-            new_tuple = []
-            for key in in_progress_monster_tuple:
-                new_tuple.append(key)
-            new_tuple.append(co_occur_key)
-            in_progress_monster_tuple_list.append(new_tuple)
-
-def capitalize_group_in_tuple(monster_tuple, capitalized_group_key, monster_map):
-    new_monster_key_list = []
-    for monster_key in monster_tuple.split(","):
-        group_key = monster_map[monster_key]["group_key"]
-        if group_key == capitalized_group_key:
-            new_monster_key_list.append(monster_key.upper())
-        else:
-            new_monster_key_list.append(monster_key)
-    return ",".join(new_monster_key_list)
-
-def find_multi_occurring_groups_of_tuple(monster_tuple, multi_occurring_group_to_produced_tuple_list_map, monster_map):
-    group_key_to_count = {}
-    monster_key_already_seen = set()
-    for monster_key in monster_tuple.split(","):
-        if monster_key in monster_key_already_seen:
-            continue
-        monster_key_already_seen.add(monster_key)
-        group_key = monster_map[monster_key]["group_key"]
-        if group_key in group_key_to_count:
-            group_key_to_count[group_key] += 1
+'''
+an encounter is a chain of up to MAX_ENCOUNTER_CHAIN_LENGTH groups : starting from any monster, each next group is one of the
+co_occur_keys of the monster before it, and the chain ends early at a monster without co_occur_keys.
+'''
+MAX_ENCOUNTER_CHAIN_LENGTH = 4
+
+'''
+the co_occur_keys of the monsters as a graph, built once : each monster is a node with an integer id (its rank among the sorted
+monster keys) and its co_occur_keys are its successors. A chain is a tuple of node ids. Chains may revisit nodes (the cycles
+k -> o -> k and hs -> bb -> hs are followed until the chain length limit), and the chains starting at a node with a given
+remaining length are computed once and shared by every chain reaching that node.
+'''
+class CoOccurrenceGraph:
+    def __init__(self, monster_map):
+        self.monster_keys = sorted(monster_map)
+        self.node_ids = {}
+        for node_id, monster_key in enumerate(self.monster_keys):
+            self.node_ids[monster_key] = node_id
+        self.group_keys = [monster_map[monster_key]["group_key"] for monster_key in self.monster_keys]
+        self.successors = [tuple(self.node_ids[co_occur_key] for co_occur_key in monster_map[monster_key]["co_occur_keys"]) for monster_key in self.monster_keys]
+        self.chains_from_node_memo = {}
+        self.chains = None
+
+    '''
+    the chains starting at node_id with at most chain_length nodes (as long as possible)
+    '''
+    def chains_from_node(self, node_id, chain_length=MAX_ENCOUNTER_CHAIN_LENGTH):
+        memo_key = (node_id, chain_length)
+        if memo_key in self.chains_from_node_memo:
+            return self.chains_from_node_memo[memo_key]
+        if chain_length == 1 or len(self.successors[node_id]) == 0:
+            chains = [(node_id,)]
         else:
-            group_key_to_count[group_key] = 1
-    for group_key in group_key_to_count:
-        if group_key_to_count[group_key] > 1:
-            capitalized_tuple = capitalize_group_in_tuple(monster_tuple, group_key, monster_map)
-            if group_key in multi_occurring_group_to_produced_tuple_list_map:
-                multi_occurring_group_to_produced_tuple_list_map[group_key] += "\n\t" + capitalized_tuple
-            else:
-                multi_occurring_group_to_produced_tuple_list_map[group_key] = "\t" + capitalized_tuple
-
-def is_capitalized(string):
-    return string == string.upper()
-
-def convert_monster_keys_to_monster_key_names(produced_tuple_list, monster_map, unidentified_group_map):
-    named_monster_tuple_list_set = set()
-    lines = produced_tuple_list.split('\n')
-    for line in lines:
-        if line.startswith('\t'):
-            line = line[1:]
-        first_member_index = -1
-        last_member_index = -1
-        monster_name_list = []
-        monster_key_list = line.split(',')
-        for index, monster_key in enumerate(monster_key_list):
-            monster_key_name = monster_map[monster_key.lower()]["key_name"]
-            if is_capitalized(monster_key):
-                if first_member_index == -1:
-                    first_member_index = index
-                last_member_index = index
-                monster_name_list.append(monster_key_name.upper())
-            else:
-                monster_name_list.append(monster_key_name)
-        named_monster_tuple_list_set.add(", ".join(monster_name_list[first_member_index:last_member_index + 1]))
-    return "\t" + "\n\t".join(sorted(named_monster_tuple_list_set))
+            chains = []
+            for successor_id in self.successors[node_id]:
+                for chain in self.chains_from_node(successor_id, chain_length - 1):
+                    chains.append((node_id,) + chain)
+        self.chains_from_node_memo[memo_key] = chains
+        return chains
+
+    '''
+    every distinct encounter chain (starting at any monster), sorted
+    '''
+    def all_chains(self):
+        if self.chains is None:
+            chain_set = set()
+            for node_id in range(len(self.monster_keys)):
+                chain_set.update(self.chains_from_node(node_id))
+            self.chains = sorted(chain_set)
+        return self.chains
+
+    '''
+    the distinct sets of monsters killed in one encounter chain (as frozensets of node ids), sorted by their sorted node ids
+    '''
+    def chain_node_sets(self):
+        return sorted(set(frozenset(chain) for chain in self.all_chains()), key=sorted)
+
+    def chains_through_monster(self, monster_key):
+        node_id = self.node_ids[monster_key]
+        return [chain for chain in self.all_chains() if node_id in chain]
 
-def write_out_multi_occurring_unidentified_groups(monster_map, unidentified_group_map):
+    '''
+    the distinct monster node ids of each group within one chain (group key to sorted node ids)
+    '''
+    def chain_group_node_ids(self, chain):
+        group_node_ids = {}
+        for node_id in sorted(set(chain)):
+            group_node_ids.setdefault(self.group_keys[node_id], []).append(node_id)
+        return group_node_ids
+
+    '''
+    the groups which can multi-occur (appear in one chain as more than one distinct monster) : group key to the sorted list of
+    such chains
+    '''
+    def multi_occurring_group_chains(self):
+        group_chains = {}
+        for chain in self.all_chains():
+            for group_key, node_ids in self.chain_group_node_ids(chain).items():
+                if len(node_ids) > 1:
+                    group_chains.setdefault(group_key, []).append(chain)
+        return group_chains
+
+'''
+the part of the chain from the first to the last monster of the group, as names (those of the group capitalized)
+'''
+def name_chain_members_of_group(chain, group_key, co_occurrence_graph, monster_map):
+    member_indexes = [index for index, node_id in enumerate(chain) if co_occurrence_graph.group_keys[node_id] == group_key]
+    monster_names = []
+    for node_id in chain[member_indexes[0]:member_indexes[-1] + 1]:
+        monster_key_name = monster_map[co_occurrence_graph.monster_keys[node_id]]["key_name"]
+        if co_occurrence_graph.group_keys[node_id] == group_key:
+            monster_key_name = monster_key_name.upper()
+        monster_names.append(monster_key_name)
+    return ", ".join(monster_names)
+
+def write_out_multi_occurring_unidentified_groups(monster_map, unidentified_group_map, co_occurrence_graph):
     sys.stdout.write("\ngroups which can multi-occur (group members capitalized):\n")
-    produced_monster_tuple_set = set()
-    for monster_key in monster_map:
-        find_all_monster_tuples_of_monster(monster_key, produced_monster_tuple_set, monster_map)
-    multi_occurring_group_to_produced_tuple_list_map = {}
-    for monster_tuple in sorted(produced_monster_tuple_set):
-        find_multi_occurring_groups_of_tuple(monster_tuple, multi_occurring_group_to_produced_tuple_list_map, monster_map)
-    for group_key in sorted(multi_occurring_group_to_produced_tuple_list_map):
-        produced_tuple_list = multi_occurring_group_to_produced_tuple_list_map[group_key]
-        named_monster_tuple_list = convert_monster_keys_to_monster_key_names(produced_tuple_list, monster_map, unidentified_group_map)
-        sys.stdout.write("%4s: \n%s\n" % (group_key, named_monster_tuple_list))
+    multi_occurring_group_chains = co_occurrence_graph.multi_occurring_group_chains()
+    for group_key in sorted(multi_occurring_group_chains):
+        named_chains = sorted(set(name_chain_members_of_group(chain, group_key, co_occurrence_graph, monster_map) for chain in multi_occurring_group_chains[group_key]))
+        sys.stdout.write("%4s: \n%s\n" % (group_key, "\t" + "\n\t".join(named_chains)))
 
 def write_out_unidentified_groups_and_possible_monsters_for_each(monster_map, unidentified_group_map, unidentified_group_to_monster_set_map):
     write_out_unidentified_groups_with_only_one_monster(monster_map, unidentified_group_map, unidentified_group_to_monster_set_map)
     write_out_unidentified_groups_with_several_monsters(monster_map, unidentified_group_map, unidentified_group_to_monster_set_map)
-    write_out_multi_occurring_unidentified_groups(monster_map, unidentified_group_map)
-
-def find_next_matching_key(remainder, entity_map):
-    longest_match = ""
-    for key in entity_map:
-        if remainder.startswith(key):
-            if len(key) > len(longest_match):
-                longest_match = key
-    if len(longest_match) > 0:
-        return longest_match
-    else:
-        return None
+    write_out_multi_occurring_unidentified_groups(monster_map, unidentified_group_map, CoOccurrenceGraph(monster_map))
 
 def write_code_list(code_map):
     remaining_entity_count = len(code_map)
@@ -477,255 +726,3618 @@ def write_expected_input(monster_map, unidentified_group_map):
     sys.stderr.write("special codes:\n")
     sys.stderr.write("  x (for experience points awarded per character)\n")
     sys.stderr.write("  c (for number of non-incapacitated characters at encounter end)\n")
+    sys.stderr.write("  i (for the image shown for the first group, written right after the term of that group, such as 7sa15i)\n")
+    sys.stderr.write("an unidentified group term may be pinned to some of its monsters, such as 7sa=ch/gg\n")
 
-def find_next_number(s, monster_map, unidentified_group_map):
-    number_re = re.compile("^([0-9]+)")
-    match = number_re.match(s)
-    if match == None:
-        if len(s) == 0:
-            s = "<end_of_input>"
-        sys.stderr.write("error : could not find expected number at this position in input '%s'\n" % s)
-        write_expected_input(monster_map, unidentified_group_map)
-        sys.exit(1)
-    number = match.groups()[0]
-    return number
-
-def find_next_number_key_pair(s, monster_map, unidentified_group_map):
-    number = find_next_number(s, monster_map, unidentified_group_map)
-    remainder = s[len(number):]
-    special_keys = {"x": "experience points", "c": "character count"}
-    key = find_next_matching_key(remainder, unidentified_group_map)
-    if not key:
-        key = find_next_matching_key(remainder, monster_map)
-    if not key:
-        key = find_next_matching_key(remainder, special_keys)
-    if not key:
-        if len(remainder) == 0:
-            remainder = "<end of input>"
-        sys.stderr.write("error : could not find expected monster key or unidentified group key at this position in input '%s'\n" % remainder)
-        write_expected_input(monster_map, unidentified_group_map)
-        sys.exit(1)
-    return number, key
+SPECIAL_CODE_MAP = {"x": "experience points", "c": "character count", "i": "image index"}
+
+'''
+when a code is found in more than one map, an unidentified group code is preferred over a monster code,
+which is preferred over a special code (whatever their lengths)
+'''
+CODE_KIND_PRIORITY = ("unidentified_group", "monster", "special")
+
+'''
+a term of a query : count is the number given before the code (high_count is the same number, or the last number of a range of
+counts such as 4-6), kind is one of CODE_KIND_PRIORITY, and start/end are the offsets of the term within the query string.
+pinned_codes lists the monster codes an unidentified group term is pinned to (such as ["ch", "gg"] for 7sa=ch/gg), or is None.
+'''
+class QueryToken:
+    __slots__ = ("count", "high_count", "code", "kind", "start", "end", "pinned_codes")
+
+    def __init__(self, count, high_count, code, kind, start, end, pinned_codes=None):
+        self.count = count
+        self.high_count = high_count
+        self.code = code
+        self.kind = kind
+        self.start = start
+        self.end = end
+        self.pinned_codes = pinned_codes
+
+'''
+prefix trie of every code which may follow a number in a query. Each node is a dictionary from the next character to the
+child node; a node which ends a code also maps None to a dictionary of {kind: code}.
+This is built once when the data is loaded, so that a query is tokenized in a single pass.
+'''
+def construct_code_trie(monster_map, unidentified_group_map):
+    code_trie = {}
+    for kind, code_map in zip(CODE_KIND_PRIORITY, (unidentified_group_map, monster_map, SPECIAL_CODE_MAP)):
+        for code in code_map:
+            node = code_trie
+            for character in code:
+                if character not in node:
+                    node[character] = {}
+                node = node[character]
+            if None not in node:
+                node[None] = {}
+            node[None][kind] = code
+    return code_trie
+
+'''
+the longest code of the most preferred kind (see CODE_KIND_PRIORITY) which starts at position in userstring (only codes of
+kind when one is given), as a tuple (code, kind), or (None, None) when there is none
+'''
+def match_code_at_position(userstring, position, code_trie, kind=None):
+    longest_code_of_kind = {}
+    node = code_trie
+    code_position = position
+    while code_position < len(userstring) and userstring[code_position] in node:
+        node = node[userstring[code_position]]
+        code_position += 1
+        if None in node:
+            longest_code_of_kind.update(node[None])
+    for code_kind in CODE_KIND_PRIORITY:
+        if code_kind in longest_code_of_kind and (kind is None or code_kind == kind):
+            return longest_code_of_kind[code_kind], code_kind
+    return None, None
+
+'''
+splits a query into QueryTokens in a single pass. Each term is a number (or a range of numbers such as 4-6) followed by the
+longest matching code of the most preferred kind (see CODE_KIND_PRIORITY). Codes may contain digits (but do not start with one).
+An unidentified group code may be followed by "=" and the "/" separated codes of the monsters it is pinned to (such as 7sa=ch/gg).
+raises InvalidQueryError (with the offset of the problem) when the string can not be tokenized
+'''
+def tokenize_query(userstring, code_trie):
+    tokens = []
+    position = 0
+    length = len(userstring)
+    while position < length:
+        start = position
+        while position < length and userstring[position] in "0123456789":
+            position += 1
+        if position == start:
+            msg = "error : could not find expected number at this position (character %d) in input '%s'\n" % (start + 1, userstring[start:])
+            raise InvalidQueryError(msg, start)
+        count = int(userstring[start:position])
+        high_count = count
+        if position + 1 < length and userstring[position] == "-" and userstring[position + 1] in "0123456789":
+            high_start = position + 1
+            position = high_start
+            while position < length and userstring[position] in "0123456789":
+                position += 1
+            high_count = int(userstring[high_start:position])
+        code, kind = match_code_at_position(userstring, position, code_trie)
+        if code is None:
+            remainder = userstring[position:]
+            if len(remainder) == 0:
+                remainder = "<end of input>"
+            msg = "error : could not find expected monster key or unidentified group key at this position (character %d) in input '%s'\n" % (position + 1, remainder)
+            raise InvalidQueryError(msg, position)
+        position += len(code)
+        pinned_codes = None
+        if position < length and userstring[position] == "=":
+            if kind != "unidentified_group":
+                msg = "error : only an unidentified group term may be pinned to some of its monsters (character %d), such as '7sa=ch/gg'\n" % (position + 1)
+                raise InvalidQueryError(msg, position)
+            pinned_codes = []
+            separator = "="
+            while position < length and userstring[position] == separator:
+                pinned_code = match_code_at_position(userstring, position + 1, code_trie, "monster")[0]
+                if pinned_code is None:
+                    msg = "error : could not find expected monster key at this position (character %d) in input '%s'\n" % (position + 2, userstring[position + 1:] or "<end of input>")
+                    raise InvalidQueryError(msg, position + 1)
+                pinned_codes.append(pinned_code)
+                position += 1 + len(pinned_code)
+                separator = "/"
+        tokens.append(QueryToken(count, high_count, code, kind, start, position, pinned_codes))
+    return tokens
+
+'''
+the largest party, and so the party sizes a query may have when its character count is unknown (see --any-party-size)
+'''
+MAX_PARTY_SIZE = 6
+ANY_PARTY_SIZE = range(1, MAX_PARTY_SIZE + 1)
+
+'''
+the special codes which accept a range of counts, with an example of each
+'''
+QUERY_RANGE_EXAMPLES = {"x": "2100-2140x", "c": "4-6c"}
+
+'''
+what the player observed about the monsters of one unidentified group of a query, beyond its kill count : the monsters it is
+pinned to (pinned_keys, such as ("ch", "gg") for 7sa=ch/gg), and the image shown for it (image_index, such as 15 for 7sa15i, with
+image_keys the keys of the monsters of the group showing that image). Each is None when not given.
+The constraints of a query map each constrained group key to its CandidateConstraint, and are held by the parsed query under
+CANDIDATE_CONSTRAINTS_KEY (which can not be a code, see key_is_valid). They filter the candidates of the groups before the search.
+'''
+class CandidateConstraint:
+    __slots__ = ("pinned_keys", "image_index", "image_keys")
+
+    def __init__(self):
+        self.pinned_keys = None
+        self.image_index = None
+        self.image_keys = None
+
+    '''
+    true when the group may have been these monsters (the keys of one monster, or of the subgroups of a divided group, see
+    --split) : all of them are pinned monsters, and one of them shows the image (only the first group of an encounter shows
+    its image, so the other subgroups of a divided group may show other images)
+    '''
+    def allows_monster_keys(self, monster_keys):
+        if self.pinned_keys is not None:
+            for monster_key in monster_keys:
+                if monster_key not in self.pinned_keys:
+                    return False
+        if self.image_keys is not None:
+            for monster_key in monster_keys:
+                if monster_key in self.image_keys:
+                    return True
+            return False
+        return True
+
+    '''
+    the constraint as written after the group term of a query, such as "=ch/gg15i"
+    '''
+    def format_terms(self):
+        terms = ""
+        if self.pinned_keys is not None:
+            terms += "=" + "/".join(self.pinned_keys)
+        if self.image_index is not None:
+            terms += "%di" % self.image_index
+        return terms
+
+CANDIDATE_CONSTRAINTS_KEY = "="
 
 '''
 function to parse a single string into groups with monster counts
 format example : 7wol5wer4ani2703x6c - means 7 wolves killed, 5 wererats killed, 4 animals killed,
 2703 experience points awarded per character, 6 characters in non-disabled condition
+the counts are converted to integers here, once, and stay integers through the searches and the assignments
+the character count may also be a range when the number of survivors is not known (such as 4-6c), and the experience points
+a range when they are not known exactly (such as 2100-2140x), which are kept as range objects (see find_party_sizes and
+find_user_xp_values). Without a "c" term, the character count is default_character_count (a full party, or every
+party size with --any-party-size).
+an unidentified group term may be pinned to some of its monsters (7sa=ch/gg) and followed by the image shown for that group
+(7sa15i), which are kept as CandidateConstraints under CANDIDATE_CONSTRAINTS_KEY
+code_trie is built from the maps when not given (see construct_code_trie)
+without xp_required, the xp may be left out (as in the encounters of a run, see parse_encounter_run_from_input)
+raises InvalidQueryError when the string can not be parsed
 '''
-def parse_groups_from_input(userstring, monster_map, unidentified_group_map):
+def parse_groups_from_input(userstring, monster_map, unidentified_group_map, code_trie=None, default_character_count=MAX_PARTY_SIZE, xp_required=True):
     # all fields of input are number/key pairs. 7wol5wer4ani2100x6c is 7wol 5wer 4ani 2100x 6c. However, the keys can have digits in them.
-    s = userstring
+    if code_trie is None:
+        code_trie = construct_code_trie(monster_map, unidentified_group_map)
     parsed_query = {}
-    while len(s) > 0:
-        number, key = find_next_number_key_pair(s, monster_map, unidentified_group_map)
-        if key in parsed_query:
-            parsed_query[key] = str(int(parsed_query[key]) + int(number))
+    candidate_constraints = {}
+    previous_token = None
+    for token in tokenize_query(userstring, code_trie):
+        if token.code == "i" and token.high_count == token.count:
+            if previous_token is None or previous_token.kind != "unidentified_group":
+                msg = "error : the image (character %d) must follow the term of the unidentified group which showed it, such as '7sa15i'\n" % (token.start + 1)
+                raise InvalidQueryError(msg, token.start)
+            if any(constraint.image_index is not None for constraint in candidate_constraints.values()):
+                msg = "error : only the image of the first group (character %d) is shown, so only one image may be given\n" % (token.start + 1)
+                raise InvalidQueryError(msg, token.start)
+            group_key = previous_token.code
+            image_keys = frozenset(key for key in monster_map if monster_map[key]["group_key"] == group_key and monster_map[key]["image_index"] == token.count)
+            if len(image_keys) == 0:
+                msg = "error : no monster of unidentified group '%s' shows image %d (character %d)\n" % (group_key, token.count, token.start + 1)
+                raise InvalidQueryError(msg, token.start)
+            if group_key not in candidate_constraints:
+                candidate_constraints[group_key] = CandidateConstraint()
+            candidate_constraints[group_key].image_index = token.count
+            candidate_constraints[group_key].image_keys = image_keys
+            previous_token = token
+            continue
+        if token.high_count != token.count or isinstance(parsed_query.get(token.code), range):
+            if token.code not in QUERY_RANGE_EXAMPLES:
+                msg = "error : a range of counts (character %d) is only accepted for the experience points and the character count, such as '2100-2140x' or '4-6c'\n" % (token.start + 1)
+                raise InvalidQueryError(msg, token.start)
+            if token.code in parsed_query or token.high_count < token.count:
+                msg = "error : the range of %s (character %d) must be given once, lowest count first, such as '%s'\n" % (
+                        SPECIAL_CODE_MAP[token.code], token.start + 1, QUERY_RANGE_EXAMPLES[token.code])
+                raise InvalidQueryError(msg, token.start)
+            parsed_query[token.code] = range(token.count, token.high_count + 1)
+        elif token.code in parsed_query:
+            parsed_query[token.code] += token.count
         else:
-            parsed_query[key] = number
-        s = s[len(number) + len(key):]
-    if not "x" in parsed_query:
-        sys.stdout.write("error : it is required that the input include the earned experience points, such as '2100x'\n")
-        sys.stdout.write("running this program with no arguments will print a description of usage.\n")
-        sys.exit(1)
+            parsed_query[token.code] = token.count
+        if token.pinned_codes is not None:
+            for pinned_code in token.pinned_codes:
+                if monster_map[pinned_code]["group_key"] != token.code:
+                    msg = "error : monster '%s' is not a monster of unidentified group '%s' (character %d)\n" % (pinned_code, token.code, token.start + 1)
+                    raise InvalidQueryError(msg, token.start)
+            if token.code not in candidate_constraints:
+                candidate_constraints[token.code] = CandidateConstraint()
+            pinned_keys = set(token.pinned_codes)
+            if candidate_constraints[token.code].pinned_keys is not None:
+                pinned_keys &= set(candidate_constraints[token.code].pinned_keys)
+            candidate_constraints[token.code].pinned_keys = tuple(sorted(pinned_keys))
+        previous_token = token
+    for group_key, constraint in candidate_constraints.items():
+        if not any(monster_map[key]["group_key"] == group_key and constraint.allows_monster_keys((key,)) for key in monster_map):
+            msg = "error : the pinned monsters and the image given for unidentified group '%s' leave no possible monster\n" % group_key
+            raise InvalidQueryError(msg)
+    if len(candidate_constraints) > 0:
+        parsed_query[CANDIDATE_CONSTRAINTS_KEY] = candidate_constraints
+    if not "x" in parsed_query and xp_required:
+        msg = "error : it is required that the input include the earned experience points, such as '2100x'\n"
+        raise InvalidQueryError(msg)
     if not "c" in parsed_query:
-        parsed_query["c"] = 6 # default to a full party if not specified
+        parsed_query["c"] = default_character_count # default to a full party if not specified
+    if find_party_sizes(parsed_query)[0] < 1:
+        msg = "error : the character count must be at least 1\n"
+        raise InvalidQueryError(msg)
     return parsed_query
 
-def map_minus_key(basis_map, subtracted_key):
-    result_map = {}
-    for key in basis_map:
-        if not key == subtracted_key:
-            result_map[key] = basis_map[key]
-    return result_map
+'''
+a run of encounters is written as the queries of its encounters separated by ENCOUNTER_SEPARATOR, when only the xp gained
+over the whole run is known (see identify_encounter_run)
+'''
+ENCOUNTER_SEPARATOR = ","
+
+'''
+parses a run of encounters, such as 5pri1mil,4pri6mir5c,1534x : each encounter has its own terms and character count
+(see parse_groups_from_input), and a single xp term, in any of them (usually after the last one, on its own), gives the xp
+gained over the whole run by each character who survived every encounter.
+returns (list of the parsed queries of the encounters, without "x", in order ; the xp or range of xp of the run)
+raises InvalidQueryError (with the offset of the problem within the whole run) when the string can not be parsed
+'''
+def parse_encounter_run_from_input(userstring, monster_map, unidentified_group_map, code_trie=None, default_character_count=MAX_PARTY_SIZE):
+    if code_trie is None:
+        code_trie = construct_code_trie(monster_map, unidentified_group_map)
+    encounters = []
+    run_xp = None
+    encounter_start = 0
+    for encounter_string in userstring.split(ENCOUNTER_SEPARATOR):
+        encounter_number = len(encounters) + 1
+        try:
+            parsed_query = parse_groups_from_input(encounter_string, monster_map, unidentified_group_map, code_trie, default_character_count, xp_required=False)
+        except InvalidQueryError as e:
+            msg = str(e).replace("error : ", "error : encounter %d : " % encounter_number, 1)
+            raise InvalidQueryError(msg, None if e.position is None else encounter_start + e.position)
+        has_xp = "x" in parsed_query
+        if has_xp:
+            if run_xp is not None:
+                msg = "error : the experience points of a run (encounter %d) must be given once, for the whole run, such as '5pri1mil,4pri6mir5c,1534x'\n" % encounter_number
+                raise InvalidQueryError(msg, encounter_start)
+            run_xp = parsed_query.pop("x")
+        has_kills = any(key != "c" and key != CANDIDATE_CONSTRAINTS_KEY for key in parsed_query)
+        if has_kills:
+            encounters.append(parsed_query)
+        elif not has_xp:
+            msg = "error : encounter %d of the run has no monster killed (character %d)\n" % (encounter_number, encounter_start + 1)
+            raise InvalidQueryError(msg, encounter_start)
+        encounter_start += len(encounter_string) + len(ENCOUNTER_SEPARATOR)
+    if len(encounters) == 0:
+        msg = "error : a run must have at least one encounter with monsters killed, such as '5pri1mil,4pri6mir5c,1534x'\n"
+        raise InvalidQueryError(msg)
+    if run_xp is None:
+        msg = "error : it is required that the input include the experience points earned over the run, such as '5pri1mil,4pri6mir5c,1534x'\n"
+        raise InvalidQueryError(msg)
+    return encounters, run_xp
+
+'''
+the party sizes allowed by the user input : the character count, or each count of a range of character counts
+'''
+def find_party_sizes(usergroups):
+    character_count = usergroups["c"]
+    if isinstance(character_count, range):
+        return character_count
+    return range(character_count, character_count + 1)
+
+'''
+the xp values allowed by the user input : the xp, or each xp of a range of xp
+'''
+def find_user_xp_values(usergroups):
+    user_xp = usergroups["x"]
+    if isinstance(user_xp, range):
+        return user_xp
+    return range(user_xp, user_xp + 1)
+
+'''
+a count of the user input as written in a query : a number, or a range of numbers such as 4-6
+'''
+def format_query_count(count):
+    if isinstance(count, range):
+        return "%d-%d" % (count[0], count[-1])
+    return "%d" % count
 
-def compute_total_xp(deduced_monster_map, monster_map):
+def compute_total_xp(deduced_monster_map, monster_table):
     total_xp = 0
     for key in deduced_monster_map:
-        if key in monster_map:
-            total_xp += int(monster_map[key]["xp"]) * int(deduced_monster_map[key])
+        if key in monster_table.monster_ids:
+            total_xp += monster_table.monster_xp[monster_table.monster_ids[key]] * deduced_monster_map[key]
         else:
-            sys.stderr.write("error - some programming error allowed deduced_monster_map to contain a non-recognized key\n")
-            sys.exit(1)
+            raise InvalidKeyError("error : the assignment holds '%s', which is not a monster key\n" % key)
     return total_xp
 
+'''
+true when the total split among the characters (for any of the party sizes of the user input) is the user xp (or within
+its range)
+'''
 def xp_total_matches_close_enough(usergroups, known_monster_total_xp):
-    user_xp = int(usergroups["x"])
-    user_character_count = int(usergroups["c"])
-    #sys.stderr.write("        user_xp = %s\n" % (str(user_xp)))
-    #sys.stderr.write("        user_cc = %s\n" % (str(user_character_count)))
-    #sys.stderr.write("        known_monster_total_xp = %s\n" % (str(known_monster_total_xp)))
-    #sys.stderr.write("        computed ratio = %s\n" % (str(known_monster_total_xp / user_character_count)))
-    return int(known_monster_total_xp / user_character_count) == user_xp
-
-def recursively_search_unidentified_groups_for_satisfactory_monster_maps(
+    user_xp = find_user_xp_values(usergroups)
+    for user_character_count in find_party_sizes(usergroups):
+        if known_monster_total_xp // user_character_count in user_xp:
+            return True
+    return False
+
+'''
+returns the sorted list of the inclusive ranges of total xp values which satisfy xp_total_matches_close_enough for the user input.
+For each party size c, the total is split among the characters with fractions dropped, so any of the c values starting at
+x * c will do, and for a range of xp from x to y, any of the values from x * c to y * c + c - 1. The ranges of successive
+party sizes only overlap when x is smaller than c (or when the range of xp is wide), and are then merged.
+'''
+def satisfactory_total_xp_ranges(usergroups):
+    user_xp_values = find_user_xp_values(usergroups)
+    xp_ranges = []
+    for user_character_count in find_party_sizes(usergroups):
+        low_xp = user_xp_values[0] * user_character_count
+        high_xp = user_xp_values[-1] * user_character_count + user_character_count - 1
+        if len(xp_ranges) > 0 and low_xp <= xp_ranges[-1][1] + 1:
+            xp_ranges[-1] = (xp_ranges[-1][0], max(high_xp, xp_ranges[-1][1]))
+        else:
+            xp_ranges.append((low_xp, high_xp))
+    return xp_ranges
+
+def xp_total_is_within_ranges(xp_total, xp_ranges):
+    for low_xp, high_xp in xp_ranges:
+        if low_xp <= xp_total <= high_xp:
+            return True
+    return False
+
+'''
+the satisfactory ranges for the unidentified groups, once the xp of the identified monsters is deducted
+'''
+def shift_xp_ranges(xp_ranges, xp_shift):
+    return [(low_xp - xp_shift, high_xp - xp_shift) for low_xp, high_xp in xp_ranges]
+
+'''
+co-occurrence constraint : every encounter is a chain of up to 4 groups following co_occur_keys (see CoOccurrenceGraph),
+and the monsters killed in one encounter must all belong to one such chain.
+Each distinct chain (as a set of monsters) is given a bit, and the returned map gives for each monster key a mask of
+the chains containing it. A selection of monsters can occur together only if the AND of their masks is not zero.
+'''
+def construct_co_occurrence_mask_map(co_occurrence_graph):
+    co_occurrence_masks = [0] * len(co_occurrence_graph.monster_keys)
+    for index, node_set in enumerate(co_occurrence_graph.chain_node_sets()):
+        for node_id in node_set:
+            co_occurrence_masks[node_id] |= 1 << index
+    return dict(zip(co_occurrence_graph.monster_keys, co_occurrence_masks))
+
+'''
+true when all monsters of the map can occur together in one encounter
+'''
+def monsters_can_co_occur(deduced_monster_map, co_occurrence_mask_map):
+    co_occurrence_mask = -1
+    for monster_key in deduced_monster_map:
+        co_occurrence_mask &= co_occurrence_mask_map[monster_key]
+    return co_occurrence_mask != 0
+
+'''
+for one unidentified group of the user input, list each possible monster as a tuple (xp contribution, monster id, co-occurrence mask)
+the mask is -1 (compatible with everything) when no co_occurrence_mask_map is given
+the list is sorted by monster id (and so by monster key) so that the search (and so the output) has a stable order
+'''
+def construct_candidate_list_for_unidentified_group(group_key, count, monster_table, co_occurrence_mask_map):
+    candidate_list = []
+    for monster_id in monster_table.group_monster_ids(group_key):
+        if co_occurrence_mask_map is None:
+            co_occurrence_mask = -1
+        else:
+            co_occurrence_mask = co_occurrence_mask_map[monster_table.monster_keys[monster_id]]
+        candidate_list.append((monster_table.monster_xp[monster_id] * count, monster_id, co_occurrence_mask))
+    return candidate_list
+
+def sum_of_extreme_candidate_xp(candidate_lists, extreme_function):
+    total = 0
+    for candidate_list in candidate_lists:
+        total += extreme_function(candidate[0] for candidate in candidate_list)
+    return total
+
+'''
+choose where to split the candidate lists into two halves so that the larger half has as few selections as possible
+'''
+def choose_candidate_list_split_index(candidate_lists):
+    best_index = 0
+    best_cost = None
+    for index in range(len(candidate_lists) + 1):
+        first_cost = 1
+        for candidate_list in candidate_lists[:index]:
+            first_cost *= len(candidate_list)
+        second_cost = 1
+        for candidate_list in candidate_lists[index:]:
+            second_cost *= len(candidate_list)
+        cost = max(first_cost, second_cost)
+        if best_cost is None or cost < best_cost:
+            best_index = index
+            best_cost = cost
+    return best_index
+
+'''
+instrumentation of --stats : the time spent in each phase (loading the data, parsing the queries, searching and writing the
+output) and the work of the searches. A node is a partial selection the search expanded, a leaf a complete selection whose
+xp total was tested, and a pruned branch a selection dropped before completion (because its xp total could no longer be
+satisfactory or its monsters could not co-occur). Statistics of several queries are added together.
+'''
+class SearchStatistics:
+    def __init__(self):
+        self.queries = 0
+        self.load_seconds = 0.0
+        self.parse_seconds = 0.0
+        self.search_seconds = 0.0
+        self.output_seconds = 0.0
+        self.nodes_visited = 0
+        self.leaves_tested = 0
+        self.branches_pruned = 0
+        self.solutions = 0
+
+    def add(self, other):
+        for name, value in vars(other).items():
+            setattr(self, name, getattr(self, name) + value)
+
+    '''
+    the statistics as a json friendly dictionary (times in milliseconds). Those of a single query leave out the query count and
+    the phases which are not timed per query.
+    '''
+    def to_record(self, single_query=False):
+        record = {}
+        for name, value in vars(self).items():
+            if single_query and name in {"queries", "load_seconds", "output_seconds"}:
+                continue
+            if name.endswith("_seconds"):
+                record[name[:-len("seconds")] + "ms"] = round(value * 1000.0, 3)
+            else:
+                record[name] = value
+        return record
+
+    def to_text(self):
+        lines = ["statistics of %d quer%s :" % (self.queries, "y" if self.queries == 1 else "ies")]
+        for name, value in self.to_record().items():
+            if name == "queries":
+                continue
+            if name.endswith("_ms"):
+                lines.append("  %-16s %12.3f ms" % (name[:-len("_ms")].replace("_", " "), value))
+            else:
+                lines.append("  %-16s %12d" % (name.replace("_", " "), value))
+        return "\n".join(lines) + "\n"
+
+'''
+depth first selection of one candidate from each list (from list index onward). min_remaining_xp and max_remaining_xp hold
+the smallest and largest xp the lists after each index can still add, so a branch is dropped as soon as its xp sum can no
+longer end up within [low_xp, high_xp]. A branch is also dropped as soon as its selected monsters can not co-occur (the AND
+of their co-occurrence masks is zero). Each complete selection is appended to selections as
+(xp sum, tuple of candidate indexes, co-occurrence mask).
+The visited nodes and dropped branches are counted in search_statistics when one is given (see SearchStatistics).
+'''
+def collect_candidate_selections_within_bounds(
+            candidate_lists,
+            index,
+            xp_sum,
+            choice,
+            co_occurrence_mask,
+            min_remaining_xp,
+            max_remaining_xp,
+            low_xp,
+            high_xp,
+            selections,
+            search_statistics=None):
+    if search_statistics is not None:
+        search_statistics.nodes_visited += 1
+    if index == len(candidate_lists):
+        selections.append((xp_sum, choice, co_occurrence_mask))
+        return
+    pruned_branch_count = 0
+    for candidate_index, candidate in enumerate(candidate_lists[index]):
+        adjusted_xp_sum = xp_sum + candidate[0]
+        if adjusted_xp_sum + min_remaining_xp[index + 1] > high_xp:
+            pruned_branch_count += 1
+            continue
+        if adjusted_xp_sum + max_remaining_xp[index + 1] < low_xp:
+            pruned_branch_count += 1
+            continue
+        adjusted_co_occurrence_mask = co_occurrence_mask & candidate[2]
+        if adjusted_co_occurrence_mask == 0:
+            pruned_branch_count += 1
+            continue
+        collect_candidate_selections_within_bounds(
+                candidate_lists,
+                index + 1,
+                adjusted_xp_sum,
+                choice + (candidate_index,),
+                adjusted_co_occurrence_mask,
+                min_remaining_xp,
+                max_remaining_xp,
+                low_xp,
+                high_xp,
+                selections,
+                search_statistics)
+    if search_statistics is not None:
+        search_statistics.branches_pruned += pruned_branch_count
+
+def find_candidate_selections_within_bounds(candidate_lists, low_xp, high_xp, co_occurrence_mask, search_statistics=None):
+    min_remaining_xp = [0] * (len(candidate_lists) + 1)
+    max_remaining_xp = [0] * (len(candidate_lists) + 1)
+    for index in range(len(candidate_lists) - 1, -1, -1):
+        min_remaining_xp[index] = min_remaining_xp[index + 1] + min(candidate[0] for candidate in candidate_lists[index])
+        max_remaining_xp[index] = max_remaining_xp[index + 1] + max(candidate[0] for candidate in candidate_lists[index])
+    selections = []
+    if min_remaining_xp[0] > high_xp or max_remaining_xp[0] < low_xp:
+        if search_statistics is not None:
+            search_statistics.branches_pruned += 1
+        return selections
+    collect_candidate_selections_within_bounds(
+            candidate_lists, 0, 0, (), co_occurrence_mask, min_remaining_xp, max_remaining_xp, low_xp, high_xp, selections, search_statistics)
+    return selections
+
+'''
+meet in the middle search : the unidentified groups are split into two halves. Selections of the second half are stored in
+a table keyed by their xp sum, with the sorted list of those sums, then each selection of the first half bisects that list for
+the sums which complete it to a satisfactory total (within one of the satisfactory ranges of each party size, so every pair is
+tested against all the party sizes at once). The cost of a lookup does not grow with the width of the ranges, so a range of
+xp (such as 2100-2140x) costs about the same as a single value. Both halves are enumerated with min/max remaining xp bounds, so hopeless branches are never expanded.
+When a co_occurrence_mask_map is given, known_monster_co_occurrence_mask holds the chains allowed by the identified monsters
+of the input and selections which can not co-occur with them (or with each other) are dropped during the search.
+Yields the same assignments as trying every monster for every group, ordered by the selection made for each group in turn,
+as soon as each is found (only the selections of the two halves are held in memory, never the assignments).
+The complete selections tested are the pairs of half selections matched by their xp sums.
+'''
+def search_unidentified_groups_for_satisfactory_monster_maps(
             usergroups,
             user_unidentified_group_map,
-            monster_map,
-            unidentified_group_map,
-            unidentified_group_to_monster_set_map,
-            known_monster_total_xp):
-    #sys.stderr.write("entered rsugfsmm with user_unid_group_map %s\n" % (str(user_unidentified_group_map)))
-    if len(user_unidentified_group_map) == 0:
-        #sys.stderr.write("    testing xp compatibility (ug=%s, totalxp=%s).." % (str(usergroups), str(known_monster_total_xp)))
-        if xp_total_matches_close_enough(usergroups, known_monster_total_xp):
-            # xp requrement was satisfied .. return an object to represent this case
-            return [ {} ]
+            monster_table,
+            known_monster_total_xp,
+            co_occurrence_mask_map=None,
+            known_monster_co_occurrence_mask=-1,
+            search_statistics=None):
+    group_keys = list(user_unidentified_group_map)
+    candidate_lists = []
+    for group_key in group_keys:
+        candidate_lists.append(construct_candidate_list_for_unidentified_group(group_key, usergroups[group_key], monster_table, co_occurrence_mask_map))
+    xp_ranges = shift_xp_ranges(satisfactory_total_xp_ranges(usergroups), known_monster_total_xp)
+    low_xp = xp_ranges[0][0]
+    high_xp = xp_ranges[-1][1]
+    split_index = choose_candidate_list_split_index(candidate_lists)
+    first_candidate_lists = candidate_lists[:split_index]
+    second_candidate_lists = candidate_lists[split_index:]
+    first_min_xp = sum_of_extreme_candidate_xp(first_candidate_lists, min)
+    first_max_xp = sum_of_extreme_candidate_xp(first_candidate_lists, max)
+    second_min_xp = sum_of_extreme_candidate_xp(second_candidate_lists, min)
+    second_max_xp = sum_of_extreme_candidate_xp(second_candidate_lists, max)
+    first_selections = find_candidate_selections_within_bounds(
+            first_candidate_lists, low_xp - second_max_xp, high_xp - second_min_xp, known_monster_co_occurrence_mask, search_statistics)
+    second_selection_table = {}
+    for xp_sum, choice, co_occurrence_mask in find_candidate_selections_within_bounds(
+            second_candidate_lists, low_xp - first_max_xp, high_xp - first_min_xp, known_monster_co_occurrence_mask, search_statistics):
+        if xp_sum in second_selection_table:
+            second_selection_table[xp_sum].append((choice, co_occurrence_mask))
         else:
-            return []
-    found_satisfactory_monster_maps = []
-    # iterate over one unkown group
-    selected_unidentified_group = next(iter(user_unidentified_group_map.keys()))
-    #sys.stderr.write("selected group : %s\n" % (selected_unidentified_group))
-    for possible_monster in unidentified_group_to_monster_set_map[selected_unidentified_group]:
-        #sys.stderr.write("  possible monster is: %s\n" % (possible_monster))
-        adjusted_total_xp = known_monster_total_xp + monster_map[possible_monster]["xp"] * int(usergroups[selected_unidentified_group])
-        #sys.stderr.write("  adjusted xp : %s\n" % (adjusted_total_xp))
-        adjusted_user_unidentified_group_map = map_minus_key(user_unidentified_group_map, selected_unidentified_group)
-        satisfactory_monster_maps_for_choice = recursively_search_unidentified_groups_for_satisfactory_monster_maps(
-                usergroups,
-                adjusted_user_unidentified_group_map,
-                monster_map,
-                unidentified_group_map,
-                unidentified_group_to_monster_set_map,
-                adjusted_total_xp)
-        for satisfactory_monster_map in satisfactory_monster_maps_for_choice:
-            satisfactory_monster_map[possible_monster] = usergroups[selected_unidentified_group]
-        found_satisfactory_monster_maps += satisfactory_monster_maps_for_choice
-    return found_satisfactory_monster_maps
+            second_selection_table[xp_sum] = [(choice, co_occurrence_mask)]
+    second_xp_sums = sorted(second_selection_table)
+    for first_xp_sum, first_choice, first_co_occurrence_mask in first_selections:
+        matching_second_selections = []
+        for range_low_xp, range_high_xp in xp_ranges:
+            first_position = bisect.bisect_left(second_xp_sums, range_low_xp - first_xp_sum)
+            end_position = bisect.bisect_right(second_xp_sums, range_high_xp - first_xp_sum, first_position)
+            for second_xp_sum in second_xp_sums[first_position:end_position]:
+                matching_second_selections += second_selection_table[second_xp_sum]
+        if search_statistics is not None:
+            search_statistics.leaves_tested += len(matching_second_selections)
+        for second_choice, second_co_occurrence_mask in sorted(matching_second_selections):
+            if first_co_occurrence_mask & second_co_occurrence_mask == 0:
+                if search_statistics is not None:
+                    search_statistics.branches_pruned += 1
+                continue
+            yield construct_monster_map_from_choice(usergroups, group_keys, candidate_lists, first_choice + second_choice, monster_table)
+
+'''
+the assignment of one selection : choice holds, for each group of group_keys, the index of the selected candidate
+'''
+def construct_monster_map_from_choice(usergroups, group_keys, candidate_lists, choice, monster_table):
+    satisfactory_monster_map = {}
+    # the last group is added first (the order the former recursive search produced)
+    for index in range(len(group_keys) - 1, -1, -1):
+        monster_key = monster_table.monster_keys[candidate_lists[index][choice[index]][1]]
+        satisfactory_monster_map[monster_key] = usergroups[group_keys[index]]
+    return satisfactory_monster_map
+
+'''
+numpy is optional : returns the numpy module, or None when it is not installed (the pure python search is used then)
+'''
+def find_numpy_module():
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+'''
+largest number of xp totals the vectorized search computes at once (about 8 bytes each, in several temporary arrays)
+'''
+NUMPY_SEARCH_CHUNK_SIZE = 1 << 20
+
+'''
+the xp totals of every selection of the candidate lists as an array with one axis per list (the broadcast sum of the xp of
+each list's candidates). Element [i, j, ...] is the total of selecting candidate i of the first list, j of the second, and so on.
+'''
+def construct_xp_total_grid(numpy_module, candidate_lists):
+    xp_total_grid = numpy_module.zeros((), dtype=numpy_module.int64)
+    for candidate_list in candidate_lists:
+        xp_total_grid = numpy_module.add.outer(xp_total_grid, numpy_module.array([candidate[0] for candidate in candidate_list], dtype=numpy_module.int64))
+    return xp_total_grid
+
+'''
+vectorized search (same arguments and yielded assignments as search_unidentified_groups_for_satisfactory_monster_maps) : the xp total
+of every selection is computed at once as an array with one axis per unidentified group, and the test of
+xp_total_matches_close_enough (the total divided among the characters with fractions dropped is the user xp, for any party size)
+is applied to the whole array as a single mask, by comparing each total with the satisfactory range of each party size. The indexes of the matching elements are the selections (in the same order as the search).
+When the array would hold more than NUMPY_SEARCH_CHUNK_SIZE totals, the leading groups are enumerated one selection at a time
+(skipping the selections which can no longer reach a satisfactory total) and the array of the remaining groups is reused for each.
+Co-occurrence masks do not fit numpy integers, so they are checked only for the matching selections.
+Each selection of the leading groups is a visited node, and each element of the array it is added to is a tested selection.
+'''
+def search_unidentified_groups_for_satisfactory_monster_maps_with_numpy(
+            numpy_module,
+            usergroups,
+            user_unidentified_group_map,
+            monster_table,
+            known_monster_total_xp,
+            co_occurrence_mask_map=None,
+            known_monster_co_occurrence_mask=-1,
+            search_statistics=None):
+    group_keys = list(user_unidentified_group_map)
+    candidate_lists = []
+    for group_key in group_keys:
+        candidate_lists.append(construct_candidate_list_for_unidentified_group(group_key, usergroups[group_key], monster_table, co_occurrence_mask_map))
+    xp_ranges = satisfactory_total_xp_ranges(usergroups)
+    low_xp = xp_ranges[0][0]
+    high_xp = xp_ranges[-1][1]
+    split_index = len(candidate_lists)
+    grid_size = 1
+    while split_index > 0 and grid_size * len(candidate_lists[split_index - 1]) <= NUMPY_SEARCH_CHUNK_SIZE:
+        split_index -= 1
+        grid_size *= len(candidate_lists[split_index])
+    xp_total_grid = construct_xp_total_grid(numpy_module, candidate_lists[split_index:]) + known_monster_total_xp
+    grid_min_xp = int(xp_total_grid.min())
+    grid_max_xp = int(xp_total_grid.max())
+    for leading_choice in itertools.product(*[range(len(candidate_list)) for candidate_list in candidate_lists[:split_index]]):
+        if search_statistics is not None:
+            search_statistics.nodes_visited += 1
+        leading_xp_sum = 0
+        leading_co_occurrence_mask = known_monster_co_occurrence_mask
+        for index, candidate_index in enumerate(leading_choice):
+            leading_xp_sum += candidate_lists[index][candidate_index][0]
+            leading_co_occurrence_mask &= candidate_lists[index][candidate_index][2]
+        if leading_co_occurrence_mask == 0 or leading_xp_sum + grid_min_xp > high_xp or leading_xp_sum + grid_max_xp < low_xp:
+            if search_statistics is not None:
+                search_statistics.branches_pruned += 1
+            continue
+        if search_statistics is not None:
+            search_statistics.leaves_tested += xp_total_grid.size
+        xp_totals = xp_total_grid + leading_xp_sum
+        satisfactory_mask = None
+        for range_low_xp, range_high_xp in xp_ranges:
+            range_mask = (xp_totals >= range_low_xp) & (xp_totals <= range_high_xp)
+            if satisfactory_mask is None:
+                satisfactory_mask = range_mask
+            else:
+                satisfactory_mask |= range_mask
+        for trailing_choice in numpy_module.argwhere(satisfactory_mask).tolist():
+            choice = leading_choice + tuple(trailing_choice)
+            co_occurrence_mask = leading_co_occurrence_mask
+            for index in range(split_index, len(candidate_lists)):
+                co_occurrence_mask &= candidate_lists[index][choice[index]][2]
+            if co_occurrence_mask == 0:
+                if search_statistics is not None:
+                    search_statistics.branches_pruned += 1
+                continue
+            yield construct_monster_map_from_choice(usergroups, group_keys, candidate_lists, choice, monster_table)
+
+'''
+co-occurring monsters within one unidentified group : for each group key, the list of sorted tuples of distinct monster ids of
+that group which can be killed in one encounter (following the chains of CoOccurrenceGraph, whose node ids are the monster ids
+of MonsterTable). Every non-empty subset of such monsters is included (a group may flee or dissolve entirely), so every monster
+of the group appears alone too.
+Example : "sh" maps to [(k,), (k, o), (o,)] where k and o are the ids of "k" and "o"
+'''
+def construct_group_co_occurring_monster_sets_map(co_occurrence_graph, unidentified_group_to_monster_set_map):
+    group_monster_tuple_sets = {}
+    for group_key in unidentified_group_to_monster_set_map:
+        group_monster_tuple_sets[group_key] = set()
+    for chain in co_occurrence_graph.all_chains():
+        for group_key, node_ids in co_occurrence_graph.chain_group_node_ids(chain).items():
+            for subset_size in range(1, len(node_ids) + 1):
+                for monster_id_subset in itertools.combinations(node_ids, subset_size):
+                    group_monster_tuple_sets[group_key].add(monster_id_subset)
+    group_co_occurring_monster_sets_map = {}
+    for group_key in group_monster_tuple_sets:
+        group_co_occurring_monster_sets_map[group_key] = sorted(group_monster_tuple_sets[group_key])
+    return group_co_occurring_monster_sets_map
+
+'''
+every way to divide count killed monsters into part_count subgroups of at least one monster each (as tuples, in lexical order)
+'''
+def find_count_divisions(count, part_count):
+    if part_count == 1:
+        return [(count,)]
+    count_divisions = []
+    for first_part in range(1, count - part_count + 2):
+        for remaining_parts in find_count_divisions(count - first_part, part_count - 1):
+            count_divisions.append((first_part,) + remaining_parts)
+    return count_divisions
+
+'''
+for one unidentified group of the user input, maps each possible xp contribution to the list of divisions of the kill count
+which give it. A division is a tuple of (monster id, count) pairs, paired with the co-occurrence mask of its monsters
+(-1 when no co_occurrence_mask_map is given).
+When a candidate_constraint is given, only the sets of monsters it allows are divided (see CandidateConstraint).
+'''
+def construct_division_options_for_unidentified_group(group_key, count, monster_table, group_co_occurring_monster_sets_map, co_occurrence_mask_map, candidate_constraint=None):
+    xp_to_divisions = {}
+    for monster_ids in group_co_occurring_monster_sets_map[group_key]:
+        if len(monster_ids) > max(count, 1):
+            continue
+        if candidate_constraint is not None and not candidate_constraint.allows_monster_keys([monster_table.monster_keys[monster_id] for monster_id in monster_ids]):
+            continue
+        co_occurrence_mask = -1
+        if co_occurrence_mask_map is not None:
+            for monster_id in monster_ids:
+                co_occurrence_mask &= co_occurrence_mask_map[monster_table.monster_keys[monster_id]]
+        for count_division in find_count_divisions(count, len(monster_ids)):
+            xp = 0
+            for monster_id, monster_count in zip(monster_ids, count_division):
+                xp += monster_table.monster_xp[monster_id] * monster_count
+            if xp not in xp_to_divisions:
+                xp_to_divisions[xp] = []
+            xp_to_divisions[xp].append((tuple(zip(monster_ids, count_division)), co_occurrence_mask))
+    return xp_to_divisions
+
+'''
+depth first selection of one division for each group (from group index onward), trying the divisions of each group in sorted
+order so that the division lists are yielded in sorted order. A division is only tried when the xp sums reachable by the
+groups after it (suffix_xp_sums, sorted) can still complete a total within [low_xp, high_xp], and a complete selection is only
+yielded when its total is within one of xp_ranges (the satisfactory ranges of each party size, between low_xp and high_xp).
+'''
+def generate_satisfactory_divisions(
+            division_lists,
+            suffix_xp_sums,
+            index,
+            xp_sum,
+            co_occurrence_mask,
+            low_xp,
+            high_xp,
+            xp_ranges,
+            selected_divisions,
+            search_statistics=None):
+    if search_statistics is not None:
+        search_statistics.nodes_visited += 1
+    if index == len(division_lists):
+        if search_statistics is not None:
+            search_statistics.leaves_tested += 1
+        if xp_total_is_within_ranges(xp_sum, xp_ranges):
+            yield list(selected_divisions)
+        return
+    for division, xp, division_co_occurrence_mask in division_lists[index]:
+        adjusted_xp_sum = xp_sum + xp
+        position = bisect.bisect_left(suffix_xp_sums[index + 1], low_xp - adjusted_xp_sum)
+        if position == len(suffix_xp_sums[index + 1]) or suffix_xp_sums[index + 1][position] > high_xp - adjusted_xp_sum:
+            if search_statistics is not None:
+                search_statistics.branches_pruned += 1
+            continue
+        adjusted_co_occurrence_mask = co_occurrence_mask & division_co_occurrence_mask
+        if adjusted_co_occurrence_mask == 0:
+            if search_statistics is not None:
+                search_statistics.branches_pruned += 1
+            continue
+        selected_divisions[index] = division
+        yield from generate_satisfactory_divisions(
+                division_lists,
+                suffix_xp_sums,
+                index + 1,
+                adjusted_xp_sum,
+                adjusted_co_occurrence_mask,
+                low_xp,
+                high_xp,
+                xp_ranges,
+                selected_divisions,
+                search_statistics)
+
+'''
+search for the case where several subgroups of one unidentified group were killed (the player only knows the total count).
+Each unidentified group may be divided among the monsters which can co-occur in that group (see
+construct_group_co_occurring_monster_sets_map), and the combination of all groups must capture the xp total.
+Rather than enumerating every combination of divisions, a dynamic program records the set of xp sums reachable by the last
+groups (only sums which can still be completed within the satisfactory range by the groups before them are kept), then the
+divisions are selected from the first group on, only where those sets show that a satisfactory total can still be reached,
+so only the divisions of actual solutions are ever combined. The assignments are yielded in the order of their division lists.
+The candidate constraints of the user input (see CandidateConstraint) are applied to the divisions of each group.
+'''
+def search_divided_unidentified_groups_for_satisfactory_monster_maps(
+            usergroups,
+            user_unidentified_group_map,
+            monster_table,
+            group_co_occurring_monster_sets_map,
+            known_monster_total_xp,
+            co_occurrence_mask_map=None,
+            known_monster_co_occurrence_mask=-1,
+            search_statistics=None):
+    group_keys = list(user_unidentified_group_map)
+    candidate_constraints = usergroups.get(CANDIDATE_CONSTRAINTS_KEY, {})
+    division_lists = []
+    for group_key in group_keys:
+        option_map = construct_division_options_for_unidentified_group(
+                group_key, usergroups[group_key], monster_table, group_co_occurring_monster_sets_map, co_occurrence_mask_map, candidate_constraints.get(group_key))
+        if len(option_map) == 0:
+            return
+        division_lists.append(sorted((division, xp, co_occurrence_mask) for xp in option_map for division, co_occurrence_mask in option_map[xp]))
+    xp_ranges = shift_xp_ranges(satisfactory_total_xp_ranges(usergroups), known_monster_total_xp)
+    low_xp = xp_ranges[0][0]
+    high_xp = xp_ranges[-1][1]
+    min_prefix_xp = [0] * (len(division_lists) + 1)
+    max_prefix_xp = [0] * (len(division_lists) + 1)
+    for index, division_list in enumerate(division_lists):
+        min_prefix_xp[index + 1] = min_prefix_xp[index] + min(xp for division, xp, co_occurrence_mask in division_list)
+        max_prefix_xp[index + 1] = max_prefix_xp[index] + max(xp for division, xp, co_occurrence_mask in division_list)
+    # suffix_xp_sums[index] holds the sorted xp sums of the groups from index on which can still lead to a satisfactory total
+    suffix_xp_sums = [None] * len(division_lists) + [[0]]
+    for index in range(len(division_lists) - 1, -1, -1):
+        xp_set = set(xp for division, xp, co_occurrence_mask in division_lists[index])
+        suffix_xp_set = set()
+        for suffix_xp_sum in suffix_xp_sums[index + 1]:
+            for xp in xp_set:
+                adjusted_xp_sum = suffix_xp_sum + xp
+                if adjusted_xp_sum + min_prefix_xp[index] > high_xp or adjusted_xp_sum + max_prefix_xp[index] < low_xp:
+                    if search_statistics is not None:
+                        search_statistics.branches_pruned += 1
+                    continue
+                suffix_xp_set.add(adjusted_xp_sum)
+        suffix_xp_sums[index] = sorted(suffix_xp_set)
+    for division_list in generate_satisfactory_divisions(
+                division_lists, suffix_xp_sums, 0, 0, known_monster_co_occurrence_mask, low_xp, high_xp, xp_ranges, [None] * len(division_lists), search_statistics):
+        satisfactory_monster_map = {}
+        # the last group is added first (as in search_unidentified_groups_for_satisfactory_monster_maps)
+        for division in reversed(division_list):
+            for monster_id, monster_count in division:
+                satisfactory_monster_map[monster_table.monster_keys[monster_id]] = monster_count
+        yield satisfactory_monster_map
 
 '''
 XP of all known monster groups are totalled and deducted from the user specified xp, yielding an xp total for the unidentified groups.
-All permutations of possible monster selection from each unidentified group is attempted and a list of all valid assignments (which capture the xp total) are collected and returned.
+Selections of possible monsters from each unidentified group are searched (see search_unidentified_groups_for_satisfactory_monster_maps)
+and each valid assignment (which captures the xp total) is yielded as soon as it is found, so a caller which only needs the
+first few assignments (such as --limit and --unique) stops the search early, and the assignments are never all held in memory.
 An example to test the combination of groups which are the same monster would be : 6sh6o470x6c or 6sh6sh470x6c
+When a co_occurrence_mask_map is given (see construct_co_occurrence_mask_map), only assignments whose monsters can all
+occur in one encounter are searched and returned. Example : 4pri6mir3mia7sa6050x6c has no such assignment.
+When a group_co_occurring_monster_sets_map is given (see construct_group_co_occurring_monster_sets_map), the count of each
+unidentified group may also be divided among several monsters of that group. Example : 6sh325x is 3 kobolds and 3 orcs.
+When a numpy_module is given (see find_numpy_module), undivided groups are searched by the vectorized search.
+When a search_statistics is given, the search counts its work in it (see SearchStatistics).
+The candidate constraints of the user input (such as 7sa15i, see CandidateConstraint) are applied before the search : the
+searches of undivided groups are given a table without the monsters they exclude (see MonsterTable.with_candidate_constraints).
 '''
-def deduce_monsters_from_usergroups(usergroups, monster_map, unidentified_group_map, unidentified_group_to_monster_set_map):
+def generate_monsters_from_usergroups(
+            usergroups,
+            monster_table,
+            co_occurrence_mask_map=None,
+            group_co_occurring_monster_sets_map=None,
+            numpy_module=None,
+            search_statistics=None):
     known_monster_total_xp = 0
+    known_monster_co_occurrence_mask = -1
     known_monster_map = {}
     user_unidentified_group_map = {}
+    if CANDIDATE_CONSTRAINTS_KEY in usergroups and group_co_occurring_monster_sets_map is None:
+        monster_table = monster_table.with_candidate_constraints(usergroups[CANDIDATE_CONSTRAINTS_KEY])
     for key in usergroups:
         if key == "x":
             continue
         if key == "c":
             continue
-        if key in unidentified_group_map:
+        if key == CANDIDATE_CONSTRAINTS_KEY:
+            continue
+        if key in monster_table.group_ids:
             user_unidentified_group_map[key] = usergroups[key]
             continue
-        if key in monster_map:
+        if key in monster_table.monster_ids:
             known_monster_map[key] = usergroups[key]
-            known_monster_total_xp = int(known_monster_total_xp) + int(monster_map[key]["xp"]) * int(usergroups[key])
+            known_monster_total_xp += monster_table.monster_xp[monster_table.monster_ids[key]] * usergroups[key]
+            if co_occurrence_mask_map is not None:
+                known_monster_co_occurrence_mask &= co_occurrence_mask_map[key]
         else:
-            sys.stderr.write("error - some programming error allowed usergroups to contain a non-recognized key\n")
-            sys.exit(1)
+            raise InvalidKeyError("error : the query holds '%s', which is neither a monster key nor an unidentified group key\n" % key)
     deduced_monster_map_list = [ {} ] # default for when there are no unidentified groups
-    if len(user_unidentified_group_map) > 0:
-        deduced_monster_map_list = recursively_search_unidentified_groups_for_satisfactory_monster_maps(
+    if known_monster_co_occurrence_mask == 0:
+        return # the identified monsters can not occur in one encounter
+    if len(user_unidentified_group_map) > 0 and group_co_occurring_monster_sets_map is not None:
+        deduced_monster_map_list = search_divided_unidentified_groups_for_satisfactory_monster_maps(
+                usergroups,
+                user_unidentified_group_map,
+                monster_table,
+                group_co_occurring_monster_sets_map,
+                known_monster_total_xp,
+                co_occurrence_mask_map,
+                known_monster_co_occurrence_mask,
+                search_statistics)
+    elif len(user_unidentified_group_map) > 0 and numpy_module is not None:
+        deduced_monster_map_list = search_unidentified_groups_for_satisfactory_monster_maps_with_numpy(
+                numpy_module,
+                usergroups,
+                user_unidentified_group_map,
+                monster_table,
+                known_monster_total_xp,
+                co_occurrence_mask_map,
+                known_monster_co_occurrence_mask,
+                search_statistics)
+    elif len(user_unidentified_group_map) > 0:
+        deduced_monster_map_list = search_unidentified_groups_for_satisfactory_monster_maps(
                 usergroups,
                 user_unidentified_group_map,
-                monster_map,
-                unidentified_group_map,
-                unidentified_group_to_monster_set_map,
-                known_monster_total_xp)
-    # add in the known monsters
+                monster_table,
+                known_monster_total_xp,
+                co_occurrence_mask_map,
+                known_monster_co_occurrence_mask,
+                search_statistics)
     for deduced_monster_map in deduced_monster_map_list:
+        # add in the known monsters
         for known_monster in known_monster_map:
             if known_monster in deduced_monster_map:
-                deduced_monster_map[known_monster] = str(int(deduced_monster_map[known_monster]) + int(known_monster_map[known_monster]))
+                deduced_monster_map[known_monster] += known_monster_map[known_monster]
             else:
                 deduced_monster_map[known_monster] = known_monster_map[known_monster]
-    # report case if xp requirements are not satisfied (only happens when all monsters were known)
-    cases_to_skip_in_output = []
-    for deduced_monster_map in deduced_monster_map_list:
-        computed_total_xp = compute_total_xp(deduced_monster_map, monster_map)
+        # drop the case where xp requirements are not satisfied (only happens when all monsters were known, and is then
+        # reported as no identification, with the nearest xp which matches the monster counts)
+        computed_total_xp = compute_total_xp(deduced_monster_map, monster_table)
         if not xp_total_matches_close_enough(usergroups, computed_total_xp):
-            sys.stderr.write("The xp computation for this case does not match what was computed from the monster counts.\n")
-            sys.stderr.write("This case will not be output:\n\t%s\n" % str(deduced_monster_map))
-            cases_to_skip_in_output.append(deduced_monster_map)
-    return_list = []
-    for deduced_monster_map in deduced_monster_map_list:
-        if not deduced_monster_map in cases_to_skip_in_output:
-            return_list.append(deduced_monster_map)
-    return return_list
+            continue
+        yield deduced_monster_map
 
 '''
-spaces will be ignored ... so collapse all command line arguments into a single string
+the list of every assignment of generate_monsters_from_usergroups (same arguments)
 '''
-def construct_user_query(args):
-    joined_args = ""
-    for arg in args[1:]:
-        joined_args += "".join(arg.split())
-    return joined_args
+def deduce_monsters_from_usergroups(
+            usergroups,
+            monster_table,
+            co_occurrence_mask_map=None,
+            group_co_occurring_monster_sets_map=None,
+            numpy_module=None,
+            search_statistics=None):
+    return list(generate_monsters_from_usergroups(
+            usergroups,
+            monster_table,
+            co_occurrence_mask_map,
+            group_co_occurring_monster_sets_map,
+            numpy_module,
+            search_statistics))
 
-def output_entity_term(key, count, monster_map, unidentified_group_map, user_value_flag):
-    if user_value_flag:
-        sys.stdout.write("[input] ")
-    if key in unidentified_group_map:
-        sys.stdout.write(" - %s %s\n" % (count, unidentified_group_map[key]["key_name"]))
-    else:
-        sys.stdout.write(" - %s %s\n" % (count, monster_map[key]["key_name"]))
+'''
+precomputed solution index :
+For a query, only the unidentified groups with more than one possible monster ("ambiguous" groups) need a search. Every other
+term (identified monsters and groups with a single possible monster) adds a fixed xp amount. The index stores, for each
+combination of ambiguous groups and kill counts, every selection of monsters sorted by its xp total. A lookup finds the block of
+its ambiguous groups and bisects the xp totals for the few values which complete a satisfactory total, so the party size and the
+other terms of the query never multiply the size of the index.
+Only combinations of ambiguous groups which can occur together (following the co_occur_keys chains) are indexed, up to
+max_groups distinct groups with counts from 1 to max_count. Queries outside of that space are answered by the search.
 
-def output_entities_from_map(entity_map, monster_map, unidentified_group_map, user_value_flag):
-    for key in entity_map:
-        if key == "x" or key == "c":
-            continue
-        count = entity_map[key]
-        output_entity_term(key, count, monster_map, unidentified_group_map, user_value_flag)
+file layout (all integers little endian):
+  8 bytes      magic SOLUTION_INDEX_MAGIC
+  uint32       length of the header
+  header       json : format version, hash of the data files, max_groups, max_count, candidate monster keys of each group, block count
+  block table  block count * (uint64 hash of block key, uint64 offset of block from the start of the blocks)  sorted by hash
+  blocks       each : uint32 key length, key (such as "3mia6mir4pri"), uint8 group count, uint32 total count,
+               total count * uint32 xp totals (ascending), (total count + 1) * uint32 first selection of each total,
+               selections (group count bytes each : the index of the selected monster within each group's sorted candidates)
+'''
+SOLUTION_INDEX_MAGIC = b"WMIDX\x00\x00\x01"
+DEFAULT_SOLUTION_INDEX_FILENAME = "wizardry_monster_id.idx"
+SOLUTION_INDEX_FORMAT_VERSION = 1
 
-def output_xp_and_character_count(usergroups):
-    xp = usergroups["x"]
-    character_count = usergroups["c"]
-    sys.stdout.write("[input] (%s experience points for" % (xp))
-    sys.stdout.write(" %s characters)\n" % (character_count))
+'''
+hash of the contents of both data files, used to reject an index built from other data
+'''
+def compute_data_files_hash():
+    import hashlib
+    data_hash = hashlib.sha256()
+    for filename in [UNIDENTIFIED_GROUPS_FILENAME, MONSTERS_FILENAME]:
+        with open(find_data_file(filename), 'rb') as file:
+            data_hash.update(file.read())
+    return data_hash.hexdigest()
 
-def output_user_input(usergroups, monster_map, unidentified_group_map):
-    output_entities_from_map(usergroups, monster_map, unidentified_group_map, True)
-    output_xp_and_character_count(usergroups)
+def compute_index_key_hash(index_key):
+    import hashlib
+    return struct.unpack("<Q", hashlib.blake2b(index_key.encode(), digest_size=8).digest())[0]
+
+'''
+key of the index block for a list of (group key, count) pairs of ambiguous groups (sorted by group key)
+'''
+def construct_index_key(ambiguous_group_count_pairs):
+    return "".join("%d%s" % (count, group_key) for group_key, count in ambiguous_group_count_pairs)
 
-def output_deduced_monster_assignment(monster_map, unidentified_group_map, deduced_monster_assignment):
-    output_entities_from_map(deduced_monster_assignment, monster_map, unidentified_group_map, False)
+def group_is_ambiguous(group_key, monster_table):
+    return len(monster_table.group_monster_ids(group_key)) > 1
 
 '''
-If only one assignment gives the correct total, output all mosters with counts and xp contribution.
-If zero or more than one assignment gives the correct total, output the situation to user
+sorted list of tuples of ambiguous group keys (at most max_groups per tuple) which can occur together in one encounter
 '''
-def output_deduced_monster_assignments(usergroups, monster_map, unidentified_group_map, deduced_monster_assignments):
-    if len(deduced_monster_assignments) == 0:
-        sys.stdout.write("Could not find identification for:\n")
-        output_user_input(usergroups, monster_map, unidentified_group_map)
-        sys.exit(0)
-    if len(deduced_monster_assignments) > 1:
-        sys.stdout.write("More than one selection of specific monsters yields the correct xp total. Perhaps examine the first monster group, the rendered image, and the potential co-spawners. All valid selections:\n")
-    for deduced_monster_assignment in deduced_monster_assignments:
-        output_deduced_monster_assignment(monster_map, unidentified_group_map, deduced_monster_assignment)
-        if len(deduced_monster_assignments) > 1:
-            sys.stdout.write("----------------------------------------\n")
+def find_indexed_ambiguous_group_tuples(co_occurrence_graph, monster_table, max_groups):
+    group_tuple_set = set()
+    for node_set in co_occurrence_graph.chain_node_sets():
+        ambiguous_group_keys = set()
+        for node_id in node_set:
+            group_key = co_occurrence_graph.group_keys[node_id]
+            if group_is_ambiguous(group_key, monster_table):
+                ambiguous_group_keys.add(group_key)
+        for group_count in range(1, min(len(ambiguous_group_keys), max_groups) + 1):
+            for group_tuple in itertools.combinations(sorted(ambiguous_group_keys), group_count):
+                group_tuple_set.add(group_tuple)
+    return sorted(group_tuple_set)
 
-def main():
-    unidentified_groups = []
-    monsters = []
-    unidentified_group_map = {}
-    monster_map = {}
-    read_obj_list_from_file('unidentified_groups.json', "unidentified groups", unidentified_groups)
-    read_obj_list_from_file('monsters.json', "monsters", monsters)
-    construct_key_map(unidentified_group_map, unidentified_groups)
-    construct_key_map(monster_map, monsters)
-    validate_keys(monster_map, "monsters.json")
-    validate_keys(unidentified_group_map, "unidentified_groups.json")
-    unidentified_group_to_monster_set_map = {}
-    construct_unidentified_group_to_monster_map(monster_map, unidentified_group_map, unidentified_group_to_monster_set_map)
-    if len(sys.argv) == 1 or user_is_asking_for_help(sys.argv[1]):
-            show_usage()
-            return
-    if sys.argv[1] == "codes":
-            write_out_monster_codes_and_unidentified_group_codes(monster_map, unidentified_group_map)
-            return
-    if sys.argv[1] == "groups":
-            write_out_unidentified_groups_and_possible_monsters_for_each(monster_map, unidentified_group_map, unidentified_group_to_monster_set_map)
-            return
-    else:
-        userstring = construct_user_query(sys.argv)
-        usergroups = parse_groups_from_input(userstring, monster_map, unidentified_group_map)
-        deduced_monster_assignments = deduce_monsters_from_usergroups(usergroups, monster_map, unidentified_group_map, unidentified_group_to_monster_set_map)
-        output_deduced_monster_assignments(usergroups, monster_map, unidentified_group_map, deduced_monster_assignments)
+'''
+every selection of monsters for the groups (each with its kill count), encoded as an index block
+'''
+def construct_index_block(index_key, group_tuple, counts, monster_table, numpy_module=None):
+    candidate_lists = []
+    for group_key, count in zip(group_tuple, counts):
+        candidate_lists.append(construct_candidate_list_for_unidentified_group(group_key, count, monster_table, None))
+    if numpy_module is not None:
+        return construct_index_block_with_numpy(numpy_module, index_key, candidate_lists)
+    xp_choices = []
+    for choice in itertools.product(*[range(len(candidate_list)) for candidate_list in candidate_lists]):
+        xp_total = 0
+        for index, candidate_index in enumerate(choice):
+            xp_total += candidate_lists[index][candidate_index][0]
+        xp_choices.append((xp_total, choice))
+    xp_choices.sort()
+    totals = []
+    starts = []
+    for selection_index, (xp_total, choice) in enumerate(xp_choices):
+        if len(totals) == 0 or totals[-1] != xp_total:
+            totals.append(xp_total)
+            starts.append(selection_index)
+    starts.append(len(xp_choices))
+    encoded_key = index_key.encode()
+    return b"".join([
+            struct.pack("<I", len(encoded_key)),
+            encoded_key,
+            struct.pack("<BI", len(group_tuple), len(totals)),
+            struct.pack("<%dI" % len(totals), *totals),
+            struct.pack("<%dI" % len(starts), *starts),
+            b"".join(bytes(choice) for xp_total, choice in xp_choices)])
+
+'''
+the same block as construct_index_block, from the array of the xp totals of every selection (see construct_xp_total_grid).
+A stable sort of the flattened array orders equal totals by selection, as the sort of (xp total, selection) pairs does.
+'''
+def construct_index_block_with_numpy(numpy_module, index_key, candidate_lists):
+    xp_totals = construct_xp_total_grid(numpy_module, candidate_lists).ravel()
+    order = numpy_module.argsort(xp_totals, kind="stable")
+    sorted_xp_totals = xp_totals[order]
+    totals, starts = numpy_module.unique(sorted_xp_totals, return_index=True)
+    choices = numpy_module.stack(numpy_module.unravel_index(order, [len(candidate_list) for candidate_list in candidate_lists]), axis=-1)
+    encoded_key = index_key.encode()
+    return b"".join([
+            struct.pack("<I", len(encoded_key)),
+            encoded_key,
+            struct.pack("<BI", len(candidate_lists), len(totals)),
+            totals.astype("<u4").tobytes(),
+            numpy_module.append(starts, len(order)).astype("<u4").tobytes(),
+            choices.astype(numpy_module.uint8).tobytes()])
+
+'''
+enumerates the indexed space (see the description of the solution index above) and writes the index file
+'''
+def build_solution_index(filename, monster_map, monster_table, max_groups, max_count, numpy_module=None):
+    import json
+    import shutil
+    group_tuples = find_indexed_ambiguous_group_tuples(CoOccurrenceGraph(monster_map), monster_table, max_groups)
+    block_table = []
+    blocks_filename = filename + ".blocks"
+    with open(blocks_filename, 'wb') as blocks_file:
+        for tuple_number, group_tuple in enumerate(group_tuples, start=1):
+            for counts in itertools.product(range(1, max_count + 1), repeat=len(group_tuple)):
+                index_key = construct_index_key(zip(group_tuple, counts))
+                block_table.append((compute_index_key_hash(index_key), blocks_file.tell()))
+                blocks_file.write(construct_index_block(index_key, group_tuple, counts, monster_table, numpy_module))
+            sys.stderr.write("indexed group combination %d of %d (%s)\n" % (tuple_number, len(group_tuples), ",".join(group_tuple)))
+    block_table.sort()
+    candidate_keys = {}
+    for group in monster_table.groups:
+        if group_is_ambiguous(group.key, monster_table):
+            candidate_keys[group.key] = [monster_table.monster_keys[monster_id] for monster_id in group.monster_ids]
+    header = json.dumps({
+            "format_version": SOLUTION_INDEX_FORMAT_VERSION,
+            "data_hash": compute_data_files_hash(),
+            "max_groups": max_groups,
+            "max_count": max_count,
+            "candidate_keys": candidate_keys,
+            "block_count": len(block_table)}).encode()
+    with open(filename + ".tmp", 'wb') as index_file:
+        index_file.write(SOLUTION_INDEX_MAGIC)
+        index_file.write(struct.pack("<I", len(header)))
+        index_file.write(header)
+        for key_hash, block_offset in block_table:
+            index_file.write(struct.pack("<QQ", key_hash, block_offset))
+        with open(blocks_filename, 'rb') as blocks_file:
+            shutil.copyfileobj(blocks_file, index_file)
+    os.remove(blocks_filename)
+    os.replace(filename + ".tmp", filename)
+    return len(block_table)
+
+'''
+read only view of an index file through a memory map. Raises StaleIndexError if the index was not built by this version of
+the program from the current data files.
+'''
+class SolutionIndex:
+    def __init__(self, filename):
+        import json
+        import mmap
+        with open(filename, 'rb') as file:
+            self.buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.buffer[:len(SOLUTION_INDEX_MAGIC)] != SOLUTION_INDEX_MAGIC:
+            raise StaleIndexError("error : file '%s' is not a solution index (or was built by another version of this program)\n" % filename)
+        header_length = struct.unpack_from("<I", self.buffer, len(SOLUTION_INDEX_MAGIC))[0]
+        header_offset = len(SOLUTION_INDEX_MAGIC) + 4
+        self.header = json.loads(self.buffer[header_offset:header_offset + header_length].decode())
+        if self.header["format_version"] != SOLUTION_INDEX_FORMAT_VERSION or self.header["data_hash"] != compute_data_files_hash():
+            raise StaleIndexError("error : solution index '%s' does not match the current data files, rebuild it with build-index\n" % filename)
+        self.max_count = self.header["max_count"]
+        self.candidate_keys = self.header["candidate_keys"]
+        self.block_count = self.header["block_count"]
+        self.table_offset = header_offset + header_length
+        self.blocks_offset = self.table_offset + 16 * self.block_count
+
+    '''
+    returns the offset of the block with index_key, or None when the index does not cover it
+    '''
+    def find_block(self, index_key):
+        key_hash = compute_index_key_hash(index_key)
+        low = 0
+        high = self.block_count
+        while low < high:
+            middle = (low + high) // 2
+            if struct.unpack_from("<Q", self.buffer, self.table_offset + 16 * middle)[0] < key_hash:
+                low = middle + 1
+            else:
+                high = middle
+        encoded_key = index_key.encode()
+        while low < self.block_count:
+            entry_hash, block_offset = struct.unpack_from("<QQ", self.buffer, self.table_offset + 16 * low)
+            if entry_hash != key_hash:
+                break
+            offset = self.blocks_offset + block_offset
+            key_length = struct.unpack_from("<I", self.buffer, offset)[0]
+            if self.buffer[offset + 4:offset + 4 + key_length] == encoded_key:
+                return offset
+            low += 1
+        return None
+
+    '''
+    returns the list of selections (tuples of candidate indexes) in the block whose xp total is within [low_xp, high_xp]
+    '''
+    def find_selections(self, block_offset, low_xp, high_xp):
+        key_length = struct.unpack_from("<I", self.buffer, block_offset)[0]
+        offset = block_offset + 4 + key_length
+        group_count, total_count = struct.unpack_from("<BI", self.buffer, offset)
+        totals_offset = offset + 5
+        starts_offset = totals_offset + 4 * total_count
+        selections_offset = starts_offset + 4 * (total_count + 1)
+        low = 0
+        high = total_count
+        while low < high:
+            middle = (low + high) // 2
+            if struct.unpack_from("<I", self.buffer, totals_offset + 4 * middle)[0] < low_xp:
+                low = middle + 1
+            else:
+                high = middle
+        selections = []
+        total_index = low
+        while total_index < total_count and struct.unpack_from("<I", self.buffer, totals_offset + 4 * total_index)[0] <= high_xp:
+            first_selection, end_selection = struct.unpack_from("<II", self.buffer, starts_offset + 4 * total_index)
+            for selection_index in range(first_selection, end_selection):
+                selection_offset = selections_offset + group_count * selection_index
+                selections.append(tuple(self.buffer[selection_offset:selection_offset + group_count]))
+            total_index += 1
+        return selections
+
+'''
+answers a query from the solution index when the index covers its ambiguous groups, or else by the search.
+The assignments and their order are the same as generate_monsters_from_usergroups yields. (The index orders the selections by
+xp total, so the few selections within the satisfactory range are read and sorted before the first assignment is yielded.
+The index lists the candidates of each group in the order of the search, by monster id, so a selection holds the candidate
+indexes of the search.) A query with candidate constraints (see CandidateConstraint) is answered by the search, whose
+candidates the constraints already cut down.
+'''
+def generate_monsters_from_solution_index(usergroups, monster_table, solution_index, co_occurrence_mask_map=None, search_statistics=None):
+    if CANDIDATE_CONSTRAINTS_KEY in usergroups:
+        yield from generate_monsters_from_usergroups(usergroups, monster_table, co_occurrence_mask_map, search_statistics=search_statistics)
+        return
+    ambiguous_group_keys = []
+    fixed_xp_total = 0
+    for key in usergroups:
+        if key == "x" or key == "c":
+            continue
+        if key in monster_table.group_ids:
+            if key not in solution_index.candidate_keys:
+                monster_ids = monster_table.group_monster_ids(key)
+                if len(monster_ids) != 1:
+                    yield from generate_monsters_from_usergroups(usergroups, monster_table, co_occurrence_mask_map, search_statistics=search_statistics)
+                    return
+                fixed_xp_total += monster_table.monster_xp[monster_ids[0]] * usergroups[key]
+                continue
+            if usergroups[key] > solution_index.max_count:
+                yield from generate_monsters_from_usergroups(usergroups, monster_table, co_occurrence_mask_map, search_statistics=search_statistics)
+                return
+            ambiguous_group_keys.append(key)
+        elif key in monster_table.monster_ids:
+            fixed_xp_total += monster_table.monster_xp[monster_table.monster_ids[key]] * usergroups[key]
+    sorted_group_keys = sorted(ambiguous_group_keys)
+    index_key = construct_index_key((group_key, usergroups[group_key]) for group_key in sorted_group_keys)
+    block_offset = None
+    if len(sorted_group_keys) > 0:
+        block_offset = solution_index.find_block(index_key)
+    if block_offset is None:
+        yield from generate_monsters_from_usergroups(usergroups, monster_table, co_occurrence_mask_map, search_statistics=search_statistics)
+        return
+    selections = []
+    for low_xp, high_xp in shift_xp_ranges(satisfactory_total_xp_ranges(usergroups), fixed_xp_total):
+        selections += solution_index.find_selections(block_offset, low_xp, high_xp)
+    if search_statistics is not None:
+        search_statistics.nodes_visited += 1
+        search_statistics.leaves_tested += len(selections)
+    # order the selections as the search does (candidate index of each group in input order)
+    selection_positions = [sorted_group_keys.index(group_key) for group_key in ambiguous_group_keys]
+    choices = sorted((tuple(selection[position] for position in selection_positions), selection) for selection in selections)
+    user_group_keys = [key for key in usergroups if key in monster_table.group_ids]
+    for choice, selection in choices:
+        selected_candidate_indexes = dict(zip(sorted_group_keys, selection))
+        deduced_monster_map = {}
+        for group_key in reversed(user_group_keys):
+            monster_ids = monster_table.group_monster_ids(group_key)
+            if group_key in selected_candidate_indexes:
+                monster_ids = (monster_ids[selected_candidate_indexes[group_key]],)
+            for monster_id in monster_ids:
+                deduced_monster_map[monster_table.monster_keys[monster_id]] = usergroups[group_key]
+        for key in usergroups:
+            if key in monster_table.monster_ids:
+                if key in deduced_monster_map:
+                    deduced_monster_map[key] += usergroups[key]
+                else:
+                    deduced_monster_map[key] = usergroups[key]
+        if co_occurrence_mask_map is not None and not monsters_can_co_occur(deduced_monster_map, co_occurrence_mask_map):
+            if search_statistics is not None:
+                search_statistics.branches_pruned += 1
+            continue
+        yield deduced_monster_map
+
+def lookup_monsters_from_usergroups(usergroups, monster_table, solution_index, co_occurrence_mask_map=None, search_statistics=None):
+    return list(generate_monsters_from_solution_index(usergroups, monster_table, solution_index, co_occurrence_mask_map, search_statistics))
+
+'''
+ambiguity atlas : every ambiguous input of the space of the solution index (the combinations of up to max_groups ambiguous
+groups which can occur together, with counts from 1 to max_count), for every party size from 1 to MAX_PARTY_SIZE. An input
+(the kill counts of the groups, the xp to each survivor and the party size) is ambiguous when more than one assignment
+gives that xp. An assignment gives its total xp // c to each of c survivors, so the ambiguous xp values of one combination
+of counts are read from the sorted xp totals of its assignments, without searching any xp value. With --co-occur, the
+assignments whose monsters can not occur together are left out first (as the search does), which leaves far fewer
+ambiguous inputs. Queries with known monsters, groups of a single monster or candidate constraints are outside of the atlas.
+The space is swept in shards (a group tuple with the count of its first group), by --jobs worker processes. The atlas is
+written to FILE.partial, where each shard is committed as soon as it is swept, so that build-atlas run again with the same
+options after an interruption resumes with the shards which are left. FILE.partial is renamed FILE once every shard is swept.
+
+file : an sqlite database of three tables
+  meta             (name, value) : format_version, data_hash, max_groups, max_count and co_occur (1 or 0)
+  swept_shards     (shard) : the shards swept so far, such as "kim,mir,pri:2"
+  ambiguities      (terms, c, xp_count, xp_values) : the xp_count ambiguous xp values of the group terms (written as the
+                   keys of the index blocks, such as "1kim2mir2pri") for party size c, only when there is one. xp_values
+                   is a zlib compressed array of 2 * xp_count uint32 (little endian) : the ambiguous xp values (ascending,
+                   each but the first as its difference from the one before), then the number of assignments of each.
+'''
+AMBIGUITY_ATLAS_FORMAT_VERSION = 1
+DEFAULT_AMBIGUITY_ATLAS_FILENAME = "wizardry_monster_id.atlas"
+
+'''
+the shards of the atlas : (group tuple, count of its first group) pairs
+'''
+def find_ambiguity_atlas_shards(co_occurrence_graph, monster_table, max_groups, max_count):
+    shards = []
+    for group_tuple in find_indexed_ambiguous_group_tuples(co_occurrence_graph, monster_table, max_groups):
+        for first_count in range(1, max_count + 1):
+            shards.append((group_tuple, first_count))
+    return shards
+
+def construct_ambiguity_atlas_shard_name(group_tuple, first_count):
+    return "%s:%d" % (",".join(group_tuple), first_count)
+
+'''
+the sorted xp totals of every assignment of the groups (each with its kill count), leaving out those whose monsters can not
+occur together when a co_occurrence_mask_map is given
+'''
+def find_assignment_xp_totals(group_tuple, counts, monster_table, co_occurrence_mask_map):
+    selections = [(0, -1)]
+    for group_key, count in zip(group_tuple, counts):
+        candidate_list = construct_candidate_list_for_unidentified_group(group_key, count, monster_table, co_occurrence_mask_map)
+        selections = [(xp_total + candidate[0], co_occurrence_mask & candidate[2])
+                for xp_total, co_occurrence_mask in selections
+                for candidate in candidate_list
+                if co_occurrence_mask & candidate[2] != 0]
+    return sorted(xp_total for xp_total, co_occurrence_mask in selections)
+
+'''
+the ambiguous inputs of one shard : a (terms, party size, ambiguous xp values) entry for each combination of counts and party
+size having some, where the ambiguous xp values are (xp, number of assignments) pairs sorted by xp
+'''
+def sweep_ambiguity_atlas_shard(group_tuple, first_count, monster_table, max_count, co_occurrence_mask_map):
+    import collections
+    ambiguities = []
+    for other_counts in itertools.product(range(1, max_count + 1), repeat=len(group_tuple) - 1):
+        counts = (first_count,) + other_counts
+        xp_totals = find_assignment_xp_totals(group_tuple, counts, monster_table, co_occurrence_mask_map)
+        if len(xp_totals) < 2:
+            continue
+        terms = construct_index_key(zip(group_tuple, counts))
+        for party_size in range(1, MAX_PARTY_SIZE + 1):
+            assignment_counts = collections.Counter(xp_total // party_size for xp_total in xp_totals)
+            ambiguous_xp_values = sorted((xp, assignment_count) for xp, assignment_count in assignment_counts.items() if assignment_count > 1)
+            if len(ambiguous_xp_values) > 0:
+                ambiguities.append((terms, party_size, ambiguous_xp_values))
+    return ambiguities
+
+def encode_ambiguous_xp_values(ambiguous_xp_values):
+    import zlib
+    xp_differences = []
+    previous_xp = 0
+    for xp, assignment_count in ambiguous_xp_values:
+        xp_differences.append(xp - previous_xp)
+        previous_xp = xp
+    assignment_counts = [assignment_count for xp, assignment_count in ambiguous_xp_values]
+    return zlib.compress(struct.pack("<%dI" % (2 * len(ambiguous_xp_values)), *(xp_differences + assignment_counts)))
+
+def decode_ambiguous_xp_values(xp_count, encoded_xp_values):
+    import zlib
+    values = struct.unpack("<%dI" % (2 * xp_count), zlib.decompress(encoded_xp_values))
+    return list(zip(itertools.accumulate(values[:xp_count]), values[xp_count:]))
+
+'''
+parallel sweep : each worker process loads the data once, when it starts. The workers ignore interrupts, which the main
+process handles (see run_build_atlas).
+'''
+ambiguity_atlas_worker_arguments = None
+
+def initialize_ambiguity_atlas_worker(max_count, co_occur):
+    import signal
+    global ambiguity_atlas_worker_arguments
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    monster_data = load_monster_data_for_command_line()
+    identification_context = construct_identification_context(monster_data, {"co-occur": True} if co_occur else {})
+    ambiguity_atlas_worker_arguments = (monster_data["monster_table"], max_count, identification_context["co_occurrence_mask_map"])
+
+def sweep_ambiguity_atlas_shard_in_worker(shard):
+    return shard, sweep_ambiguity_atlas_shard(shard[0], shard[1], *ambiguity_atlas_worker_arguments)
+
+'''
+the (shard, ambiguities) pairs of the shards, in the order they are swept
+'''
+def generate_swept_ambiguity_atlas_shards(shards, monster_table, max_count, co_occurrence_mask_map, job_count):
+    if job_count == 1:
+        for shard in shards:
+            yield shard, sweep_ambiguity_atlas_shard(shard[0], shard[1], monster_table, max_count, co_occurrence_mask_map)
+        return
+    import concurrent.futures
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=job_count, initializer=initialize_ambiguity_atlas_worker, initargs=(max_count, co_occurrence_mask_map is not None)) as executor:
+        swept_shards = [executor.submit(sweep_ambiguity_atlas_shard_in_worker, shard) for shard in shards]
+        try:
+            for swept_shard in concurrent.futures.as_completed(swept_shards):
+                yield swept_shard.result()
+        finally:
+            for swept_shard in swept_shards:
+                swept_shard.cancel() # an interrupted sweep does not wait for the shards which are not started
+
+'''
+sweeps the shards of the atlas which FILE.partial does not hold yet (see the description of the ambiguity atlas above), then
+renames it FILE. Returns the number of shards and of ambiguous inputs. Raises StaleIndexError when FILE.partial was started
+with other options or data files.
+'''
+def build_ambiguity_atlas(filename, monster_map, monster_table, co_occurrence_mask_map, max_groups, max_count, job_count):
+    import sqlite3
+    shards = find_ambiguity_atlas_shards(CoOccurrenceGraph(monster_map), monster_table, max_groups, max_count)
+    meta = {
+            "format_version": str(AMBIGUITY_ATLAS_FORMAT_VERSION),
+            "data_hash": compute_data_files_hash(),
+            "max_groups": str(max_groups),
+            "max_count": str(max_count),
+            "co_occur": "1" if co_occurrence_mask_map is not None else "0"}
+    partial_filename = filename + ".partial"
+    connection = sqlite3.connect(partial_filename)
+    try:
+        with connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            connection.execute("CREATE TABLE IF NOT EXISTS swept_shards (shard TEXT PRIMARY KEY)")
+            connection.execute("CREATE TABLE IF NOT EXISTS ambiguities "
+                    "(terms TEXT NOT NULL, c INTEGER NOT NULL, xp_count INTEGER NOT NULL, xp_values BLOB NOT NULL, PRIMARY KEY (terms, c)) WITHOUT ROWID")
+            partial_meta = dict(connection.execute("SELECT name, value FROM meta"))
+            if len(partial_meta) == 0:
+                connection.executemany("INSERT INTO meta VALUES (?, ?)", meta.items())
+            elif partial_meta != meta:
+                raise StaleIndexError("error : '%s' was started with other options or data files : remove it, or run build-atlas with the options it was started with\n" % partial_filename)
+        swept_shard_names = set(shard_name for (shard_name,) in connection.execute("SELECT shard FROM swept_shards"))
+        remaining_shards = [shard for shard in shards if construct_ambiguity_atlas_shard_name(*shard) not in swept_shard_names]
+        swept_shard_count = len(shards) - len(remaining_shards)
+        if swept_shard_count > 0:
+            sys.stderr.write("resuming %s : %d of %d shards already swept\n" % (partial_filename, swept_shard_count, len(shards)))
+        for shard, ambiguities in generate_swept_ambiguity_atlas_shards(remaining_shards, monster_table, max_count, co_occurrence_mask_map, job_count):
+            with connection:
+                connection.executemany("INSERT INTO ambiguities VALUES (?, ?, ?, ?)", (
+                        (terms, party_size, len(ambiguous_xp_values), encode_ambiguous_xp_values(ambiguous_xp_values))
+                        for terms, party_size, ambiguous_xp_values in ambiguities))
+                connection.execute("INSERT INTO swept_shards VALUES (?)", (construct_ambiguity_atlas_shard_name(*shard),))
+            swept_shard_count += 1
+            sys.stderr.write("swept shard %d of %d (%s)\n" % (swept_shard_count, len(shards), construct_ambiguity_atlas_shard_name(*shard)))
+        ambiguous_input_count = int(connection.execute("SELECT TOTAL(xp_count) FROM ambiguities").fetchone()[0])
+    finally:
+        connection.close()
+    os.replace(partial_filename, filename)
+    return len(shards), ambiguous_input_count
+
+'''
+read only view of an atlas file. Raises StaleIndexError if it is not an atlas written by this version of the program from the
+current data files.
+'''
+class AmbiguityAtlas:
+    def __init__(self, filename):
+        import sqlite3
+        if not os.path.isfile(filename):
+            raise StaleIndexError("error : there is no ambiguity atlas '%s' (write it with build-atlas)\n" % filename)
+        self.connection = sqlite3.connect(filename)
+        try:
+            meta = dict(self.connection.execute("SELECT name, value FROM meta"))
+        except sqlite3.DatabaseError:
+            raise StaleIndexError("error : file '%s' is not an ambiguity atlas\n" % filename)
+        if meta.get("format_version") != str(AMBIGUITY_ATLAS_FORMAT_VERSION) or meta.get("data_hash") != compute_data_files_hash():
+            raise StaleIndexError("error : ambiguity atlas '%s' does not match the current data files, rebuild it with build-atlas\n" % filename)
+        self.max_groups = int(meta["max_groups"])
+        self.max_count = int(meta["max_count"])
+        self.co_occur = meta["co_occur"] == "1"
+
+    '''
+    true when the atlas holds the ambiguous inputs of the (group key, count) pairs (sorted by group key)
+    '''
+    def covers(self, ambiguous_group_count_pairs):
+        if len(ambiguous_group_count_pairs) == 0 or len(ambiguous_group_count_pairs) > self.max_groups:
+            return False
+        if any(count > self.max_count for group_key, count in ambiguous_group_count_pairs):
+            return False
+        group_tuple = tuple(group_key for group_key, count in ambiguous_group_count_pairs)
+        shard_name = construct_ambiguity_atlas_shard_name(group_tuple, ambiguous_group_count_pairs[0][1])
+        return self.connection.execute("SELECT 1 FROM swept_shards WHERE shard = ?", (shard_name,)).fetchone() is not None
+
+    '''
+    the ambiguous xp values of the group terms for a party size, as (xp, number of assignments) pairs sorted by xp
+    '''
+    def find_ambiguous_xp_values(self, terms, party_size):
+        row = self.connection.execute("SELECT xp_count, xp_values FROM ambiguities WHERE terms = ? AND c = ?", (terms, party_size)).fetchone()
+        if row is None:
+            return []
+        return decode_ambiguous_xp_values(row[0], row[1])
+
+'''
+canonical form of a parsed query : terms sorted by code with their counts (terms with the same code are already merged
+by parse_groups_from_input), then the xp and the character count (the default count of 6 when the user gave none).
+Queries which only differ in the order or the splitting of their terms share one canonical form. Example : 6o6sh470x6c
+The term of a group with candidate constraints is followed by them (see CandidateConstraint.format_terms). Example : 7sa=ch/gg15i2000x6c
+'''
+def construct_canonical_query(usergroups):
+    candidate_constraints = usergroups.get(CANDIDATE_CONSTRAINTS_KEY, {})
+    terms = []
+    for key in sorted(usergroups):
+        if key == "x" or key == "c" or key == CANDIDATE_CONSTRAINTS_KEY:
+            continue
+        terms.append("%d%s" % (usergroups[key], key))
+        if key in candidate_constraints:
+            terms.append(candidate_constraints[key].format_terms())
+    terms.append("%sx" % format_query_count(usergroups["x"]))
+    terms.append("%sc" % format_query_count(usergroups["c"]))
+    return "".join(terms)
+
+'''
+usergroups with the keys in canonical order (as parsed from the canonical query)
+'''
+def construct_canonical_usergroups(usergroups):
+    canonical_usergroups = {}
+    for key in sorted(usergroups):
+        if key == "x" or key == "c" or key == CANDIDATE_CONSTRAINTS_KEY:
+            continue
+        canonical_usergroups[key] = usergroups[key]
+    if CANDIDATE_CONSTRAINTS_KEY in usergroups:
+        canonical_usergroups[CANDIDATE_CONSTRAINTS_KEY] = usergroups[CANDIDATE_CONSTRAINTS_KEY]
+    canonical_usergroups["x"] = usergroups["x"]
+    canonical_usergroups["c"] = usergroups["c"]
+    return canonical_usergroups
+
+SOLUTION_CACHE_FORMAT_VERSION = 2
+DEFAULT_SOLUTION_CACHE_CAPACITY = 4096
+
+'''
+bounded cache of deduction results with least recently used eviction, keyed by canonical query (see construct_solution_cache_key).
+The cached value is a tuple of assignments, each a tuple of (monster key, integer count) pairs.
+The cache can be saved to and loaded from a json file, so that it survives between invocations of the program.
+The cache may be shared by threads (see Identifier) : its entries and counters are only changed under its lock.
+'''
+class SolutionCache:
+    def __init__(self, capacity):
+        import collections
+        import threading
+        self.capacity = capacity
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def counters(self):
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "size": len(self.entries), "capacity": self.capacity}
+
+    '''
+    loads the entries saved by save (least recently used first). A missing file leaves the cache empty, and a file saved
+    from other data files is ignored.
+    '''
+    def load(self, filename, data_hash):
+        import json
+        if not os.path.exists(filename):
+            return
+        with open(filename, 'r') as file:
+            file_content = json.load(file)
+        if file_content.get("format_version") != SOLUTION_CACHE_FORMAT_VERSION or file_content.get("data_hash") != data_hash:
+            sys.stderr.write("warning : solution cache file %s was saved from other data files and is ignored\n" % filename)
+            return
+        for key, value in file_content["entries"]:
+            self.put(key, tuple(tuple(tuple(pair) for pair in assignment) for assignment in value))
+
+    def save(self, filename, data_hash):
+        import json
+        with self.lock:
+            file_content = {"format_version": SOLUTION_CACHE_FORMAT_VERSION, "data_hash": data_hash, "entries": list(self.entries.items())}
+        with open(filename + ".tmp", 'w') as file:
+            json.dump(file_content, file)
+        os.replace(filename + ".tmp", filename)
+
+'''
+the cache key is the canonical query prefixed with the search modes which change the result
+'''
+def construct_solution_cache_key(canonical_query, co_occurrence_mask_map, group_co_occurring_monster_sets_map):
+    modes = ""
+    if co_occurrence_mask_map is not None:
+        modes += "co-occur;"
+    if group_co_occurring_monster_sets_map is not None:
+        modes += "split;"
+    return modes + canonical_query
+
+'''
+answers the query from the solution index when one is given, otherwise by the search
+(the index does not hold divided groups, so the search is always used when group_co_occurring_monster_sets_map is given)
+When a solution_cache is given, the query is first put in canonical form, so that queries which only differ in the order of
+their terms are answered (in the same order) from one cache entry.
+The maps and options used are those of the identification context (see construct_identification_context).
+With a solution limit of N (--limit N or --unique), the search stops at the N + 1st assignment : at most N + 1 assignments
+are returned, and more than N means that the first N are not all of them (results cut short are not cached).
+'''
+def identify_monsters_from_usergroups(usergroups, identification_context, search_statistics=None):
+    monster_table = identification_context["monster_table"]
+    co_occurrence_mask_map = identification_context["co_occurrence_mask_map"]
+    group_co_occurring_monster_sets_map = identification_context["group_co_occurring_monster_sets_map"]
+    solution_index = identification_context["solution_index"]
+    solution_cache = identification_context["solution_cache"]
+    assignment_limit = None
+    if identification_context["solution_limit"] is not None:
+        assignment_limit = identification_context["solution_limit"] + 1
+    if solution_cache is not None:
+        usergroups = construct_canonical_usergroups(usergroups)
+        cache_key = construct_solution_cache_key(construct_canonical_query(usergroups), co_occurrence_mask_map, group_co_occurring_monster_sets_map)
+        cached_assignments = solution_cache.get(cache_key)
+        if cached_assignments is not None:
+            return [dict(assignment) for assignment in cached_assignments[:assignment_limit]]
+    if solution_index is None or group_co_occurring_monster_sets_map is not None:
+        deduced_monster_assignments = generate_monsters_from_usergroups(
+                usergroups, monster_table, co_occurrence_mask_map, group_co_occurring_monster_sets_map, identification_context["numpy_module"], search_statistics)
+    else:
+        deduced_monster_assignments = generate_monsters_from_solution_index(usergroups, monster_table, solution_index, co_occurrence_mask_map, search_statistics)
+    deduced_monster_assignments = list(itertools.islice(deduced_monster_assignments, assignment_limit))
+    if solution_cache is not None and (assignment_limit is None or len(deduced_monster_assignments) < assignment_limit):
+        solution_cache.put(cache_key, tuple(tuple(assignment.items()) for assignment in deduced_monster_assignments))
+    return deduced_monster_assignments
+
+'''
+the largest xp total the kills of the user input could give (each group taken as its monster with the most xp)
+'''
+def find_maximum_total_xp(usergroups, monster_table):
+    maximum_total_xp = 0
+    for key in usergroups:
+        if key == "x" or key == "c" or key == CANDIDATE_CONSTRAINTS_KEY:
+            continue
+        if key in monster_table.group_ids:
+            maximum_total_xp += max(monster_table.monster_xp[monster_id] for monster_id in monster_table.group_monster_ids(key)) * usergroups[key]
+        else:
+            maximum_total_xp += monster_table.monster_xp[monster_table.monster_ids[key]] * usergroups[key]
+    return maximum_total_xp
+
+'''
+when the xp of the user input has no valid selection, finds the nearest xp which has one (the xp was perhaps misread) : the
+query is answered again (see identify_monsters_from_usergroups) for a range of xp around the user xp, doubling its distance
+until a selection is found or the range holds every xp the kills could give. Each search of a range bisects sorted tables of
+xp sums (see search_unidentified_groups_for_satisfactory_monster_maps), so it costs about as much as a search of one xp.
+Returns the sorted list of the xp values with a valid selection at the smallest distance (one above and one below on a tie),
+or an empty list when there is none at all.
+'''
+def find_nearest_feasible_xp_values(usergroups, identification_context, search_statistics=None):
+    monster_table = identification_context["monster_table"]
+    user_xp = usergroups["x"]
+    party_sizes = find_party_sizes(usergroups)
+    highest_xp = max(find_maximum_total_xp(usergroups, monster_table) // party_sizes[0], user_xp)
+    unlimited_identification_context = dict(identification_context, solution_limit=None)
+    distance = 1
+    while True:
+        nearby_xp_values = range(max(user_xp - distance, 0), min(user_xp + distance, highest_xp) + 1)
+        nearby_usergroups = dict(usergroups, x=nearby_xp_values)
+        nearest_xp_values = set()
+        nearest_distance = None
+        for deduced_monster_assignment in identify_monsters_from_usergroups(nearby_usergroups, unlimited_identification_context, search_statistics):
+            xp_total = compute_total_xp(deduced_monster_assignment, monster_table)
+            for party_size in party_sizes:
+                xp = xp_total // party_size
+                if xp not in nearby_xp_values:
+                    continue
+                if nearest_distance is None or abs(xp - user_xp) < nearest_distance:
+                    nearest_distance = abs(xp - user_xp)
+                    nearest_xp_values = set()
+                if abs(xp - user_xp) == nearest_distance:
+                    nearest_xp_values.add(xp)
+        if len(nearest_xp_values) > 0:
+            return sorted(nearest_xp_values)
+        if nearby_xp_values[0] == 0 and nearby_xp_values[-1] == highest_xp:
+            return []
+        distance *= 2
+
+'''
+the bitsets of sums of xp (see find_consistent_encounter_run_xp_sums and EncounterSession) hold a bit per xp up to the highest
+sum the kills can give, so they are only built for kills which can give at most MAX_XP_SUM xp (far above any award of the
+game, where a monster gives at most 44090 xp)
+'''
+MAX_XP_SUM = 1 << 25
+
+'''
+raises InvalidQueryError when a bitset of sums of xp up to highest_xp_sum would be too large (see MAX_XP_SUM)
+'''
+def check_xp_sum_bitset_width(highest_xp_sum, kills_description):
+    if highest_xp_sum > MAX_XP_SUM:
+        raise InvalidQueryError("error : %s could give up to %d xp, more than the %d xp which can be followed\n" % (kills_description, highest_xp_sum, MAX_XP_SUM))
+
+'''
+the choices of one encounter of a run (see identify_encounter_run), grouped by the xp they give to each survivor : a map of xp
+to the list of (party size, assignment) giving that xp, in search order. Every assignment of the encounter is found (the query
+is answered for every xp its kills could give), and with a range of character counts, an assignment is a choice for each
+party size.
+'''
+def find_encounter_choices_by_xp(usergroups, identification_context, search_statistics=None):
+    monster_table = identification_context["monster_table"]
+    party_sizes = find_party_sizes(usergroups)
+    every_xp_usergroups = dict(usergroups, x=range(0, find_maximum_total_xp(usergroups, monster_table) // party_sizes[0] + 1))
+    unlimited_identification_context = dict(identification_context, solution_limit=None)
+    choices_by_xp = {}
+    for deduced_monster_assignment in identify_monsters_from_usergroups(every_xp_usergroups, unlimited_identification_context, search_statistics):
+        xp_total = compute_total_xp(deduced_monster_assignment, monster_table)
+        for party_size in party_sizes:
+            choices_by_xp.setdefault(xp_total // party_size, []).append((party_size, deduced_monster_assignment))
+    return choices_by_xp
+
+'''
+the positions of the bits set in a (non negative) int, lowest first
+'''
+def find_set_bit_positions(bits):
+    return [position for position, bit in enumerate(reversed(bin(bits)[2:])) if bit == "1"]
+
+'''
+the sums of xp through a run of encounters which lead to the xp of the run, given the choices of each encounter grouped by xp
+(see find_encounter_choices_by_xp) and the xp values of the run : a list of bitsets (ints whose bit s is set for the sum s),
+one before each encounter and one after the last, where a sum is kept when the encounters before it can give it and the
+encounters after it can still complete it to an xp of the run.
+The bitsets are built forward from the sum 0 (the sums after an encounter are the sums before it shifted by each xp it can
+give), then narrowed backward from the xp of the run (every sum is empty when the xp of the run is above every reachable sum), so that the cost is a few shifts of an int per distinct xp of each
+encounter, however many assignments the encounters have together.
+'''
+def find_consistent_encounter_run_xp_sums(encounter_choices_by_xp, run_xp_values):
+    reachable_sums = [1]
+    for choices_by_xp in encounter_choices_by_xp:
+        sums = 0
+        for xp in choices_by_xp:
+            sums |= reachable_sums[-1] << xp
+        reachable_sums.append(sums)
+    # the masks are sized by the largest reachable sum, not by the xp of the run (which may be far above it)
+    highest_reachable_sum = reachable_sums[-1].bit_length() - 1
+    if run_xp_values[0] > highest_reachable_sum:
+        return [0] * len(reachable_sums)
+    run_xp_mask = ((1 << (min(run_xp_values[-1], highest_reachable_sum) + 1)) - 1) ^ ((1 << run_xp_values[0]) - 1)
+    consistent_sums = [reachable_sums[-1] & run_xp_mask]
+    for encounter_index in range(len(encounter_choices_by_xp) - 1, -1, -1):
+        sums = 0
+        for xp in encounter_choices_by_xp[encounter_index]:
+            sums |= consistent_sums[0] >> xp
+        consistent_sums.insert(0, reachable_sums[encounter_index] & sums)
+    return consistent_sums
+
+'''
+the number of joint assignments of a run : for each encounter from the last, the number of ways to complete each consistent sum
+before it is the sum over the xp it can give of its number of choices for that xp times the number of ways to complete the sum
+after it. Only the consistent sums are visited (see find_consistent_encounter_run_xp_sums).
+'''
+def count_encounter_run_joint_assignments(encounter_choices_by_xp, consistent_sums):
+    completion_counts = {xp_sum: 1 for xp_sum in find_set_bit_positions(consistent_sums[-1])}
+    for encounter_index in range(len(encounter_choices_by_xp) - 1, -1, -1):
+        choices_by_xp = encounter_choices_by_xp[encounter_index]
+        encounter_completion_counts = {}
+        for xp_sum in find_set_bit_positions(consistent_sums[encounter_index]):
+            encounter_completion_counts[xp_sum] = sum(len(choices) * completion_counts.get(xp_sum + xp, 0) for xp, choices in choices_by_xp.items())
+        completion_counts = encounter_completion_counts
+    return completion_counts.get(0, 0)
+
+'''
+the joint assignments of a run, as tuples of one index per encounter into its consistent choices (consistent_choices, a list per
+encounter of (xp, party size, assignment), see identify_encounter_run), in order of the xp given by the first encounters.
+The choices are followed from the sum 0 along the consistent sums only, so every partial joint assignment completes.
+'''
+def generate_encounter_run_joint_assignments(consistent_choices, consistent_sums, encounter_index=0, xp_sum=0):
+    if encounter_index == len(consistent_choices):
+        yield ()
+        return
+    for choice_index, (xp, party_size, deduced_monster_assignment) in enumerate(consistent_choices[encounter_index]):
+        if (consistent_sums[encounter_index + 1] >> (xp_sum + xp)) & 1:
+            for joint_assignment in generate_encounter_run_joint_assignments(consistent_choices, consistent_sums, encounter_index + 1, xp_sum + xp):
+                yield (choice_index,) + joint_assignment
+
+'''
+joint identification of a run of encounters whose xp was only read for the whole run (see parse_encounter_run_from_input) : a
+joint assignment is one assignment per encounter such that the sum of the xp each encounter gives to each of its survivors
+(its xp total divided by its party size) is an xp of the run.
+The encounters are not combined by the cross product of their assignments, which grows exponentially with the run : each
+encounter is searched once for all of its assignments (see find_encounter_choices_by_xp), and only the xp they give takes part
+in the combination, by dynamic programming over the sums of xp (see find_consistent_encounter_run_xp_sums). The joint
+assignments are counted over the sums (see count_encounter_run_joint_assignments), and only the first ones are enumerated with a
+solution limit. raises InvalidQueryError when the kills of the run could give more than MAX_XP_SUM xp to a survivor.
+returns (the consistent choices of each encounter : a list per encounter of the (xp, party size, assignment) which belong to at
+least one joint assignment, by xp ; the number of joint assignments ; the list of joint assignments (see
+generate_encounter_run_joint_assignments), with at most solution limit + 1 of them)
+'''
+def identify_encounter_run(encounters, run_xp, identification_context, search_statistics=None):
+    monster_table = identification_context["monster_table"]
+    check_xp_sum_bitset_width(sum(find_maximum_total_xp(usergroups, monster_table) // find_party_sizes(usergroups)[0] for usergroups in encounters), "the kills of the run")
+    encounter_choices_by_xp = [find_encounter_choices_by_xp(usergroups, identification_context, search_statistics) for usergroups in encounters]
+    consistent_sums = find_consistent_encounter_run_xp_sums(encounter_choices_by_xp, find_user_xp_values({"x": run_xp}))
+    joint_assignment_count = count_encounter_run_joint_assignments(encounter_choices_by_xp, consistent_sums)
+    consistent_choices = []
+    for encounter_index, choices_by_xp in enumerate(encounter_choices_by_xp):
+        encounter_consistent_choices = []
+        for xp in sorted(choices_by_xp):
+            if (consistent_sums[encounter_index] << xp) & consistent_sums[encounter_index + 1]:
+                encounter_consistent_choices.extend((xp, party_size, deduced_monster_assignment) for party_size, deduced_monster_assignment in choices_by_xp[xp])
+        consistent_choices.append(encounter_consistent_choices)
+    joint_assignments = generate_encounter_run_joint_assignments(consistent_choices, consistent_sums)
+    solution_limit = identification_context["solution_limit"]
+    if solution_limit is not None:
+        joint_assignments = itertools.islice(joint_assignments, solution_limit + 1)
+    return consistent_choices, joint_assignment_count, list(joint_assignments)
+
+'''
+runs build-index with its command line arguments : [--max-groups N] [--max-count N] [FILE] (options already separated)
+'''
+def run_build_index(args, options, monster_map, monster_table):
+    numpy_module = find_numpy_module() # the index is the same either way, numpy only builds it faster
+    filename = DEFAULT_SOLUTION_INDEX_FILENAME
+    if len(args) > 0:
+        filename = args[0]
+    max_groups = parse_positive_int_option(options, "max-groups", 3)
+    max_count = parse_positive_int_option(options, "max-count", 9)
+    block_count = build_solution_index(filename, monster_map, monster_table, max_groups, max_count, numpy_module)
+    sys.stdout.write("wrote solution index %s (%d blocks, up to %d ambiguous groups with counts up to %d)\n" % (filename, block_count, max_groups, max_count))
+
+'''
+runs build-atlas with its command line arguments : [--max-groups N] [--max-count N] [--co-occur] [--jobs N] [FILE]
+(options already separated)
+'''
+def run_build_atlas(args, options, monster_data):
+    filename = DEFAULT_AMBIGUITY_ATLAS_FILENAME
+    if len(args) > 0:
+        filename = args[0]
+    max_groups = parse_positive_int_option(options, "max-groups", 3)
+    max_count = parse_positive_int_option(options, "max-count", 9)
+    job_count = parse_batch_job_count(options)
+    co_occurrence_mask_map = construct_identification_context(monster_data, options)["co_occurrence_mask_map"]
+    try:
+        shard_count, ambiguous_input_count = build_ambiguity_atlas(
+                filename, monster_data["monster_map"], monster_data["monster_table"], co_occurrence_mask_map, max_groups, max_count, job_count)
+    except KeyboardInterrupt:
+        sys.stderr.write("interrupted : the shards swept so far are saved in %s.partial, run build-atlas again with the same options to resume\n" % filename)
+        sys.exit(1)
+    sys.stdout.write("wrote ambiguity atlas %s (%d ambiguous inputs in %d shards, up to %d ambiguous groups%s with counts up to %d)\n" % (
+            filename, ambiguous_input_count, shard_count, max_groups, " which can occur together" if co_occurrence_mask_map is not None else "", max_count))
+
+'''
+runs atlas with its command line arguments : [--atlas-file FILE] TERM ... XP_TERM (options already separated). Writes each
+ambiguous input of the atlas with the kill counts of the query, within its xp (or range of xp) and its party sizes, as a
+query followed by its number of assignments.
+'''
+def run_atlas(args, options, identifier):
+    identification_context = identifier.identification_context
+    monster_table = identification_context["monster_table"]
+    ambiguity_atlas = AmbiguityAtlas(options.get("atlas-file", DEFAULT_AMBIGUITY_ATLAS_FILENAME))
+    try:
+        usergroups = identifier.parse(construct_user_query(args))
+    except InvalidQueryError as e:
+        sys.stderr.write(str(e))
+        write_expected_input(identification_context["monster_map"], identification_context["unidentified_group_map"])
+        sys.exit(1)
+    ambiguous_group_count_pairs = []
+    for key in usergroups:
+        if key == "x" or key == "c":
+            continue
+        if key == CANDIDATE_CONSTRAINTS_KEY or key not in monster_table.group_ids or not group_is_ambiguous(key, monster_table):
+            ambiguous_group_count_pairs = None
+            break
+        ambiguous_group_count_pairs.append((key, usergroups[key]))
+    party_sizes = find_party_sizes(usergroups)
+    if ambiguous_group_count_pairs is None or party_sizes[-1] > MAX_PARTY_SIZE or not ambiguity_atlas.covers(sorted(ambiguous_group_count_pairs)):
+        sys.stderr.write("error : the atlas only holds the queries of up to %d unidentified groups having several possible monsters, which can occur together, with counts up to %d\n" % (
+                ambiguity_atlas.max_groups, ambiguity_atlas.max_count))
+        sys.exit(1)
+    terms = construct_index_key(sorted(ambiguous_group_count_pairs))
+    user_xp_values = find_user_xp_values(usergroups)
+    ambiguous_input_count = 0
+    for party_size in party_sizes:
+        for xp, assignment_count in ambiguity_atlas.find_ambiguous_xp_values(terms, party_size):
+            if xp in user_xp_values:
+                sys.stdout.write("%s%dx%dc : %d assignments\n" % (terms, xp, party_size, assignment_count))
+                ambiguous_input_count += 1
+    if ambiguous_input_count == 0:
+        sys.stdout.write("no ambiguous input of %s within %sx%sc\n" % (terms, format_query_count(usergroups["x"]), format_query_count(usergroups["c"])))
+
+'''
+spaces will be ignored ... so collapse all command line arguments into a single string
+'''
+def construct_user_query(args):
+    joined_args = ""
+    for arg in args:
+        joined_args += "".join(arg.split())
+    return joined_args
+
+'''
+command line options are the arguments starting with "--" : flag options (such as --co-occur) map to True and
+value options take the following argument (or the text after "=") as their value.
+returns a map of option name (without the dashes) to value, and the list of remaining arguments.
+Programs which import this one may accept more options with extra_flag_options and extra_value_options.
+'''
+def separate_options_from_args(args, extra_flag_options=(), extra_value_options=()):
+    flag_options = {"co-occur", "split", "cache-stats", "numpy", "unordered", "stats", "profile-per-query", "unique", "any-party-size"}
+    flag_options.update(extra_flag_options)
+    value_options = {"index", "atlas-file", "ambiguity-policy", "format", "max-groups", "max-count", "socket", "cache-size", "cache-file", "jobs", "chunk-size", "stats-format", "profile", "limit"}
+    value_options.update(extra_value_options)
+    options = {}
+    remaining_args = []
+    index = 0
+    while index < len(args):
+        arg = args[index]
+        index += 1
+        if not arg.startswith("--"):
+            remaining_args.append(arg)
+            continue
+        name, separator, value = arg[2:].partition("=")
+        if name in flag_options and not separator:
+            options[name] = True
+        elif name in value_options:
+            if not separator:
+                if index == len(args):
+                    raise InvalidOptionError("error : option '--%s' requires a value\n" % name)
+                value = args[index]
+                index += 1
+            options[name] = value
+        else:
+            raise InvalidOptionError("error : unrecognized option '%s'\n" % arg)
+    return options, remaining_args
+
+def parse_positive_int_option(options, name, default_value):
+    if name not in options:
+        return default_value
+    value = str(options[name])
+    if not value.isdigit() or int(value) == 0:
+        raise InvalidOptionError("error : option '--%s' requires a positive integer (not '%s')\n" % (name, value))
+    return int(value)
+
+def parse_non_negative_int_option(options, name, default_value):
+    if name not in options:
+        return default_value
+    value = str(options[name])
+    if not value.isdigit():
+        raise InvalidOptionError("error : option '--%s' requires a non-negative integer (not '%s')\n" % (name, value))
+    return int(value)
+
+def output_entity_term(key, count, monster_map, unidentified_group_map, user_value_flag):
+    if user_value_flag:
+        sys.stdout.write("[input] ")
+    if key in unidentified_group_map:
+        sys.stdout.write(" - %s %s\n" % (count, unidentified_group_map[key]["key_name"]))
+    else:
+        sys.stdout.write(" - %s %s\n" % (count, monster_map[key]["key_name"]))
+
+def output_entities_from_map(entity_map, monster_map, unidentified_group_map, user_value_flag):
+    for key in entity_map:
+        if key == "x" or key == "c" or key == CANDIDATE_CONSTRAINTS_KEY:
+            continue
+        count = entity_map[key]
+        output_entity_term(key, count, monster_map, unidentified_group_map, user_value_flag)
+
+def output_xp_and_character_count(usergroups):
+    xp = usergroups["x"]
+    character_count = usergroups["c"]
+    sys.stdout.write("[input] (%s experience points for" % (format_query_count(xp)))
+    sys.stdout.write(" %s characters)\n" % (format_query_count(character_count)))
+
+def output_candidate_constraints(usergroups, monster_map, unidentified_group_map):
+    for group_key, constraint in usergroups.get(CANDIDATE_CONSTRAINTS_KEY, {}).items():
+        if constraint.pinned_keys is not None:
+            pinned_names = [monster_map[key]["key_name"] for key in constraint.pinned_keys]
+            sys.stdout.write("[input] (%s pinned to : %s)\n" % (unidentified_group_map[group_key]["key_name"], ", ".join(pinned_names)))
+        if constraint.image_index is not None:
+            sys.stdout.write("[input] (%s showed image %d)\n" % (unidentified_group_map[group_key]["key_name"], constraint.image_index))
+
+def output_user_input(usergroups, monster_map, unidentified_group_map):
+    output_entities_from_map(usergroups, monster_map, unidentified_group_map, True)
+    output_candidate_constraints(usergroups, monster_map, unidentified_group_map)
+    output_xp_and_character_count(usergroups)
+
+def output_identified_monsters(monster_map, unidentified_group_map, identified_monsters):
+    for identified_monster in identified_monsters:
+        output_entity_term(identified_monster.key, identified_monster.count, monster_map, unidentified_group_map, False)
+
+'''
+the xp an assignment gives (written when the user xp is a range, to tell which xp of the range each assignment gives)
+'''
+def output_deduced_monster_assignment_xp(xp_total, party_size):
+    sys.stdout.write("   (%d experience points : %d to each of %d survivor%s)\n" % (xp_total, xp_total // party_size, party_size, "" if party_size == 1 else "s"))
+
+'''
+the assignments grouped by party size, for a user input whose character count is a range : a list of (party size, indexes of
+the assignments whose xp total, split among that many characters, is the user xp), one per party size of the range.
+An assignment may satisfy several party sizes (only when the user xp is smaller than the party sizes).
+'''
+def group_assignments_by_party_size(usergroups, deduced_monster_assignments, monster_table):
+    xp_totals = [compute_total_xp(deduced_monster_assignment, monster_table) for deduced_monster_assignment in deduced_monster_assignments]
+    party_size_groups = []
+    for party_size in find_party_sizes(usergroups):
+        party_size_groups.append((party_size, [index for index, xp_total in enumerate(xp_totals) if xp_total // party_size in find_user_xp_values(usergroups)]))
+    return party_size_groups
+
+'''
+If only one assignment gives the correct total, output all mosters with counts and xp contribution.
+If zero or more than one assignment gives the correct total, output the situation to user
+When the solution limit cut the assignments short, only the assignments found first are output.
+When the character count is a range, the assignments are output under each party size they satisfy.
+When the xp is a range, the xp of each assignment is output too.
+When no assignment satisfies the xp, the nearest xp with a valid selection is suggested.
+'''
+def output_identification_result(identification_result, monster_map, unidentified_group_map):
+    usergroups = identification_result.usergroups
+    assignments = identification_result.assignments
+    xp_totals = identification_result.xp_totals
+    if len(assignments) == 0:
+        sys.stdout.write("Could not find identification for:\n")
+        output_user_input(usergroups, monster_map, unidentified_group_map)
+        nearest_xp_values = identification_result.nearest_xp
+        if nearest_xp_values is not None and len(nearest_xp_values) > 0:
+            sys.stdout.write("The nearest experience points with a valid selection : %s\n" % " or ".join("%dx" % xp for xp in nearest_xp_values))
+        elif nearest_xp_values is not None:
+            sys.stdout.write("No experience points at all have a valid selection for these monsters.\n")
+        return
+    several_assignments = len(assignments) > 1 or identification_result.truncated
+    if identification_result.truncated:
+        sys.stdout.write("More than one selection of specific monsters yields the correct xp total. Perhaps examine the first monster group, the rendered image, and the potential co-spawners. The search stopped after the first %d valid selection%s:\n" % (len(assignments), "" if len(assignments) == 1 else "s"))
+    elif several_assignments:
+        sys.stdout.write("More than one selection of specific monsters yields the correct xp total. Perhaps examine the first monster group, the rendered image, and the potential co-spawners. All valid selections:\n")
+    if identification_result.party_sizes is not None:
+        for party_size_result in identification_result.party_sizes:
+            party_size = party_size_result.party_size
+            assignment_indexes = party_size_result.assignment_indexes
+            sys.stdout.write("with %d surviving character%s : %d valid selection%s\n" % (
+                    party_size, "" if party_size == 1 else "s", len(assignment_indexes), "" if len(assignment_indexes) == 1 else "s"))
+            for index in assignment_indexes:
+                output_identified_monsters(monster_map, unidentified_group_map, assignments[index])
+                if xp_totals is not None:
+                    output_deduced_monster_assignment_xp(xp_totals[index], party_size)
+                sys.stdout.write("----------------------------------------\n")
+        return
+    for index, assignment in enumerate(assignments):
+        output_identified_monsters(monster_map, unidentified_group_map, assignment)
+        if xp_totals is not None:
+            output_deduced_monster_assignment_xp(xp_totals[index], usergroups["c"])
+        if several_assignments:
+            sys.stdout.write("----------------------------------------\n")
+
+'''
+the choice of one encounter within a joint assignment of a run
+'''
+def output_encounter_choice(encounter_number, encounter_choice, monster_map, unidentified_group_map):
+    party_size = encounter_choice.party_size
+    sys.stdout.write("encounter %d : %d experience points to each of %d survivor%s\n" % (encounter_number, encounter_choice.xp, party_size, "" if party_size == 1 else "s"))
+    output_identified_monsters(monster_map, unidentified_group_map, encounter_choice.assignment)
+
+'''
+If only one joint assignment gives the xp of the run, output the monsters of each encounter with the xp it gives.
+Otherwise output the number of joint assignments and of the choices of each encounter which belong to one, then the joint
+assignments (only the first ones when the solution limit cut them short).
+'''
+def output_encounter_run_result(encounter_run_result, monster_map, unidentified_group_map):
+    if encounter_run_result.joint_assignment_count == 0:
+        sys.stdout.write("Could not find identification for the run:\n")
+        for encounter_number, usergroups in enumerate(encounter_run_result.encounters, start=1):
+            sys.stdout.write("[input] encounter %d (%s characters)\n" % (encounter_number, format_query_count(usergroups["c"])))
+            output_entities_from_map(usergroups, monster_map, unidentified_group_map, True)
+            output_candidate_constraints(usergroups, monster_map, unidentified_group_map)
+        sys.stdout.write("[input] (%s experience points over the run)\n" % format_query_count(encounter_run_result.run_xp))
+        return
+    several_assignments = encounter_run_result.joint_assignment_count > 1
+    if several_assignments:
+        sys.stdout.write("More than one selection of specific monsters yields the experience points of the run : %d joint selections.\n" % encounter_run_result.joint_assignment_count)
+        for encounter_number, encounter_choices in enumerate(encounter_run_result.choices, start=1):
+            sys.stdout.write("encounter %d : %d valid selection%s\n" % (encounter_number, len(encounter_choices), "" if len(encounter_choices) == 1 else "s"))
+        if encounter_run_result.truncated:
+            sys.stdout.write("The first %d joint selection%s:\n" % (len(encounter_run_result.joint_assignments), "" if len(encounter_run_result.joint_assignments) == 1 else "s"))
+        else:
+            sys.stdout.write("All joint selections:\n")
+    for joint_assignment in encounter_run_result.joint_assignments:
+        for encounter_index, choice_index in enumerate(joint_assignment):
+            output_encounter_choice(encounter_index + 1, encounter_run_result.choices[encounter_index][choice_index], monster_map, unidentified_group_map)
+        if several_assignments:
+            sys.stdout.write("----------------------------------------\n")
+
+'''
+the data files (and the default data bundle) are found in the directory named by the environment variable
+DATA_DIRECTORY_ENVIRONMENT_VARIABLE when it is set, otherwise in the directory of this program (following symbolic links),
+whatever the working directory is
+'''
+DATA_DIRECTORY_ENVIRONMENT_VARIABLE = "WIZARDRY_MONSTER_ID_DATA"
+MONSTERS_FILENAME = "monsters.json"
+UNIDENTIFIED_GROUPS_FILENAME = "unidentified_groups.json"
+
+def find_data_file(filename):
+    data_directory = os.environ.get(DATA_DIRECTORY_ENVIRONMENT_VARIABLE)
+    if not data_directory:
+        data_directory = os.path.dirname(os.path.realpath(__file__))
+    return os.path.join(data_directory, filename)
+
+'''
+reads both data files and builds the lookup maps used by every command
+returns a tuple (monster_map, unidentified_group_map, unidentified_group_to_monster_set_map)
+'''
+def load_monster_data():
+    unidentified_groups = []
+    monsters = []
+    unidentified_group_map = {}
+    monster_map = {}
+    read_obj_list_from_file(find_data_file(UNIDENTIFIED_GROUPS_FILENAME), "unidentified groups", unidentified_groups)
+    read_obj_list_from_file(find_data_file(MONSTERS_FILENAME), "monsters", monsters)
+    construct_key_map(unidentified_group_map, unidentified_groups)
+    construct_key_map(monster_map, monsters)
+    validate_keys(monster_map, MONSTERS_FILENAME)
+    validate_keys(unidentified_group_map, UNIDENTIFIED_GROUPS_FILENAME)
+    unidentified_group_to_monster_set_map = {}
+    construct_unidentified_group_to_monster_map(monster_map, unidentified_group_map, unidentified_group_to_monster_set_map)
+    return monster_map, unidentified_group_map, unidentified_group_to_monster_set_map
+
+'''
+every co_occur_key must be the key of a monster (the co-occurrence searches follow them)
+'''
+def validate_co_occur_keys(monster_map, source_filename):
+    for monster_key in monster_map:
+        for co_occur_key in monster_map[monster_key]["co_occur_keys"]:
+            if co_occur_key not in monster_map:
+                msg = "while reading file %s, monster '%s' has co_occur_key '%s' which is not a monster key\n" % (source_filename, monster_key, co_occur_key)
+                raise MissingKeyError(msg)
+
+'''
+compiled data bundle : the data files validated once, with every structure the commands derive from them, saved with pickle.
+While the bundle is newer than both data files it is loaded instead of them (see load_monster_data_bundle).
+The bundle is a dictionary of :
+  format_version                          MONSTER_DATA_BUNDLE_FORMAT_VERSION
+  data_hash                               compute_data_files_hash() of the data files it was compiled from
+  monster_map, unidentified_group_map,
+  unidentified_group_to_monster_set_map   as returned by load_monster_data
+  monster_table                           see MonsterTable
+  code_trie                               see construct_code_trie
+  co_occurrence_mask_map                  see construct_co_occurrence_mask_map
+  group_co_occurring_monster_sets_map     see construct_group_co_occurring_monster_sets_map
+'''
+MONSTER_DATA_BUNDLE_FORMAT_VERSION = 2
+DEFAULT_MONSTER_DATA_BUNDLE_FILENAME = "wizardry_monster_id.bundle"
+
+def construct_monster_data_bundle(monster_map, unidentified_group_map, unidentified_group_to_monster_set_map):
+    co_occurrence_graph = CoOccurrenceGraph(monster_map)
+    return {
+            "format_version": MONSTER_DATA_BUNDLE_FORMAT_VERSION,
+            "data_hash": compute_data_files_hash(),
+            "monster_map": monster_map,
+            "unidentified_group_map": unidentified_group_map,
+            "unidentified_group_to_monster_set_map": unidentified_group_to_monster_set_map,
+            "monster_table": MonsterTable(monster_map, unidentified_group_map),
+            "code_trie": construct_code_trie(monster_map, unidentified_group_map),
+            "co_occurrence_mask_map": construct_co_occurrence_mask_map(co_occurrence_graph),
+            "group_co_occurring_monster_sets_map": construct_group_co_occurring_monster_sets_map(co_occurrence_graph, unidentified_group_to_monster_set_map)}
+
+def compile_monster_data_bundle(filename):
+    import pickle
+    monster_map, unidentified_group_map, unidentified_group_to_monster_set_map = load_monster_data()
+    validate_co_occur_keys(monster_map, MONSTERS_FILENAME)
+    monster_data_bundle = construct_monster_data_bundle(monster_map, unidentified_group_map, unidentified_group_to_monster_set_map)
+    with open(filename + ".tmp", 'wb') as file:
+        pickle.dump(monster_data_bundle, file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(filename + ".tmp", filename)
+    return monster_data_bundle
+
+'''
+returns the bundle saved in filename when it exists, was compiled by this version of the program, and is newer than both
+data files. Otherwise returns None (and the data files should be read).
+'''
+def load_monster_data_bundle(filename):
+    import pickle
+    try:
+        bundle_modification_time = os.stat(filename).st_mtime
+        for data_filename in [UNIDENTIFIED_GROUPS_FILENAME, MONSTERS_FILENAME]:
+            if os.stat(find_data_file(data_filename)).st_mtime > bundle_modification_time:
+                return None
+        with open(filename, 'rb') as file:
+            monster_data_bundle = pickle.load(file)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        return None
+    if not isinstance(monster_data_bundle, dict) or monster_data_bundle.get("format_version") != MONSTER_DATA_BUNDLE_FORMAT_VERSION:
+        return None
+    return monster_data_bundle
+
+'''
+the data used by the command line : the compiled bundle when it is up to date, otherwise the maps read from the data files and
+the MonsterTable (the other structures of the bundle are then built when a command needs them)
+'''
+def load_monster_data_for_command_line():
+    monster_data_bundle = load_monster_data_bundle(find_data_file(DEFAULT_MONSTER_DATA_BUNDLE_FILENAME))
+    if monster_data_bundle is not None:
+        return monster_data_bundle
+    monster_map, unidentified_group_map, unidentified_group_to_monster_set_map = load_monster_data()
+    return {
+            "monster_map": monster_map,
+            "unidentified_group_map": unidentified_group_map,
+            "unidentified_group_to_monster_set_map": unidentified_group_to_monster_set_map,
+            "monster_table": MonsterTable(monster_map, unidentified_group_map)}
+
+def run_compile_data(args):
+    filename = find_data_file(DEFAULT_MONSTER_DATA_BUNDLE_FILENAME)
+    if len(args) > 0:
+        filename = args[0]
+    monster_data_bundle = compile_monster_data_bundle(filename)
+    sys.stdout.write("wrote data bundle %s (%d monsters, %d unidentified groups)\n" % (
+            filename, len(monster_data_bundle["monster_map"]), len(monster_data_bundle["unidentified_group_map"])))
+
+'''
+status is "none" when no assignment satisfies the xp total, "unique" for exactly one, and "ambiguous" otherwise
+'''
+def deduced_monster_assignments_status(deduced_monster_assignments):
+    if len(deduced_monster_assignments) == 0:
+        return "none"
+    if len(deduced_monster_assignments) == 1:
+        return "unique"
+    return "ambiguous"
+
+'''
+one monster of an assignment of an IdentificationResult : its key, key_name (as output) and the count killed
+'''
+class IdentifiedMonster:
+    __slots__ = ("key", "key_name", "count")
+
+    def __init__(self, key, key_name, count):
+        self.key = key
+        self.key_name = key_name
+        self.count = count
+
+'''
+one party size of a query whose character count is a range : its status (see deduced_monster_assignments_status) and the
+indexes of the assignments (within IdentificationResult.assignments) which satisfy it
+'''
+class PartySizeResult:
+    __slots__ = ("party_size", "status", "assignment_indexes")
+
+    def __init__(self, party_size, status, assignment_indexes):
+        self.party_size = party_size
+        self.status = status
+        self.assignment_indexes = assignment_indexes
+
+'''
+the identification of one query (see Identifier.identify) :
+  query          the query as given
+  usergroups     the parsed query (see parse_groups_from_input)
+  status         "unique", "ambiguous" or "none" (see deduced_monster_assignments_status)
+  assignments    list of the assignments, each a list of IdentifiedMonster
+  truncated      true when the solution limit (--limit N or --unique) left out some assignments
+  party_sizes    list of PartySizeResult when the character count is a range, otherwise None
+  xp_totals      list of the xp total of each assignment when the xp is a range, otherwise None
+  nearest_xp     when no assignment satisfies the xp (a single value), the sorted list of the nearest xp values which have one
+                 (see find_nearest_feasible_xp_values), otherwise None
+  statistics     the SearchStatistics of the query when the Identifier collects them, otherwise None
+'''
+class IdentificationResult:
+    __slots__ = ("query", "usergroups", "status", "assignments", "truncated", "party_sizes", "xp_totals", "nearest_xp", "statistics")
+
+    def __init__(self, query, usergroups):
+        self.query = query
+        self.usergroups = usergroups
+        self.status = "none"
+        self.assignments = []
+        self.truncated = False
+        self.party_sizes = None
+        self.xp_totals = None
+        self.nearest_xp = None
+        self.statistics = None
+
+    '''
+    the result as a json friendly record (as written by batch and serve). "truncated", "party_sizes", "xp_totals", "nearest_xp"
+    and "stats" are only present when they apply (party sizes are written as {"c": party size, "status": ..., "assignments": indexes}).
+    '''
+    def to_record(self):
+        record = {"query": self.query, "status": self.status}
+        if self.truncated:
+            record["truncated"] = True
+        record["assignments"] = []
+        for assignment in self.assignments:
+            record["assignments"].append([{"key": monster.key, "key_name": monster.key_name, "count": monster.count} for monster in assignment])
+        if self.party_sizes is not None:
+            record["party_sizes"] = [{"c": result.party_size, "status": result.status, "assignments": result.assignment_indexes} for result in self.party_sizes]
+        if self.xp_totals is not None:
+            record["xp_totals"] = self.xp_totals
+        if self.nearest_xp is not None:
+            record["nearest_xp"] = self.nearest_xp
+        if self.statistics is not None:
+            record["stats"] = self.statistics.to_record(single_query=True)
+        return record
+
+'''
+one choice of an encounter of a run (see identify_encounter_run) : the party size, the xp it gives to each survivor and its
+assignment, a list of IdentifiedMonster
+'''
+class EncounterChoice:
+    __slots__ = ("party_size", "xp", "assignment")
+
+    def __init__(self, party_size, xp, assignment):
+        self.party_size = party_size
+        self.xp = xp
+        self.assignment = assignment
+
+'''
+the joint identification of a run of encounters (see Identifier.identify_encounter_run) :
+  query          the query as given
+  encounters     the parsed query of each encounter, without "x" (see parse_encounter_run_from_input)
+  run_xp         the xp (or range of xp) of the whole run
+  status         "unique", "ambiguous" or "none" : whether the run has one, several or no joint assignment
+  joint_assignment_count  the number of joint assignments (all of them, even when they are truncated)
+  choices        for each encounter, the list of its EncounterChoice which belong to at least one joint assignment
+  joint_assignments  list of the joint assignments, each a list of one index per encounter into its choices
+  truncated      true when the solution limit (--limit N or --unique) left out some joint assignments
+  statistics     the SearchStatistics of the query when the Identifier collects them, otherwise None
+'''
+class EncounterRunResult:
+    __slots__ = ("query", "encounters", "run_xp", "status", "joint_assignment_count", "choices", "joint_assignments", "truncated", "statistics")
+
+    def __init__(self, query, encounters, run_xp):
+        self.query = query
+        self.encounters = encounters
+        self.run_xp = run_xp
+        self.status = "none"
+        self.joint_assignment_count = 0
+        self.choices = []
+        self.joint_assignments = []
+        self.truncated = False
+        self.statistics = None
+
+    '''
+    the result as a json friendly record (as written by batch and serve) : the choices of each encounter are written as
+    {"c": party size, "xp": xp to each survivor, "assignment": monsters as in the assignments of IdentificationResult.to_record}
+    '''
+    def to_record(self):
+        record = {"query": self.query, "status": self.status, "joint_assignment_count": self.joint_assignment_count}
+        if self.truncated:
+            record["truncated"] = True
+        record["encounters"] = []
+        for encounter_choices in self.choices:
+            record["encounters"].append([{"c": choice.party_size, "xp": choice.xp, "assignment": [
+                    {"key": monster.key, "key_name": monster.key_name, "count": monster.count} for monster in choice.assignment]} for choice in encounter_choices])
+        record["joint_assignments"] = [list(joint_assignment) for joint_assignment in self.joint_assignments]
+        if self.statistics is not None:
+            record["stats"] = self.statistics.to_record(single_query=True)
+        return record
+
+'''
+in process identification, for programs which import this one rather than running it (such as an encounter tracker) :
+the monster data is loaded (or monster_data, as returned by load_monster_data_for_command_line, is used) and the
+identification context is built once (see construct_identification_context), then each query costs only its search.
+options are those of the command line, without their dashes (such as {"co-occur": True, "limit": 5}), and command is the
+command whose defaults apply (the solution cache is on by default for "batch" and "serve").
+Nothing is written and the program never exits : a query which can not be parsed raises InvalidQueryError, an invalid option
+InvalidOptionError and a solution index of other data files StaleIndexError.
+An Identifier may be shared by threads : the searches only read the shared structures, and the solution cache and the
+statistics are only changed under a lock.
+Example :
+    identifier = Identifier({"co-occur": True})
+    result = identifier.identify("5pri1mil1176x")
+    result.status is "unique", and result.assignments[0] lists 1 master thief (lo) and 5 lvl 5 priest
+'''
+class Identifier:
+    def __init__(self, options=None, monster_data=None, command="serve"):
+        import threading
+        if options is None:
+            options = {}
+        if monster_data is None:
+            monster_data = load_monster_data_for_command_line()
+        solution_cache = construct_solution_cache(options, command)
+        solution_index = None
+        if "index" in options:
+            solution_index = SolutionIndex(options["index"])
+        self.identification_context = construct_identification_context(monster_data, options, solution_index, solution_cache)
+        self.statistics = None
+        if "stats" in options:
+            self.statistics = SearchStatistics()
+        self.lock = threading.Lock()
+
+    '''
+    the parsed query (see parse_groups_from_input), ignoring whitespace. raises InvalidQueryError
+    '''
+    def parse(self, query):
+        identification_context = self.identification_context
+        return parse_groups_from_input(
+                "".join(query.split()),
+                identification_context["monster_map"],
+                identification_context["unidentified_group_map"],
+                identification_context["code_trie"],
+                identification_context["default_character_count"])
+
+    '''
+    identifies the encounter of a query and returns its IdentificationResult. raises InvalidQueryError (with the statistics of
+    the query when they are collected) when the query can not be parsed.
+    '''
+    def identify(self, query):
+        identification_context = self.identification_context
+        monster_map = identification_context["monster_map"]
+        monster_table = identification_context["monster_table"]
+        query_statistics = None
+        if self.statistics is not None:
+            query_statistics = SearchStatistics()
+            query_statistics.queries = 1
+        start_time = time.perf_counter()
+        try:
+            usergroups = self.parse(query)
+        except InvalidQueryError as e:
+            if query_statistics is not None:
+                query_statistics.parse_seconds = time.perf_counter() - start_time
+                self.add_statistics(query_statistics)
+                e.statistics = query_statistics
+            raise
+        parse_time = time.perf_counter()
+        deduced_monster_assignments = identify_monsters_from_usergroups(usergroups, identification_context, query_statistics)
+        identification_result = IdentificationResult(query, usergroups)
+        identification_result.status = deduced_monster_assignments_status(deduced_monster_assignments)
+        solution_limit = identification_context["solution_limit"]
+        if solution_limit is not None and len(deduced_monster_assignments) > solution_limit:
+            deduced_monster_assignments = deduced_monster_assignments[:solution_limit]
+            identification_result.truncated = True
+        for deduced_monster_assignment in deduced_monster_assignments:
+            identification_result.assignments.append([IdentifiedMonster(key, monster_map[key]["key_name"], count) for key, count in deduced_monster_assignment.items()])
+        if isinstance(usergroups["c"], range):
+            identification_result.party_sizes = []
+            for party_size, assignment_indexes in group_assignments_by_party_size(usergroups, deduced_monster_assignments, monster_table):
+                identification_result.party_sizes.append(PartySizeResult(party_size, deduced_monster_assignments_status(assignment_indexes), assignment_indexes))
+        if isinstance(usergroups["x"], range):
+            identification_result.xp_totals = [compute_total_xp(assignment, monster_table) for assignment in deduced_monster_assignments]
+        elif identification_result.status == "none":
+            identification_result.nearest_xp = find_nearest_feasible_xp_values(usergroups, identification_context, query_statistics)
+        if query_statistics is not None:
+            query_statistics.parse_seconds = parse_time - start_time
+            query_statistics.search_seconds = time.perf_counter() - parse_time
+            query_statistics.solutions = len(identification_result.assignments)
+            identification_result.statistics = query_statistics
+            self.add_statistics(query_statistics)
+        return identification_result
+
+    '''
+    the parsed run of encounters (see parse_encounter_run_from_input), ignoring whitespace. raises InvalidQueryError
+    '''
+    def parse_encounter_run(self, query):
+        identification_context = self.identification_context
+        return parse_encounter_run_from_input(
+                "".join(query.split()),
+                identification_context["monster_map"],
+                identification_context["unidentified_group_map"],
+                identification_context["code_trie"],
+                identification_context["default_character_count"])
+
+    '''
+    jointly identifies the encounters of a run whose xp was only read for the whole run, such as
+    "5pri1mil,4pri6mir5c,1534x" (see identify_encounter_run), and returns its EncounterRunResult. raises
+    InvalidQueryError as identify does.
+    '''
+    def identify_encounter_run(self, query):
+        monster_map = self.identification_context["monster_map"]
+        query_statistics = None
+        if self.statistics is not None:
+            query_statistics = SearchStatistics()
+            query_statistics.queries = 1
+        start_time = time.perf_counter()
+        try:
+            encounters, run_xp = self.parse_encounter_run(query)
+        except InvalidQueryError as e:
+            if query_statistics is not None:
+                query_statistics.parse_seconds = time.perf_counter() - start_time
+                self.add_statistics(query_statistics)
+                e.statistics = query_statistics
+            raise
+        parse_time = time.perf_counter()
+        consistent_choices, joint_assignment_count, joint_assignments = identify_encounter_run(encounters, run_xp, self.identification_context, query_statistics)
+        encounter_run_result = EncounterRunResult(query, encounters, run_xp)
+        encounter_run_result.status = deduced_monster_assignments_status(range(min(joint_assignment_count, 2)))
+        encounter_run_result.joint_assignment_count = joint_assignment_count
+        for encounter_consistent_choices in consistent_choices:
+            encounter_run_result.choices.append([EncounterChoice(party_size, xp, [IdentifiedMonster(key, monster_map[key]["key_name"], count) for key, count in deduced_monster_assignment.items()])
+                    for xp, party_size, deduced_monster_assignment in encounter_consistent_choices])
+        solution_limit = self.identification_context["solution_limit"]
+        if solution_limit is not None and len(joint_assignments) > solution_limit:
+            joint_assignments = joint_assignments[:solution_limit]
+            encounter_run_result.truncated = True
+        encounter_run_result.joint_assignments = joint_assignments
+        if query_statistics is not None:
+            query_statistics.parse_seconds = parse_time - start_time
+            query_statistics.search_seconds = time.perf_counter() - parse_time
+            query_statistics.solutions = len(joint_assignments)
+            encounter_run_result.statistics = query_statistics
+            self.add_statistics(query_statistics)
+        return encounter_run_result
+
+    '''
+    adds statistics to those of the identifier (when it collects them)
+    '''
+    def add_statistics(self, statistics):
+        if self.statistics is None:
+            return
+        with self.lock:
+            self.statistics.add(statistics)
+
+'''
+the failures of a query which exhaust the resources of the search rather than reveal a bug : they are reported for that query
+(see describe_query_failure) and the stream of queries goes on
+'''
+QUERY_RESOURCE_ERRORS = (MemoryError, RecursionError)
+
+'''
+identifies the encounter of a single query (or the encounters of a run, see Identifier.identify_encounter_run) and returns
+a result record (a dictionary suitable for json output, see IdentificationResult.to_record and EncounterRunResult.to_record). Any problem with the query itself is reported in the record rather than raised.
+A query which exhausts the resources of the search (see QUERY_RESOURCE_ERRORS) is reported in the record as well (see
+describe_query_failure), so that one query can not abort a stream of queries (batch, serve, analyze). Any other exception is a
+bug and is raised.
+'''
+def identify_query(query, identifier):
+    try:
+        if ENCOUNTER_SEPARATOR in query:
+            return identifier.identify_encounter_run(query).to_record()
+        return identifier.identify(query).to_record()
+    except InvalidQueryError as e:
+        record = {"query": query, "status": "error", "error": str(e).strip()}
+        if e.position is not None:
+            record["position"] = e.position
+        if e.statistics is not None:
+            record["stats"] = e.statistics.to_record(single_query=True)
+        return record
+    except QUERY_RESOURCE_ERRORS as e:
+        return {"query": query, "status": "error", "error": describe_query_failure(e)}
+
+'''
+the error message of a query which failed with one of QUERY_RESOURCE_ERRORS
+'''
+def describe_query_failure(exception):
+    description = str(exception).strip()
+    if description == "":
+        return "error : the query could not be answered (%s)" % type(exception).__name__
+    return "error : the query could not be answered (%s : %s)" % (type(exception).__name__, description)
+
+'''
+incremental identification of the encounter in progress, for a tracker which learns of the kills one at a time during combat
+(see EncounterSession)
+'''
+EVENT_EXAMPLES = "'+3sa' (3 more kills), 'sa=ch' (group identified as a monster), '2100x' (experience points awarded) or '5c' (survivors)"
+
+'''
+the state of the encounter in progress, updated by events as they happen rather than parsed again from a whole query (see
+apply_event) :
+  add_kills(key, count)          count more kills (fewer when negative) of the unidentified group or monster key
+  identify_group(group_key, monster_key)  the group showed its identified name : it is only that monster
+  award_xp(xp)                   the xp (or range of xp) given to each survivor at the end of the encounter
+  set_character_count(count)     the party size (or range of party sizes), the default one until it is set
+The state holds, for each unidentified group in the order its kills were first reported, its options (each monster of the
+group it may be, or with --split each division of its count among monsters which can occur together, see
+construct_division_options_for_unidentified_group) with the xp each gives, and the partial sums of xp of the groups : a bitset
+per group (an int whose bit s is set when the groups up to it can give s xp). An event only rebuilds the options of the group it
+changes and the partial sums from that group on, and an event which changes neither (xp, party size) rebuilds nothing.
+find_feasible_assignments lists the assignments which give the xp awarded, walking the options of each group along the partial
+sums which can still reach it (narrowed backward from the satisfactory totals), so no branch which can not give the xp is
+visited. The assignments are those Identifier.identify finds for the equivalent query (see query), in the order the groups
+were reported. That is also the order of Identifier.identify only when its solution cache is off (--cache-size 0) : with the
+cache (the default of an Identifier), its answers follow the canonical order of the terms of the query.
+'''
+class EncounterSession:
+    def __init__(self, identifier):
+        identification_context = identifier.identification_context
+        self.identification_context = identification_context
+        self.monster_table = identification_context["monster_table"]
+        self.group_counts = {}
+        self.candidate_constraints = {}
+        self.known_monster_counts = {}
+        self.group_options = []
+        self.partial_xp_sums = [1]
+        self.user_xp = None
+        self.character_count = identification_context["default_character_count"]
+
+    '''
+    the query equivalent to the state, such as "7sa=ch2pri2100x6c" (without the xp until it is awarded)
+    '''
+    @property
+    def query(self):
+        terms = []
+        for group_key, count in self.group_counts.items():
+            terms.append("%d%s" % (count, group_key))
+            if group_key in self.candidate_constraints:
+                terms.append("=" + "/".join(self.candidate_constraints[group_key].pinned_keys))
+        for monster_key, count in self.known_monster_counts.items():
+            terms.append("%d%s" % (count, monster_key))
+        if self.user_xp is not None:
+            terms.append("%sx" % format_query_count(self.user_xp))
+        terms.append("%sc" % format_query_count(self.character_count))
+        return "".join(terms)
+
+    '''
+    the parsed form of query (see parse_groups_from_input)
+    '''
+    def construct_usergroups(self):
+        usergroups = dict(self.group_counts)
+        usergroups.update(self.known_monster_counts)
+        constraints = {group_key: constraint for group_key, constraint in self.candidate_constraints.items() if group_key in self.group_counts}
+        if len(constraints) > 0:
+            usergroups[CANDIDATE_CONSTRAINTS_KEY] = constraints
+        if self.user_xp is not None:
+            usergroups["x"] = self.user_xp
+        usergroups["c"] = self.character_count
+        return usergroups
+
+    def add_kills(self, key, count):
+        monster_table = self.monster_table
+        if key in monster_table.group_ids:
+            counts = self.group_counts
+        elif key in monster_table.monster_ids:
+            counts = self.known_monster_counts
+        else:
+            raise InvalidQueryError("error : '%s' is neither a monster key nor an unidentified group key\n" % key)
+        new_count = counts.get(key, 0) + count
+        if new_count < 0:
+            raise InvalidQueryError("error : only %d kills of '%s' were reported\n" % (counts.get(key, 0), key))
+        if counts is self.known_monster_counts:
+            if new_count == 0:
+                counts.pop(key, None)
+            else:
+                counts[key] = new_count
+            return
+        group_counts = dict(self.group_counts)
+        group_options = list(self.group_options)
+        partial_xp_sums = list(self.partial_xp_sums)
+        if key not in group_counts:
+            group_index = len(group_counts)
+            group_options.append(None)
+            partial_xp_sums.append(None)
+        else:
+            group_index = list(group_counts).index(key)
+        if new_count == 0:
+            del group_counts[key]
+            del group_options[group_index]
+            del partial_xp_sums[group_index + 1]
+        else:
+            group_counts[key] = new_count
+            check_xp_sum_bitset_width(find_maximum_total_xp(group_counts, monster_table), "the kills of the unidentified groups")
+            group_options[group_index] = self.construct_group_options(key, new_count, self.candidate_constraints.get(key))
+        self.update_partial_xp_sums(group_options, partial_xp_sums, group_index)
+        self.group_counts, self.group_options, self.partial_xp_sums = group_counts, group_options, partial_xp_sums
+
+    def identify_group(self, group_key, monster_key):
+        monster_table = self.monster_table
+        if group_key not in monster_table.group_ids:
+            raise InvalidQueryError("error : '%s' is not an unidentified group key\n" % group_key)
+        if monster_key not in monster_table.monster_ids or self.identification_context["monster_map"][monster_key]["group_key"] != group_key:
+            raise InvalidQueryError("error : '%s' is not a monster of unidentified group '%s'\n" % (monster_key, group_key))
+        constraint = CandidateConstraint()
+        constraint.pinned_keys = (monster_key,)
+        if group_key in self.group_counts:
+            group_index = list(self.group_counts).index(group_key)
+            group_options = list(self.group_options)
+            partial_xp_sums = list(self.partial_xp_sums)
+            group_options[group_index] = self.construct_group_options(group_key, self.group_counts[group_key], constraint)
+            self.update_partial_xp_sums(group_options, partial_xp_sums, group_index)
+            self.group_options, self.partial_xp_sums = group_options, partial_xp_sums
+        self.candidate_constraints[group_key] = constraint
+
+    def award_xp(self, xp):
+        self.user_xp = xp
+
+    def set_character_count(self, character_count):
+        if find_party_sizes({"c": character_count})[0] < 1:
+            raise InvalidQueryError("error : the character count must be at least 1\n")
+        self.character_count = character_count
+
+    '''
+    applies one event written as text : '+3sa' or '-1sa' (kills of a group or monster, see add_kills), 'sa=ch' (see
+    identify_group), '2100x' or '2100-2140x' (see award_xp), '5c' or '4-6c' (see set_character_count). Whitespace is ignored.
+    raises InvalidQueryError when the event can not be parsed or applied, or when the kills could give more than MAX_XP_SUM xp
+    (the state is then unchanged, as it is when the event fails in any other way)
+    '''
+    def apply_event(self, event):
+        event = "".join(event.split())
+        code_trie = self.identification_context["code_trie"]
+        if event[:1] in ("+", "-"):
+            tokens = tokenize_query(event[1:], code_trie)
+            if len(tokens) != 1 or tokens[0].kind not in ("monster", "unidentified_group") or tokens[0].high_count != tokens[0].count or tokens[0].pinned_codes is not None:
+                raise InvalidQueryError("error : a kill event is a number of kills of one group or monster, such as '+3sa' (not '%s')\n" % event)
+            self.add_kills(tokens[0].code, tokens[0].count if event[0] == "+" else -tokens[0].count)
+            return
+        if event[:1] not in "0123456789":
+            group_key = match_code_at_position(event, 0, code_trie, "unidentified_group")[0]
+            if group_key is None or event[len(group_key):len(group_key) + 1] != "=":
+                raise InvalidQueryError("error : could not parse event '%s', expected such as %s\n" % (event, EVENT_EXAMPLES))
+            monster_key = match_code_at_position(event, len(group_key) + 1, code_trie, "monster")[0]
+            if monster_key is None or len(group_key) + 1 + len(monster_key) != len(event):
+                raise InvalidQueryError("error : an identification event is a group key, '=' and the key of one of its monsters, such as 'sa=ch' (not '%s')\n" % event)
+            self.identify_group(group_key, monster_key)
+            return
+        tokens = tokenize_query(event, code_trie)
+        if len(tokens) != 1 or tokens[0].code not in ("x", "c") or tokens[0].high_count < tokens[0].count:
+            raise InvalidQueryError("error : could not parse event '%s', expected such as %s\n" % (event, EVENT_EXAMPLES))
+        count = tokens[0].count
+        if tokens[0].high_count != count:
+            count = range(count, tokens[0].high_count + 1)
+        if tokens[0].code == "x":
+            self.award_xp(count)
+        else:
+            self.set_character_count(count)
+
+    '''
+    the options of an unidentified group of count kills (under its constraint, or None) as a list of (division, xp,
+    co-occurrence mask) sorted by division, where a division is a tuple of (monster id, count) pairs (a single pair unless the
+    count is divided, see --split)
+    '''
+    def construct_group_options(self, group_key, count, candidate_constraint):
+        identification_context = self.identification_context
+        monster_table = self.monster_table
+        co_occurrence_mask_map = identification_context["co_occurrence_mask_map"]
+        group_co_occurring_monster_sets_map = identification_context["group_co_occurring_monster_sets_map"]
+        if group_co_occurring_monster_sets_map is not None:
+            option_map = construct_division_options_for_unidentified_group(
+                    group_key, count, monster_table, group_co_occurring_monster_sets_map, co_occurrence_mask_map, candidate_constraint)
+            return sorted((division, xp, co_occurrence_mask) for xp in option_map for division, co_occurrence_mask in option_map[xp])
+        options = []
+        for xp, monster_id, co_occurrence_mask in construct_candidate_list_for_unidentified_group(group_key, count, monster_table, co_occurrence_mask_map):
+            if candidate_constraint is None or candidate_constraint.allows_monster_keys((monster_table.monster_keys[monster_id],)):
+                options.append((((monster_id, count),), xp, co_occurrence_mask))
+        return options
+
+    '''
+    recomputes in partial_xp_sums the partial sums of group_options from group_index on (those before it are unchanged). The
+    events build the new options and sums in copies, which replace those of the state only once they are all built.
+    '''
+    def update_partial_xp_sums(self, group_options, partial_xp_sums, group_index):
+        for index in range(group_index, len(group_options)):
+            xp_sums = 0
+            for xp in set(xp for division, xp, co_occurrence_mask in group_options[index]):
+                xp_sums |= partial_xp_sums[index] << xp
+            partial_xp_sums[index + 1] = xp_sums
+
+    '''
+    the total xp and co-occurrence mask of the identified monsters
+    '''
+    def find_known_monster_xp_and_mask(self):
+        monster_table = self.monster_table
+        co_occurrence_mask_map = self.identification_context["co_occurrence_mask_map"]
+        known_monster_total_xp = 0
+        known_monster_co_occurrence_mask = -1
+        for monster_key, count in self.known_monster_counts.items():
+            known_monster_total_xp += monster_table.monster_xp[monster_table.monster_ids[monster_key]] * count
+            if co_occurrence_mask_map is not None:
+                known_monster_co_occurrence_mask &= co_occurrence_mask_map[monster_key]
+        return known_monster_total_xp, known_monster_co_occurrence_mask
+
+    '''
+    the partial sums of the groups which can still lead to a satisfactory total (see satisfactory_total_xp_ranges) : for each
+    group index, the sums of the groups before it which the groups from it on can complete, narrowed backward from the totals
+    '''
+    def find_consistent_partial_xp_sums(self, known_monster_total_xp):
+        satisfactory_xp_sums = 0
+        # the masks are sized by the largest reachable sum, not by the xp awarded (which may be far above it)
+        highest_reachable_sum = self.partial_xp_sums[-1].bit_length() - 1
+        for low_xp, high_xp in shift_xp_ranges(satisfactory_total_xp_ranges(self.construct_usergroups()), known_monster_total_xp):
+            if high_xp >= 0 and low_xp <= highest_reachable_sum:
+                satisfactory_xp_sums |= ((1 << (min(high_xp, highest_reachable_sum) + 1)) - 1) ^ ((1 << max(low_xp, 0)) - 1)
+        consistent_xp_sums = [None] * len(self.group_options) + [self.partial_xp_sums[-1] & satisfactory_xp_sums]
+        for index in range(len(self.group_options) - 1, -1, -1):
+            xp_sums = 0
+            for xp in set(xp for division, xp, co_occurrence_mask in self.group_options[index]):
+                xp_sums |= consistent_xp_sums[index + 1] >> xp
+            consistent_xp_sums[index] = self.partial_xp_sums[index] & xp_sums
+        return consistent_xp_sums
+
+    '''
+    the candidate monsters of each group, as a map of group key to the sorted list of the keys of the monsters it may still be :
+    those of the options which lead to a satisfactory total once the xp is awarded (with --co-occur, some of them may still
+    not co-occur with the other groups), or else every option
+    '''
+    def find_candidate_monsters(self):
+        consistent_xp_sums = None
+        if self.user_xp is not None:
+            consistent_xp_sums = self.find_consistent_partial_xp_sums(self.find_known_monster_xp_and_mask()[0])
+        candidate_monsters = {}
+        for index, group_key in enumerate(self.group_counts):
+            monster_ids = set()
+            for division, xp, co_occurrence_mask in self.group_options[index]:
+                if consistent_xp_sums is None or (consistent_xp_sums[index] << xp) & consistent_xp_sums[index + 1]:
+                    monster_ids.update(monster_id for monster_id, monster_count in division)
+            candidate_monsters[group_key] = [self.monster_table.monster_keys[monster_id] for monster_id in sorted(monster_ids)]
+        return candidate_monsters
+
+    '''
+    the lowest and highest xp each survivor may be given for the kills so far (for every party size allowed), or None when
+    the kills can not be those of any monsters (a group pinned to monsters it can not be divided among, with --split)
+    '''
+    def find_possible_xp_range(self):
+        if self.partial_xp_sums[-1] == 0:
+            return None
+        known_monster_total_xp = self.find_known_monster_xp_and_mask()[0]
+        party_sizes = find_party_sizes({"c": self.character_count})
+        lowest_xp_total = (self.partial_xp_sums[-1] & -self.partial_xp_sums[-1]).bit_length() - 1 + known_monster_total_xp
+        highest_xp_total = self.partial_xp_sums[-1].bit_length() - 1 + known_monster_total_xp
+        return lowest_xp_total // party_sizes[-1], highest_xp_total // party_sizes[0]
+
+    '''
+    the assignments which give the xp awarded, as deduced monster maps, up to the solution limit and one more (as
+    identify_monsters_from_usergroups returns them). raises InvalidQueryError when no xp was awarded yet.
+    '''
+    def find_feasible_assignments(self, search_statistics=None):
+        if self.user_xp is None:
+            raise InvalidQueryError("error : no experience points were awarded yet\n")
+        known_monster_total_xp, known_monster_co_occurrence_mask = self.find_known_monster_xp_and_mask()
+        if known_monster_co_occurrence_mask == 0:
+            return []
+        usergroups = self.construct_usergroups()
+        if len(self.group_options) == 0:
+            if xp_total_matches_close_enough(usergroups, known_monster_total_xp):
+                return [dict(self.known_monster_counts)]
+            return []
+        consistent_xp_sums = self.find_consistent_partial_xp_sums(known_monster_total_xp)
+        solution_limit = self.identification_context["solution_limit"]
+        assignments = []
+        for division_list in self.generate_consistent_divisions(consistent_xp_sums, 0, 0, known_monster_co_occurrence_mask, [], search_statistics):
+            deduced_monster_map = {}
+            # the last group is added first (as in search_unidentified_groups_for_satisfactory_monster_maps)
+            for division in reversed(division_list):
+                for monster_id, monster_count in division:
+                    deduced_monster_map[self.monster_table.monster_keys[monster_id]] = monster_count
+            for monster_key, count in self.known_monster_counts.items():
+                deduced_monster_map[monster_key] = deduced_monster_map.get(monster_key, 0) + count
+            assignments.append(deduced_monster_map)
+            if solution_limit is not None and len(assignments) > solution_limit:
+                break
+        return assignments
+
+    '''
+    depth first selection of one option per group (in the order of the options, so the selections come in the order of the
+    search), where an option is only taken when the sum it leads to is consistent (see find_consistent_partial_xp_sums)
+    '''
+    def generate_consistent_divisions(self, consistent_xp_sums, index, xp_sum, co_occurrence_mask, selected_divisions, search_statistics=None):
+        if search_statistics is not None:
+            search_statistics.nodes_visited += 1
+        if index == len(self.group_options):
+            if search_statistics is not None:
+                search_statistics.leaves_tested += 1
+            yield list(selected_divisions)
+            return
+        for division, xp, division_co_occurrence_mask in self.group_options[index]:
+            adjusted_co_occurrence_mask = co_occurrence_mask & division_co_occurrence_mask
+            if not (consistent_xp_sums[index + 1] >> (xp_sum + xp)) & 1 or adjusted_co_occurrence_mask == 0:
+                if search_statistics is not None:
+                    search_statistics.branches_pruned += 1
+                continue
+            selected_divisions.append(division)
+            yield from self.generate_consistent_divisions(consistent_xp_sums, index + 1, xp_sum + xp, adjusted_co_occurrence_mask, selected_divisions, search_statistics)
+            selected_divisions.pop()
+
+    '''
+    the IdentificationResult of the state (as Identifier.identify returns for query, see the order of the assignments above), or
+    None while no xp was awarded
+    '''
+    def identify(self):
+        if self.user_xp is None:
+            return None
+        monster_map = self.identification_context["monster_map"]
+        monster_table = self.monster_table
+        usergroups = self.construct_usergroups()
+        deduced_monster_assignments = self.find_feasible_assignments()
+        identification_result = IdentificationResult(self.query, usergroups)
+        identification_result.status = deduced_monster_assignments_status(deduced_monster_assignments)
+        solution_limit = self.identification_context["solution_limit"]
+        if solution_limit is not None and len(deduced_monster_assignments) > solution_limit:
+            deduced_monster_assignments = deduced_monster_assignments[:solution_limit]
+            identification_result.truncated = True
+        for deduced_monster_assignment in deduced_monster_assignments:
+            identification_result.assignments.append([IdentifiedMonster(key, monster_map[key]["key_name"], count) for key, count in deduced_monster_assignment.items()])
+        if isinstance(usergroups["c"], range):
+            identification_result.party_sizes = []
+            for party_size, assignment_indexes in group_assignments_by_party_size(usergroups, deduced_monster_assignments, monster_table):
+                identification_result.party_sizes.append(PartySizeResult(party_size, deduced_monster_assignments_status(assignment_indexes), assignment_indexes))
+        if isinstance(usergroups["x"], range):
+            identification_result.xp_totals = [compute_total_xp(assignment, monster_table) for assignment in deduced_monster_assignments]
+        elif identification_result.status == "none":
+            identification_result.nearest_xp = find_nearest_feasible_xp_values(usergroups, self.identification_context)
+        return identification_result
+
+'''
+the json record of the state of a session after an event : the record of its IdentificationResult once the xp is awarded
+(see IdentificationResult.to_record), or else {"query": ..., "status": "pending", "xp_range": [lowest, highest xp possible]},
+with the "candidates" of each group (see EncounterSession.find_candidate_monsters)
+'''
+def construct_encounter_session_record(encounter_session):
+    identification_result = encounter_session.identify()
+    if identification_result is not None:
+        record = identification_result.to_record()
+    else:
+        record = {"query": encounter_session.query, "status": "pending", "xp_range": encounter_session.find_possible_xp_range()}
+    record["candidates"] = encounter_session.find_candidate_monsters()
+    return record
+
+'''
+track mode : the events of one encounter are read one per line (see EncounterSession.apply_event) and the state is written after
+each event as one json record (see construct_encounter_session_record) with its "line" and "event". A line "new" starts another
+encounter. Blank lines and lines starting with "#" are skipped. An event which can not be applied yields an "error" record,
+leaves the state unchanged and the tracking continues.
+'''
+def track_encounter_events(input_file, output_file, identifier):
+    import json
+    encounter_session = EncounterSession(identifier)
+    for line_number, event in read_batch_queries(input_file):
+        record = {"line": line_number, "event": event}
+        if event == "new":
+            encounter_session = EncounterSession(identifier)
+            record.update(construct_encounter_session_record(encounter_session))
+        else:
+            try:
+                encounter_session.apply_event(event)
+                record.update(construct_encounter_session_record(encounter_session))
+            except InvalidQueryError as e:
+                record.update({"status": "error", "error": str(e).strip()})
+            except QUERY_RESOURCE_ERRORS as e:
+                record.update({"status": "error", "error": describe_query_failure(e)})
+        output_file.write(json.dumps(record) + "\n")
+        output_file.flush()
+
+def run_track(args, identifier):
+    if len(args) == 0 or args[0] == "-":
+        track_encounter_events(sys.stdin, sys.stdout, identifier)
+        return
+    with open(args[0], 'r') as input_file:
+        track_encounter_events(input_file, sys.stdout, identifier)
+
+'''
+batch mode : the lookup maps are built once by the caller and every query line of input_file is identified in turn.
+whitespace within a line is ignored (as it is between command line arguments). Blank lines and "#" comment lines are skipped.
+one json record is written per query line, in input order, as soon as it is computed.
+'''
+def identify_query_lines_in_batch(input_file, output_file, identifier):
+    for line_number, query in read_batch_queries(input_file):
+        output_file.write(identify_batch_query(line_number, query, identifier))
+
+'''
+the (line number, query) pairs of the query lines of input_file
+'''
+def read_batch_queries(input_file):
+    for line_number, line in enumerate(input_file, start=1):
+        query = "".join(line.split())
+        if len(query) == 0 or query.startswith("#"):
+            continue
+        yield line_number, query
+
+'''
+the json record line of one batch query. With --profile-per-query, the query is profiled on its own and the profile is saved
+to the --profile file name followed by "." and the line number.
+'''
+def identify_batch_query(line_number, query, identifier):
+    import json
+    profile_per_query_filename = identifier.identification_context["profile_per_query_filename"]
+    profiler = None
+    if profile_per_query_filename is not None:
+        profiler = start_profiler()
+    record = {"line": line_number}
+    record.update(identify_query(query, identifier))
+    output_start_time = time.perf_counter()
+    record_line = json.dumps(record) + "\n"
+    if identifier.statistics is not None:
+        identifier.statistics.output_seconds += time.perf_counter() - output_start_time
+    if profiler is not None:
+        finish_profiler(profiler, "%s.%d" % (profile_per_query_filename, line_number))
+    return record_line
+
+def run_batch(args, identifier):
+    if len(args) == 0 or args[0] == "-":
+        identify_query_lines_in_batch(sys.stdin, sys.stdout, identifier)
+        return
+    with open(args[0], 'r') as input_file:
+        identify_query_lines_in_batch(input_file, sys.stdout, identifier)
+
+'''
+analyze mode : a session log (the queries of the encounters of a play session, one per line as for batch) is streamed through
+the identifier and only running totals are kept (see SessionAnalytics), so the log may be of any length : its lines are read
+one at a time, nothing is kept per query, and the memory used is bounded by the number of monsters and groups (and by the
+solution cache, see --cache-size). A query which can not be parsed or answered (see describe_query_failure) is reported on
+standard error and counted, and the analysis continues. The totals are written at the end, as csv or json (see write_session_analytics).
+'''
+AMBIGUITY_POLICIES = ("even", "first", "skip")
+SESSION_ANALYTICS_FORMATS = ("csv", "json")
+SESSION_ANALYTICS_CSV_COLUMNS = ("kind", "key", "key_name", "group", "encounters", "kills", "xp", "unique", "ambiguous", "none", "errors", "ambiguity_rate")
+
+'''
+running totals of the encounters of a session :
+  session     the number of encounters, of kills (as given), of encounters with a unique, an ambiguous or no assignment, of
+              queries which could not be parsed, and the xp total of the credited assignments
+  monsters    for each monster credited with kills : the encounters, kills and xp total credited to it
+  groups      for each unidentified group of the queries : the encounters and kills given for it, and the encounters where its
+              monsters are known (unique : every assignment agrees on them), unresolved (ambiguous : the assignments disagree
+              on them) or unknown (none : there is no assignment at all)
+The kills of an encounter with a unique assignment are credited to its monsters. Those of an ambiguous encounter are credited
+by the ambiguity policy : "even" splits them evenly among the assignments (so the credited counts may be fractions), "first"
+credits the first assignment, and "skip" credits none. With a solution limit (--limit N or --unique), only the assignments
+found are split. Each encounter of a run (see identify_encounter_run) counts as an encounter, with the choices which belong to
+a joint assignment as its assignments.
+'''
+class SessionAnalytics:
+    def __init__(self, monster_map, unidentified_group_map, monster_table, ambiguity_policy="even"):
+        self.monster_map = monster_map
+        self.unidentified_group_map = unidentified_group_map
+        self.monster_table = monster_table
+        self.ambiguity_policy = ambiguity_policy
+        self.session = {"encounters": 0, "kills": 0, "xp": 0, "unique": 0, "ambiguous": 0, "none": 0, "errors": 0}
+        self.monsters = {}
+        self.groups = {}
+
+    '''
+    adds the result of a query : an IdentificationResult, or an EncounterRunResult whose encounters are added one by one
+    '''
+    def add_result(self, result):
+        if isinstance(result, EncounterRunResult):
+            for usergroups, encounter_choices in zip(result.encounters, result.choices):
+                assignments = []
+                assignment_keys = set()
+                for choice in encounter_choices:
+                    assignment_key = tuple((monster.key, monster.count) for monster in choice.assignment)
+                    if assignment_key not in assignment_keys:
+                        assignment_keys.add(assignment_key)
+                        assignments.append(choice.assignment)
+                self.add_encounter(usergroups, assignments, False)
+            return
+        self.add_encounter(result.usergroups, result.assignments, result.truncated)
+
+    '''
+    adds one encounter : its parsed query and its assignments, each a list of IdentifiedMonster
+    '''
+    def add_encounter(self, usergroups, assignments, truncated):
+        status = deduced_monster_assignments_status(assignments)
+        if truncated:
+            status = "ambiguous"
+        self.session["encounters"] += 1
+        self.session[status] += 1
+        for key in usergroups:
+            if key == "x" or key == "c" or key == CANDIDATE_CONSTRAINTS_KEY:
+                continue
+            self.session["kills"] += usergroups[key]
+            if key not in self.unidentified_group_map:
+                continue
+            group_counters = self.groups.setdefault(key, {"encounters": 0, "kills": 0, "unique": 0, "ambiguous": 0, "none": 0})
+            group_counters["encounters"] += 1
+            group_counters["kills"] += usergroups[key]
+            group_monster_sets = set()
+            for assignment in assignments:
+                group_monster_sets.add(tuple(sorted((monster.key, monster.count) for monster in assignment if self.monster_map[monster.key]["group_key"] == key)))
+            if len(group_monster_sets) == 0:
+                group_counters["none"] += 1
+            elif len(group_monster_sets) == 1 and not truncated:
+                group_counters["unique"] += 1
+            else:
+                group_counters["ambiguous"] += 1
+        credited_assignments = assignments
+        if status == "ambiguous" and self.ambiguity_policy == "first":
+            credited_assignments = assignments[:1]
+        elif status == "ambiguous" and self.ambiguity_policy == "skip":
+            credited_assignments = []
+        for assignment in credited_assignments:
+            weight = 1.0 / len(credited_assignments)
+            for monster in assignment:
+                xp = self.monster_table.monster_xp[self.monster_table.monster_ids[monster.key]] * monster.count
+                monster_counters = self.monsters.setdefault(monster.key, {"encounters": 0, "kills": 0, "xp": 0})
+                monster_counters["encounters"] += weight
+                monster_counters["kills"] += weight * monster.count
+                monster_counters["xp"] += weight * xp
+                self.session["xp"] += weight * xp
+
+    def add_error(self):
+        self.session["errors"] += 1
+
+    '''
+    the totals as a json friendly record : {"session": ..., "groups": [...], "monsters": [...]}, the groups and monsters in the
+    order of the data files, with the ambiguity rate (the share of ambiguous encounters) of the session and of each group
+    '''
+    def to_record(self):
+        session_record = {"ambiguity_policy": self.ambiguity_policy}
+        session_record.update((name, format_session_analytics_number(value)) for name, value in self.session.items())
+        session_record["ambiguity_rate"] = compute_ambiguity_rate(self.session)
+        group_records = []
+        for key in self.unidentified_group_map:
+            if key in self.groups:
+                group_record = {"key": key, "key_name": self.unidentified_group_map[key]["key_name"]}
+                group_record.update(self.groups[key])
+                group_record["ambiguity_rate"] = compute_ambiguity_rate(self.groups[key])
+                group_records.append(group_record)
+        monster_records = []
+        for key in self.monster_map:
+            if key in self.monsters:
+                monster_record = {"key": key, "key_name": self.monster_map[key]["key_name"], "group": self.monster_map[key]["group_key"]}
+                monster_record.update((name, format_session_analytics_number(value)) for name, value in self.monsters[key].items())
+                monster_records.append(monster_record)
+        return {"session": session_record, "groups": group_records, "monsters": monster_records}
+
+'''
+the share of the encounters of counters which are ambiguous, rounded (0 without encounters)
+'''
+def compute_ambiguity_rate(counters):
+    if counters["encounters"] == 0:
+        return 0.0
+    return round(counters["ambiguous"] / counters["encounters"], 4)
+
+'''
+a credited count or xp as written : an int when it is whole (always, except with the "even" ambiguity policy), otherwise
+rounded to 3 decimals
+'''
+def format_session_analytics_number(value):
+    value = round(value, 3)
+    if value == int(value):
+        return int(value)
+    return value
+
+'''
+writes the totals of session_analytics to output_file : as one json object (see SessionAnalytics.to_record), or as csv with one
+row per kind of total ("session", "group" or "monster", see SESSION_ANALYTICS_CSV_COLUMNS), the columns which do not apply
+to a kind being left empty
+'''
+def write_session_analytics(session_analytics, analytics_format, output_file):
+    record = session_analytics.to_record()
+    if analytics_format == "json":
+        import json
+        output_file.write(json.dumps(record) + "\n")
+        return
+    import csv
+    writer = csv.DictWriter(output_file, SESSION_ANALYTICS_CSV_COLUMNS, restval="", extrasaction="ignore", lineterminator="\n")
+    writer.writeheader()
+    writer.writerow(dict(record["session"], kind="session"))
+    for group_record in record["groups"]:
+        writer.writerow(dict(group_record, kind="group"))
+    for monster_record in record["monsters"]:
+        writer.writerow(dict(monster_record, kind="monster"))
+
+'''
+the options of analyze : --ambiguity-policy POLICY (default even, see SessionAnalytics) and --format FORMAT (default csv).
+returns (ambiguity policy, format)
+'''
+def parse_analyze_options(options):
+    ambiguity_policy = options.get("ambiguity-policy", "even")
+    if ambiguity_policy not in AMBIGUITY_POLICIES:
+        raise InvalidOptionError("error : option '--ambiguity-policy' requires one of %s (not '%s')\n" % (", ".join("'%s'" % policy for policy in AMBIGUITY_POLICIES), ambiguity_policy))
+    analytics_format = options.get("format", "csv")
+    if analytics_format not in SESSION_ANALYTICS_FORMATS:
+        raise InvalidOptionError("error : option '--format' requires 'csv' or 'json' (not '%s')\n" % analytics_format)
+    return ambiguity_policy, analytics_format
+
+'''
+streams the query lines of input_file through the identifier into session_analytics
+'''
+def analyze_query_lines(input_file, identifier, session_analytics):
+    for line_number, query in read_batch_queries(input_file):
+        try:
+            if ENCOUNTER_SEPARATOR in query:
+                result = identifier.identify_encounter_run(query)
+            else:
+                result = identifier.identify(query)
+        except InvalidQueryError as e:
+            sys.stderr.write("line %d : %s" % (line_number, str(e)))
+            session_analytics.add_error()
+            continue
+        except QUERY_RESOURCE_ERRORS as e:
+            sys.stderr.write("line %d : %s\n" % (line_number, describe_query_failure(e)))
+            session_analytics.add_error()
+            continue
+        session_analytics.add_result(result)
+
+'''
+runs analyze with its command line arguments : [FILE] (options already separated), reading standard input when FILE is
+omitted or "-"
+'''
+def run_analyze(args, identifier, ambiguity_policy, analytics_format):
+    identification_context = identifier.identification_context
+    session_analytics = SessionAnalytics(identification_context["monster_map"], identification_context["unidentified_group_map"], identification_context["monster_table"], ambiguity_policy)
+    if len(args) == 0 or args[0] == "-":
+        analyze_query_lines(sys.stdin, identifier, session_analytics)
+    else:
+        with open(args[0], 'r') as input_file:
+            analyze_query_lines(input_file, identifier, session_analytics)
+    write_session_analytics(session_analytics, analytics_format, sys.stdout)
+
+'''
+parallel batch mode (--jobs N) : the query lines are read in chunks of --chunk-size lines and each chunk is identified by one of
+N worker processes, so that a whole chunk of records comes back from a worker at once. Each worker loads the data and builds
+its Identifier (with its own solution cache) once, when it starts (see initialize_batch_worker).
+Records are written in input order, or as soon as their chunk is done with --unordered (each record holds its "line" either way).
+At most BATCH_CHUNKS_IN_FLIGHT_PER_JOB chunks per worker are read ahead, so the input may be of any length.
+'''
+DEFAULT_BATCH_CHUNK_SIZE = 64
+BATCH_CHUNKS_IN_FLIGHT_PER_JOB = 4
+
+batch_worker_identifier = None
+
+def initialize_batch_worker(options):
+    global batch_worker_identifier
+    batch_worker_identifier = Identifier(options, command="batch")
+
+'''
+the record lines of the chunk, and its statistics (None without --stats)
+'''
+def identify_batch_query_chunk(query_chunk):
+    if batch_worker_identifier.statistics is not None:
+        batch_worker_identifier.statistics = SearchStatistics()
+    record_lines = "".join(identify_batch_query(line_number, query, batch_worker_identifier) for line_number, query in query_chunk)
+    return record_lines, batch_worker_identifier.statistics
+
+def read_batch_query_chunks(input_file, chunk_size):
+    query_chunk = []
+    for line_number, query in read_batch_queries(input_file):
+        query_chunk.append((line_number, query))
+        if len(query_chunk) == chunk_size:
+            yield query_chunk
+            query_chunk = []
+    if len(query_chunk) > 0:
+        yield query_chunk
+
+def write_finished_batch_chunk(finished_chunk, output_file, statistics):
+    record_lines, chunk_statistics = finished_chunk.result()
+    output_file.write(record_lines)
+    if statistics is not None:
+        statistics.add(chunk_statistics)
+
+'''
+writes the records of submitted chunks until no more than max_pending_count chunks are pending, and returns the chunks still pending
+'''
+def write_finished_batch_chunks(pending_chunks, max_pending_count, ordered, output_file, statistics):
+    import concurrent.futures
+    while len(pending_chunks) > max_pending_count:
+        if ordered:
+            write_finished_batch_chunk(pending_chunks.pop(0), output_file, statistics)
+            continue
+        finished_chunks, unfinished_chunks = concurrent.futures.wait(pending_chunks, return_when=concurrent.futures.FIRST_COMPLETED)
+        for finished_chunk in finished_chunks:
+            write_finished_batch_chunk(finished_chunk, output_file, statistics)
+        pending_chunks = list(unfinished_chunks)
+    output_file.flush()
+    return pending_chunks
+
+def identify_query_lines_in_parallel_batch(input_file, output_file, options, job_count, chunk_size, ordered, statistics):
+    import concurrent.futures # only parallel batches need it (it is slow to import)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=job_count, initializer=initialize_batch_worker, initargs=(options,)) as executor:
+        pending_chunks = []
+        for query_chunk in read_batch_query_chunks(input_file, chunk_size):
+            pending_chunks.append(executor.submit(identify_batch_query_chunk, query_chunk))
+            pending_chunks = write_finished_batch_chunks(pending_chunks, job_count * BATCH_CHUNKS_IN_FLIGHT_PER_JOB, ordered, output_file, statistics)
+        write_finished_batch_chunks(pending_chunks, 0, ordered, output_file, statistics)
+
+def run_parallel_batch(args, options, job_count, statistics=None):
+    chunk_size = parse_positive_int_option(options, "chunk-size", DEFAULT_BATCH_CHUNK_SIZE)
+    ordered = not "unordered" in options
+    if len(args) == 0 or args[0] == "-":
+        identify_query_lines_in_parallel_batch(sys.stdin, sys.stdout, options, job_count, chunk_size, ordered, statistics)
+        return
+    with open(args[0], 'r') as input_file:
+        identify_query_lines_in_parallel_batch(input_file, sys.stdout, options, job_count, chunk_size, ordered, statistics)
+
+'''
+the number of worker processes of a batch (or of build-atlas) : --jobs N (default 1, which identifies the queries in this process) where 0 is one per
+processor. The solution cache of each worker is its own, so it can not be saved to a file or reported, and the workers are
+not profiled.
+'''
+def parse_batch_job_count(options):
+    job_count = parse_non_negative_int_option(options, "jobs", 1)
+    if job_count == 0:
+        job_count = os.cpu_count() or 1
+    if job_count > 1:
+        for name in ("cache-file", "cache-stats", "profile"):
+            if name in options:
+                raise InvalidOptionError("error : option '--%s' can not be used with '--jobs'\n" % name)
+    return job_count
+
+'''
+server mode : the data and every precomputed structure stay loaded while requests are answered one per line (json-lines).
+A request is either a json object {"id": <any>, "query": "<query>"} or a plain query line; the response is the record of
+identify_query (with the same "id" when one was given) on one line. The request {"id": <any>, "command": "cache-stats"}
+is answered with the counters of the solution cache, and {"id": <any>, "command": "stats"} with the statistics of the
+requests so far (with --stats). Requests of several socket clients are served concurrently.
+'''
+def answer_server_request_line(line, identifier):
+    import json
+    solution_cache = identifier.identification_context["solution_cache"]
+    line = line.strip()
+    if len(line) == 0:
+        return None
+    request = {"query": line}
+    if line.startswith("{"):
+        try:
+            request = json.loads(line)
+        except ValueError:
+            return {"status": "error", "error": "error : request is not valid json"}
+        if isinstance(request, dict) and request.get("command") == "cache-stats":
+            return {"id": request.get("id"), "cache": solution_cache.counters() if solution_cache is not None else None}
+        if isinstance(request, dict) and request.get("command") == "stats":
+            statistics = identifier.statistics
+            return {"id": request.get("id"), "stats": statistics.to_record() if statistics is not None else None}
+        if not isinstance(request, dict) or not isinstance(request.get("query"), str):
+            return {"id": request.get("id") if isinstance(request, dict) else None, "status": "error", "error": "error : request has no \"query\" string"}
+    record = {}
+    if "id" in request:
+        record["id"] = request["id"]
+    query = "".join(request["query"].split())
+    record.update(identify_query(query, identifier))
+    return record
+
+def encode_server_response(record):
+    import json
+    return (json.dumps(record) + "\n").encode()
+
+async def serve_socket_client(reader, writer, identifier):
+    try:
+        while True:
+            line = await reader.readline()
+            if len(line) == 0:
+                break
+            record = answer_server_request_line(line.decode(errors="replace"), identifier)
+            if record is not None:
+                writer.write(encode_server_response(record))
+                await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+async def serve_unix_socket(socket_path, identifier):
+    import asyncio
+    import functools
+    serve_client = functools.partial(serve_socket_client, identifier=identifier)
+    if os.path.exists(socket_path) and stat.S_ISSOCK(os.stat(socket_path).st_mode):
+        os.remove(socket_path) # left behind by a server which did not exit cleanly
+    server = await asyncio.start_unix_server(serve_client, path=socket_path)
+    sys.stderr.write("serving on unix socket %s\n" % socket_path)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+
+async def serve_standard_streams(identifier):
+    import asyncio
+    import json
+    loop = asyncio.get_running_loop()
+    while True:
+        line = await loop.run_in_executor(None, sys.stdin.readline)
+        if len(line) == 0:
+            break
+        record = answer_server_request_line(line, identifier)
+        if record is not None:
+            sys.stdout.write(json.dumps(record))
+            sys.stdout.write("\n")
+            sys.stdout.flush()
+
+def run_server(options, identifier):
+    import asyncio # only the server needs it (it is slow to import)
+    try:
+        if "socket" in options:
+            asyncio.run(serve_unix_socket(options["socket"], identifier))
+        else:
+            asyncio.run(serve_standard_streams(identifier))
+    except KeyboardInterrupt:
+        pass
+
+'''
+the solution cache is used by batch, serve and analyze (and by single queries when it is saved to a file with --cache-file).
+--cache-size 0 turns it off. Returns None when no cache is used.
+'''
+def construct_solution_cache(options, command):
+    default_capacity = 0
+    if command in {"batch", "serve", "analyze"} or "cache-file" in options:
+        default_capacity = DEFAULT_SOLUTION_CACHE_CAPACITY
+    capacity = parse_non_negative_int_option(options, "cache-size", default_capacity)
+    if capacity == 0:
+        return None
+    solution_cache = SolutionCache(capacity)
+    if "cache-file" in options:
+        solution_cache.load(options["cache-file"], compute_data_files_hash())
+    return solution_cache
+
+def finish_solution_cache(options, solution_cache):
+    if solution_cache is None:
+        return
+    if "cache-file" in options:
+        solution_cache.save(options["cache-file"], compute_data_files_hash())
+    if "cache-stats" in options:
+        import json
+        sys.stderr.write("solution cache : %s\n" % json.dumps(solution_cache.counters()))
+
+'''
+--profile FILE saves a cProfile profile (readable with the pstats module) of the query, or of the whole batch or server run
+'''
+def start_profiler():
+    import cProfile # only profiling needs it
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+def finish_profiler(profiler, filename):
+    profiler.disable()
+    profiler.dump_stats(filename)
+
+'''
+--limit N stops each search once more than N assignments are found, and --unique is --limit 1 (enough to tell a unique
+assignment from an ambiguous one). Returns None when the searches are not limited.
+'''
+def parse_solution_limit_option(options):
+    solution_limit = parse_positive_int_option(options, "limit", None)
+    if "unique" in options:
+        solution_limit = 1
+    return solution_limit
+
+def parse_stats_format_option(options):
+    stats_format = options.get("stats-format", "text")
+    if stats_format not in {"text", "json"}:
+        raise InvalidOptionError("error : option '--stats-format' requires 'text' or 'json' (not '%s')\n" % stats_format)
+    return stats_format
+
+def finish_statistics(options, statistics):
+    if statistics is None:
+        return
+    if parse_stats_format_option(options) == "json":
+        import json
+        sys.stderr.write(json.dumps(statistics.to_record()) + "\n")
+    else:
+        sys.stderr.write(statistics.to_text())
+
+'''
+everything needed to identify queries, built once from the monster data and the options : the data maps and the MonsterTable, the code trie,
+the optional maps of --co-occur and --split, the numpy module of --numpy, the solution index, the solution cache, the
+solution limit of --limit and --unique, the character count of queries without a "c" term (see --any-party-size) and the profile file name prefix of --profile-per-query (each of the optional entries is None when not used)
+'''
+def construct_identification_context(monster_data, options, solution_index=None, solution_cache=None):
+    monster_map = monster_data["monster_map"]
+    unidentified_group_map = monster_data["unidentified_group_map"]
+    unidentified_group_to_monster_set_map = monster_data["unidentified_group_to_monster_set_map"]
+    co_occurrence_mask_map = None
+    if "co-occur" in options:
+        co_occurrence_mask_map = monster_data.get("co_occurrence_mask_map")
+        if co_occurrence_mask_map is None:
+            co_occurrence_mask_map = construct_co_occurrence_mask_map(CoOccurrenceGraph(monster_map))
+    group_co_occurring_monster_sets_map = None
+    if "split" in options:
+        group_co_occurring_monster_sets_map = monster_data.get("group_co_occurring_monster_sets_map")
+        if group_co_occurring_monster_sets_map is None:
+            group_co_occurring_monster_sets_map = construct_group_co_occurring_monster_sets_map(CoOccurrenceGraph(monster_map), unidentified_group_to_monster_set_map)
+    code_trie = monster_data.get("code_trie")
+    if code_trie is None:
+        code_trie = construct_code_trie(monster_map, unidentified_group_map)
+    numpy_module = None
+    if "numpy" in options:
+        numpy_module = find_numpy_module()
+    return {
+            "monster_map": monster_map,
+            "unidentified_group_map": unidentified_group_map,
+            "unidentified_group_to_monster_set_map": unidentified_group_to_monster_set_map,
+            "monster_table": monster_data["monster_table"],
+            "co_occurrence_mask_map": co_occurrence_mask_map,
+            "group_co_occurring_monster_sets_map": group_co_occurring_monster_sets_map,
+            "code_trie": code_trie,
+            "numpy_module": numpy_module,
+            "solution_index": solution_index,
+            "solution_cache": solution_cache,
+            "solution_limit": parse_solution_limit_option(options),
+            "default_character_count": ANY_PARTY_SIZE if "any-party-size" in options else MAX_PARTY_SIZE,
+            "profile_per_query_filename": options["profile"] if "profile" in options and "profile-per-query" in options else None}
+
+'''
+the identification commands (a query, batch and serve), build-index, build-atlas and atlas : loads the data bundle (or the data files) and builds
+the Identifier, then runs the command. The parallel batch identifies its queries in its workers, each with its own
+Identifier, so no solution cache is used here.
+'''
+def run_identification_command(args, options):
+    try:
+        load_start_time = time.perf_counter()
+        monster_data = load_monster_data_for_command_line()
+        monster_map = monster_data["monster_map"]
+        unidentified_group_map = monster_data["unidentified_group_map"]
+        if args[0] == "build-index":
+            run_build_index(args[1:], options, monster_map, monster_data["monster_table"])
+            return
+        if args[0] == "build-atlas":
+            run_build_atlas(args[1:], options, monster_data)
+            return
+        job_count = 1
+        if args[0] == "batch":
+            job_count = parse_batch_job_count(options)
+        parse_stats_format_option(options)
+        identifier_options = options
+        if job_count > 1:
+            identifier_options = dict(options, **{"cache-size": "0"})
+        identifier = Identifier(identifier_options, monster_data, args[0])
+        if args[0] == "atlas":
+            run_atlas(args[1:], options, identifier)
+            return
+        if args[0] == "analyze":
+            ambiguity_policy, analytics_format = parse_analyze_options(options)
+    except InvalidOptionError as e:
+        exit_on_invalid_option(e)
+    except StaleIndexError as e:
+        sys.stderr.write(str(e))
+        sys.exit(1)
+    solution_cache = identifier.identification_context["solution_cache"]
+    statistics = identifier.statistics
+    if statistics is not None:
+        statistics.load_seconds = time.perf_counter() - load_start_time
+    if "numpy" in options and identifier.identification_context["numpy_module"] is None:
+        sys.stderr.write("numpy is not installed : the search is not vectorized\n")
+    profiler = None
+    if "profile" in options and identifier.identification_context["profile_per_query_filename"] is None:
+        profiler = start_profiler()
+    if args[0] == "batch" and job_count > 1:
+            run_parallel_batch(args[1:], options, job_count, statistics)
+            finish_statistics(options, statistics)
+            return
+    if args[0] == "batch":
+            run_batch(args[1:], identifier)
+            if profiler is not None:
+                finish_profiler(profiler, options["profile"])
+            finish_solution_cache(options, solution_cache)
+            finish_statistics(options, statistics)
+            return
+    if args[0] == "analyze":
+            run_analyze(args[1:], identifier, ambiguity_policy, analytics_format)
+            if profiler is not None:
+                finish_profiler(profiler, options["profile"])
+            finish_solution_cache(options, solution_cache)
+            finish_statistics(options, statistics)
+            return
+    if args[0] == "track":
+            run_track(args[1:], identifier)
+            if profiler is not None:
+                finish_profiler(profiler, options["profile"])
+            finish_solution_cache(options, solution_cache)
+            return
+    if args[0] == "serve":
+            run_server(options, identifier)
+            if profiler is not None:
+                finish_profiler(profiler, options["profile"])
+            finish_solution_cache(options, solution_cache)
+            finish_statistics(options, statistics)
+            return
+    else:
+        userstring = construct_user_query(args)
+        try:
+            if ENCOUNTER_SEPARATOR in userstring:
+                identification_result = identifier.identify_encounter_run(userstring)
+            else:
+                identification_result = identifier.identify(userstring)
+        except InvalidQueryError as e:
+            sys.stderr.write(str(e))
+            write_expected_input(monster_map, unidentified_group_map)
+            sys.exit(1)
+        output_start_time = time.perf_counter()
+        finish_solution_cache(options, solution_cache)
+        try:
+            if isinstance(identification_result, EncounterRunResult):
+                output_encounter_run_result(identification_result, monster_map, unidentified_group_map)
+            else:
+                output_identification_result(identification_result, monster_map, unidentified_group_map)
+        finally:
+            if profiler is not None:
+                finish_profiler(profiler, options["profile"])
+            if statistics is not None:
+                sys.stdout.flush()
+                statistics.output_seconds += time.perf_counter() - output_start_time
+                finish_statistics(options, statistics)
+
+def exit_on_invalid_option(e):
+    sys.stderr.write(str(e))
+    sys.stderr.write("running this program with no arguments will print a description of usage.\n")
+    sys.exit(2)
+
+'''
+the command is dispatched before anything is loaded, so that each command loads only what it needs : the usage loads nothing,
+codes and groups read only the data files, compile-data reads the data files and writes the bundle, and the other commands
+load the bundle (see run_identification_command). The modules which only some commands use are imported by those commands.
+'''
+def main():
+    # checked before the options are separated, which would reject --help and --usage as unknown options
+    if len(sys.argv) > 1 and user_is_asking_for_help(sys.argv[1]):
+        show_usage()
+        return
+    try:
+        options, args = separate_options_from_args(sys.argv[1:])
+    except InvalidOptionError as e:
+        exit_on_invalid_option(e)
+    if len(args) == 0 or user_is_asking_for_help(args[0]):
+        show_usage()
+        return
+    if args[0] == "compile-data":
+        try:
+            run_compile_data(args[1:])
+        except (InvalidKeyError, MissingKeyError, DuplicateKeyError) as e:
+            sys.stderr.write("error : %s" % str(e))
+            sys.exit(1)
+        return
+    if args[0] == "codes":
+        monster_map, unidentified_group_map, unidentified_group_to_monster_set_map = load_monster_data()
+        write_out_monster_codes_and_unidentified_group_codes(monster_map, unidentified_group_map)
+        return
+    if args[0] == "groups":
+        monster_map, unidentified_group_map, unidentified_group_to_monster_set_map = load_monster_data()
+        write_out_unidentified_groups_and_possible_monsters_for_each(monster_map, unidentified_group_map, unidentified_group_to_monster_set_map)
+        return
+    run_identification_command(args, options)
 
 if __name__ == "__main__":
     main()
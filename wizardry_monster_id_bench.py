@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+
+'''
+wizardry_monster_id_bench.py - measures the cost of wizardry_monster_id.py on synthetic and worst case encounters
+Copyright (C) 2023 github user bassjack1 <147515670+bassjack1@users.noreply.github.com>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+'''
+
+'''
+General description:
+This program imports wizardry_monster_id.py (from its own directory) and times its identification of encounter queries, in
+process, with an Identifier (see wizardry_monster_id.py). Two kinds of benchmarks are run :
+- corpus benchmarks : synthetic encounters, generated by walking the co_occur_keys chains of monsters.json the way the game
+  picks the allies of an encounter (see generate_encounter_query), for each of several corpus sizes. The corpus depends
+  only on the seed and the data files, and each smaller corpus is the start of the larger ones.
+- worst case benchmarks : the named queries of WORST_CASE_QUERIES, which are among the most expensive to search.
+The parse, search and output (the json record of batch and serve) times of each benchmark are measured separately, along with
+the search work (see SearchStatistics in wizardry_monster_id.py). Each benchmark is run several times and the fastest run is
+kept. The results are written as text or as json lines, so that runs can be saved and compared (see --compare).
+The identification options of wizardry_monster_id.py (such as --co-occur or --split) apply to every benchmark. The solution
+cache is off unless --cache-size is given, so that every query is searched.
+'''
+
+import json
+import platform
+import random
+import sys
+import time
+
+import wizardry_monster_id
+
+'''
+the shape of the synthetic encounters : a monster is followed by one of its co_occur_keys with ALLY_PROBABILITY, from 1 to
+MAX_KILL_COUNT of each monster are killed, and the whole party survives with FULL_PARTY_PROBABILITY
+'''
+ALLY_PROBABILITY = 0.5
+MAX_KILL_COUNT = 9
+FULL_PARTY_PROBABILITY = 0.75
+
+DEFAULT_CORPUS_SIZES = (100, 1000, 10000)
+DEFAULT_SEED = 1
+DEFAULT_REPEAT_COUNT = 3
+
+'''
+the worst case queries : the example of wizardry_monster_id.py (four groups of many possible monsters), with a range of party
+sizes and a range of xp, and the two chains of 4 distinct groups which hold both "mir" and "sa" (two of the groups with the
+most possible monsters), with 9 of each monster killed. Each is identified WORST_CASE_QUERY_COUNT times per run.
+'''
+WORST_CASE_QUERIES = (
+        ("docstring example", "4pri6mir3mia7sa6050x6c"),
+        ("docstring example, any party size", "4pri6mir3mia7sa6050x1-6c"),
+        ("docstring example, xp range", "4pri6mir3mia7sa6030-6070x6c"),
+        ("sa mir mia pri chain", "9sa9mir9mia9pri13290x6c"),
+        ("mir sa ue gar chain", "9mir9sa9ue9gar9690x6c"))
+WORST_CASE_QUERY_COUNT = 20
+
+def show_usage():
+    sys.stdout.write('Usage: (may require prefixing with your python3 executable)\n')
+    sys.stdout.write('wizardry_monster_id_bench.py [OPTION ...]\n')
+    sys.stdout.write('      times the identification of synthetic encounter corpora and of\n')
+    sys.stdout.write('      named worst case queries, with separate parse, search and\n')
+    sys.stdout.write('      output times, and writes one result per benchmark.\n')
+    sys.stdout.write('      The identification options of wizardry_monster_id.py (such as\n')
+    sys.stdout.write('      --co-occur, --split, --numpy or --index FILE) apply to every\n')
+    sys.stdout.write('      benchmark.\n')
+    sys.stdout.write('      --sizes N,N,...  corpus sizes (default: 100,1000,10000)\n')
+    sys.stdout.write('      --seed N    seed of the synthetic corpus (default: 1)\n')
+    sys.stdout.write('      --repeat N  run each benchmark N times and keep the fastest\n')
+    sys.stdout.write('                  run (default: 3)\n')
+    sys.stdout.write('      --only KIND  run only the "corpus" or the "worst-case"\n')
+    sys.stdout.write('                  benchmarks (default: all)\n')
+    sys.stdout.write('      --format FORMAT  text (default) or json (one json record per\n')
+    sys.stdout.write('                  line, the first describing the run)\n')
+    sys.stdout.write('      --output FILE  write the results to FILE instead of standard\n')
+    sys.stdout.write('                  output\n')
+    sys.stdout.write('      --compare FILE  compare the total time of each benchmark with\n')
+    sys.stdout.write('                  that of an earlier run saved with --format json\n')
+    sys.stdout.write('      --write-corpus FILE  also write the largest corpus to FILE, one\n')
+    sys.stdout.write('                  query per line (input for wizardry_monster_id.py batch)\n')
+
+'''
+one synthetic encounter query : starting from a random monster, each monster is followed by one of its co_occur_keys (with
+ALLY_PROBABILITY) until the chain holds MAX_ENCOUNTER_CHAIN_LENGTH monsters or reaches a monster without co_occur_keys, and
+from 1 to MAX_KILL_COUNT of each monster of the chain are killed. As in the game, the query names the unidentified group of
+each monster (the kills of the monsters of one group are added up) and the xp is the total xp of the monsters divided among
+the surviving characters, fractions dropped. The "c" term is left out when the whole party survives.
+'''
+def generate_encounter_query(rng, co_occurrence_graph, monster_map):
+    node_id = rng.randrange(len(co_occurrence_graph.monster_keys))
+    chain = [node_id]
+    while len(chain) < wizardry_monster_id.MAX_ENCOUNTER_CHAIN_LENGTH and len(co_occurrence_graph.successors[node_id]) > 0 and rng.random() < ALLY_PROBABILITY:
+        node_id = rng.choice(co_occurrence_graph.successors[node_id])
+        chain.append(node_id)
+    group_counts = {}
+    total_xp = 0
+    for node_id in chain:
+        monster = monster_map[co_occurrence_graph.monster_keys[node_id]]
+        kill_count = rng.randint(1, MAX_KILL_COUNT)
+        group_counts[monster["group_key"]] = group_counts.get(monster["group_key"], 0) + kill_count
+        total_xp += monster["xp"] * kill_count
+    party_size = wizardry_monster_id.MAX_PARTY_SIZE
+    if rng.random() >= FULL_PARTY_PROBABILITY:
+        party_size = rng.randint(1, wizardry_monster_id.MAX_PARTY_SIZE - 1)
+    query = "".join("%d%s" % (count, group_key) for group_key, count in group_counts.items())
+    query += "%dx" % (total_xp // party_size)
+    if party_size != wizardry_monster_id.MAX_PARTY_SIZE:
+        query += "%dc" % party_size
+    return query
+
+def generate_corpus(size, seed, monster_map):
+    rng = random.Random(seed)
+    co_occurrence_graph = wizardry_monster_id.CoOccurrenceGraph(monster_map)
+    return [generate_encounter_query(rng, co_occurrence_graph, monster_map) for query_number in range(size)]
+
+'''
+identifies each query once, as batch and serve do (the output is the json record of the query), and returns the statistics
+of the run and the count of the queries of each status ("error" for the queries which can not be parsed)
+'''
+def run_queries(queries, identifier):
+    statistics = wizardry_monster_id.SearchStatistics()
+    identifier.statistics = statistics
+    status_counts = {}
+    for query in queries:
+        try:
+            identification_result = identifier.identify(query)
+        except wizardry_monster_id.InvalidQueryError:
+            status = "error"
+        else:
+            output_start_time = time.perf_counter()
+            json.dumps(identification_result.to_record())
+            statistics.output_seconds += time.perf_counter() - output_start_time
+            status = identification_result.status
+        status_counts[status] = status_counts.get(status, 0) + 1
+    return statistics, status_counts
+
+def total_seconds(statistics):
+    return statistics.parse_seconds + statistics.search_seconds + statistics.output_seconds
+
+'''
+runs the queries repeat_count times and returns the record of the fastest run : the times in milliseconds, the microseconds per
+query, the search work and the count of the queries of each status
+'''
+def run_benchmark(name, queries, identifier, repeat_count):
+    fastest_statistics = None
+    for run_number in range(repeat_count):
+        statistics, status_counts = run_queries(queries, identifier)
+        if fastest_statistics is None or total_seconds(statistics) < total_seconds(fastest_statistics):
+            fastest_statistics = statistics
+    record = {"benchmark": name}
+    for record_name, value in fastest_statistics.to_record().items():
+        if record_name != "load_ms":
+            record[record_name] = value
+    record["total_ms"] = round(total_seconds(fastest_statistics) * 1000.0, 3)
+    record["us_per_query"] = round(total_seconds(fastest_statistics) * 1000000.0 / len(queries), 3)
+    record["statuses"] = dict(sorted(status_counts.items()))
+    return record
+
+def parse_corpus_sizes_option(options):
+    if "sizes" not in options:
+        return list(DEFAULT_CORPUS_SIZES)
+    corpus_sizes = []
+    for size in options["sizes"].split(","):
+        if not size.isdigit() or int(size) == 0:
+            raise wizardry_monster_id.InvalidOptionError("error : option '--sizes' requires positive integers separated by commas (not '%s')\n" % options["sizes"])
+        corpus_sizes.append(int(size))
+    return sorted(set(corpus_sizes))
+
+'''
+the value of an option which must be one of choices
+'''
+def parse_choice_option(options, name, choices, default_value):
+    value = options.get(name, default_value)
+    if value not in choices:
+        raise wizardry_monster_id.InvalidOptionError("error : option '--%s' requires %s (not '%s')\n" % (name, " or ".join("'%s'" % choice for choice in choices), value))
+    return value
+
+'''
+the total milliseconds of each benchmark of an earlier run saved with --format json
+'''
+def read_baseline_totals(filename):
+    baseline_totals = {}
+    with open(filename, 'r') as baseline_file:
+        for line in baseline_file:
+            line = line.strip()
+            if len(line) == 0:
+                continue
+            record = json.loads(line)
+            if "total_ms" in record:
+                baseline_totals[record["benchmark"]] = record["total_ms"]
+    return baseline_totals
+
+'''
+the benchmark records : a corpus benchmark for each corpus size, then a worst case benchmark for each of WORST_CASE_QUERIES
+(with its "query")
+'''
+def run_benchmarks(options, identifier, monster_map):
+    repeat_count = wizardry_monster_id.parse_positive_int_option(options, "repeat", DEFAULT_REPEAT_COUNT)
+    only = parse_choice_option(options, "only", ("corpus", "worst-case", "all"), "all")
+    if only != "worst-case":
+        corpus_sizes = parse_corpus_sizes_option(options)
+        corpus = generate_corpus(corpus_sizes[-1], wizardry_monster_id.parse_non_negative_int_option(options, "seed", DEFAULT_SEED), monster_map)
+        if "write-corpus" in options:
+            with open(options["write-corpus"], 'w') as corpus_file:
+                corpus_file.write("".join(query + "\n" for query in corpus))
+        for corpus_size in corpus_sizes:
+            yield run_benchmark("corpus %d" % corpus_size, corpus[:corpus_size], identifier, repeat_count)
+    if only != "corpus":
+        for name, query in WORST_CASE_QUERIES:
+            record = run_benchmark(name, [query] * WORST_CASE_QUERY_COUNT, identifier, repeat_count)
+            record["query"] = query
+            yield record
+
+'''
+the record which describes the run (first of the json output) : what the results depend on, and when they were measured.
+It also checks the options of the benchmarks, before anything is run.
+'''
+def construct_run_record(argv, options, load_seconds):
+    return {
+            "benchmark": "run",
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "data_hash": wizardry_monster_id.compute_data_files_hash(),
+            "arguments": argv,
+            "seed": wizardry_monster_id.parse_non_negative_int_option(options, "seed", DEFAULT_SEED),
+            "repeat": wizardry_monster_id.parse_positive_int_option(options, "repeat", DEFAULT_REPEAT_COUNT),
+            "sizes": parse_corpus_sizes_option(options),
+            "only": parse_choice_option(options, "only", ("corpus", "worst-case", "all"), "all"),
+            "load_ms": round(load_seconds * 1000.0, 3)}
+
+TEXT_COLUMNS_FORMAT = "%-36s %7s %10s %10s %10s %10s %10s %10s"
+
+def write_text_header(output_file, run_record, compare):
+    output_file.write("python %s (%s), data %s, load %.3f ms, fastest of %d runs\n" % (
+            run_record["python"], run_record["machine"], run_record["data_hash"][:12], run_record["load_ms"], run_record["repeat"]))
+    output_file.write((TEXT_COLUMNS_FORMAT % ("benchmark", "queries", "parse ms", "search ms", "output ms", "us/query", "nodes", "vs earlier" if compare else "")).rstrip() + "\n")
+
+def write_text_record(output_file, record):
+    baseline = ""
+    if "speedup" in record:
+        baseline = "%.2fx" % record["speedup"]
+    output_file.write((TEXT_COLUMNS_FORMAT % (
+            record["benchmark"],
+            record["queries"],
+            "%.3f" % record["parse_ms"],
+            "%.3f" % record["search_ms"],
+            "%.3f" % record["output_ms"],
+            "%.3f" % record["us_per_query"],
+            record["nodes_visited"],
+            baseline)).rstrip() + "\n")
+
+def run(argv):
+    load_start_time = time.perf_counter()
+    options, args = wizardry_monster_id.separate_options_from_args(
+            argv,
+            extra_value_options={"sizes", "seed", "repeat", "only", "format", "output", "compare", "write-corpus"})
+    if len(args) > 0:
+        if wizardry_monster_id.user_is_asking_for_help(args[0]):
+            show_usage()
+            return
+        raise wizardry_monster_id.InvalidOptionError("error : unexpected argument '%s'\n" % args[0])
+    output_format = parse_choice_option(options, "format", ("text", "json"), "text")
+    baseline_totals = None
+    if "compare" in options:
+        baseline_totals = read_baseline_totals(options["compare"])
+    monster_data = wizardry_monster_id.load_monster_data_for_command_line()
+    identifier = wizardry_monster_id.Identifier(dict(options, stats=True), monster_data, "bench")
+    run_record = construct_run_record(argv, options, time.perf_counter() - load_start_time)
+    output_file = sys.stdout
+    if "output" in options:
+        output_file = open(options["output"], 'w')
+    try:
+        if output_format == "json":
+            output_file.write(json.dumps(run_record) + "\n")
+        else:
+            write_text_header(output_file, run_record, baseline_totals is not None)
+        output_file.flush()
+        for record in run_benchmarks(options, identifier, monster_data["monster_map"]):
+            if baseline_totals is not None and record["benchmark"] in baseline_totals and record["total_ms"] > 0:
+                record["baseline_total_ms"] = baseline_totals[record["benchmark"]]
+                record["speedup"] = round(record["baseline_total_ms"] / record["total_ms"], 3)
+            if output_format == "json":
+                output_file.write(json.dumps(record) + "\n")
+            else:
+                write_text_record(output_file, record)
+            output_file.flush()
+    finally:
+        if output_file is not sys.stdout:
+            output_file.close()
+
+def main():
+    try:
+        run(sys.argv[1:])
+    except wizardry_monster_id.InvalidOptionError as e:
+        sys.stderr.write(str(e))
+        sys.stderr.write("running this program with the argument help will print a description of usage.\n")
+        sys.exit(2)
+    except wizardry_monster_id.StaleIndexError as e:
+        sys.stderr.write(str(e))
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()